@@ -0,0 +1,268 @@
+from io import BytesIO
+from typing import Callable, Dict, Optional
+
+from asgiref.sync import sync_to_async
+from django.db.models import QuerySet
+from django.http import Http404, HttpRequest, HttpResponse
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.request import Request
+from rest_framework.views import exception_handler
+
+from app.caches import wealth_cache
+from app.filters import is_wealth_included
+from app.idempotency import async_idempotent
+from app.middleware import timed
+from app.models import ArchivedMoneyBox, MoneyBox
+from app.pagination import MoneyBoxCursorPagination
+from app.parsers import CamelCaseORJSONParser
+from app.renderers import CamelCaseORJSONRenderer
+from app.routers import stick_to_primary, use_replica
+from app.serializers import (
+    MoneyBoxContentSerializer,
+    MoneyBoxFinalWealthSerializer,
+    MoneyBoxSerializer,
+    MoneyBoxWealthSerializer,
+    MoneyBoxWithWealthSerializer,
+)
+from app.views import MoneyBoxBrokenError, MoneyBoxConditionalMixin, MoneyBoxViewSet
+
+
+class AsyncMoneyBoxViewSet(MoneyBoxConditionalMixin):
+    """
+    Native async counterpart of the list, retrieve, shake, save and break actions of MoneyBoxViewSet
+    for ASGI deployments, the database is queried through the async ORM API so a worker keeps serving
+    other requests while one waits on the database. The responses are the same as the MoneyBoxViewSet ones,
+    the list and retrieve actions accept the same query parameters.
+    """
+    renderer = CamelCaseORJSONRenderer()
+    parser = CamelCaseORJSONParser()
+    # Read-only actions reading from a replica, see app.routers
+    replica_actions = {'list', 'retrieve', 'shake'}
+    # The list and retrieve actions are filtered, ordered and paginated like the MoneyBoxViewSet ones,
+    # the filter backends and the pagination read these attributes from the view
+    queryset = MoneyBoxViewSet.queryset
+    filter_backends = MoneyBoxViewSet.filter_backends
+    ordering_fields = MoneyBoxViewSet.ordering_fields
+    ordering = MoneyBoxViewSet.ordering
+
+    @classmethod
+    def as_view(cls, actions: Dict[str, str]) -> Callable:
+        """
+        Build the async view dispatching the request to the action bound to its HTTP method.
+        Args:
+            actions (Dict[str, str]): The action name by lowercase HTTP method, e.g. {'get': 'shake'}.
+        Returns:
+            Callable: The async view.
+        """
+        async def view(request: HttpRequest, *args, **kwargs) -> HttpResponse:
+            action_name = actions.get(request.method.lower())
+            if action_name is None:
+                return cls.render(
+                    {'detail': f'Method "{request.method}" not allowed.'},
+                    status=status.HTTP_405_METHOD_NOT_ALLOWED,
+                )
+            if action_name in cls.replica_actions:
+                with use_replica(request):
+                    return await cls.run_action(action_name, request, *args, **kwargs)
+            response = await cls.run_action(action_name, request, *args, **kwargs)
+            if request.method not in SAFE_METHODS:
+                stick_to_primary(response)
+            return response
+
+        # Like the DRF views, the API does not rely on the CSRF protection of the session authentication
+        view.csrf_exempt = True
+        return view
+
+    @classmethod
+    async def run_action(cls, action_name: str, request: HttpRequest, *args, **kwargs) -> HttpResponse:
+        """
+        Run an action, rendering its API errors like the DRF views do.
+        Args:
+            action_name (str): The name of the action.
+            request (HttpRequest): Django request object.
+        Returns:
+            HttpResponse: The Django response object.
+        """
+        try:
+            return await getattr(cls(), action_name)(request, *args, **kwargs)
+        except (APIException, Http404) as error:
+            error_response = exception_handler(error, {})
+            return cls.render(error_response.data, status=error_response.status_code)
+
+    @classmethod
+    def render(cls, data, status: int = status.HTTP_200_OK, headers: Optional[dict] = None) -> HttpResponse:
+        """
+        Render data as the camelCase JSON response the DRF views would send.
+        Args:
+            data: The data to render.
+            status (int): The status code of the response.
+            headers (Optional[dict]): The headers of the response.
+        Returns:
+            HttpResponse: The Django response object.
+        """
+        with timed('render'):
+            content = cls.renderer.render(data)
+        return HttpResponse(
+            content,
+            status=status,
+            headers=headers,
+            content_type=cls.renderer.media_type,
+        )
+
+    def filter_queryset(self, request: Request) -> QuerySet:
+        """
+        Filter the money boxes with the filter backends of MoneyBoxViewSet, which only build the queryset.
+        Args:
+            request (Request): DRF request object.
+        Returns:
+            QuerySet: The filtered money boxes.
+        """
+        queryset = self.queryset.all()
+        for backend in self.filter_backends:
+            queryset = backend().filter_queryset(request, queryset, self)
+        return queryset
+
+    async def get_money_box(
+        self, pk: int, allow_broken: bool = False, queryset: Optional[QuerySet] = None,
+    ) -> MoneyBox:
+        """
+        Get a MoneyBox instance by its primary key, the money boxes archived once broken are read from the archive.
+        Args:
+            pk (int): Primary key of the MoneyBox instance.
+            allow_broken (bool): Whether a broken money box can be returned.
+            queryset (Optional[QuerySet]): The money boxes to look the money box up in, all of them by default.
+        Returns:
+            MoneyBox: MoneyBox instance.
+        """
+        if queryset is None:
+            queryset = MoneyBox.objects.all()
+        try:
+            money_box = await queryset.aget(id=pk)
+        except MoneyBox.DoesNotExist:
+            money_box = await ArchivedMoneyBox.aget_money_box(pk)
+            if money_box is None:
+                raise Http404
+        if money_box.broken and not allow_broken:
+            raise MoneyBoxBrokenError
+        return money_box
+
+    async def list(self, request: HttpRequest) -> HttpResponse:
+        """
+        List the money boxes page by page, see MoneyBoxViewSet.list.
+        Args:
+            request (HttpRequest): Django request object.
+        Returns:
+            HttpResponse: The page of money boxes serialized with MoneyBoxSerializer, or MoneyBoxWithWealthSerializer.
+        """
+        drf_request = Request(request)
+        paginator = MoneyBoxCursorPagination()
+        page_queryset = paginator.get_page_queryset(self.filter_queryset(drf_request), drf_request, self)
+        page = paginator.set_page([money_box async for money_box in page_queryset])
+        serializer = self.get_serializer_class(drf_request)(page, many=True)
+        return self.render(paginator.get_paginated_response(serializer.data).data)
+
+    async def retrieve(self, request: HttpRequest, pk: int) -> HttpResponse:
+        """
+        Retrieve the basic data of a money box, see MoneyBoxViewSet.retrieve.
+        Args:
+            request (HttpRequest): Django request object.
+            pk (int): Primary key of the MoneyBox instance.
+        Returns:
+            HttpResponse: The money box serialized with MoneyBoxSerializer, or MoneyBoxWithWealthSerializer.
+        """
+        drf_request = Request(request)
+        money_box = await self.get_money_box(pk, allow_broken=True, queryset=self.filter_queryset(drf_request))
+        not_modified_response = self.get_not_modified_response(request, money_box)
+        if not_modified_response is not None:
+            return not_modified_response
+        serializer = self.get_serializer_class(drf_request)(money_box)
+        return self.set_conditional_headers(self.render(serializer.data), money_box)
+
+    async def shake(self, request: HttpRequest, pk: int) -> HttpResponse:
+        """
+        Retrieve the wealth of a money box, see MoneyBoxViewSet.shake.
+        Args:
+            request (HttpRequest): Django request object.
+            pk (int): Primary key of the MoneyBox instance.
+        Returns:
+            HttpResponse: The wealth data serialized with MoneyBoxWealthSerializer.
+        """
+        money_box = await self.get_money_box(pk)
+        not_modified_response = self.get_not_modified_response(request, money_box)
+        if not_modified_response is not None:
+            return not_modified_response
+        wealth_data = await wealth_cache.aget(money_box)
+        cache_status = 'HIT'
+        if wealth_data is None:
+            await money_box.aload_contents()
+            wealth_data = await self.serialize_wealth(money_box)
+            await wealth_cache.aset(money_box, wealth_data)
+            cache_status = 'MISS'
+        response = self.render(wealth_data, headers={'X-Cache': cache_status})
+        return self.set_conditional_headers(response, money_box)
+
+    @async_idempotent
+    async def save(self, request: HttpRequest, pk: int) -> HttpResponse:
+        """
+        Add cashes to a money box, see MoneyBoxViewSet.save.
+        Args:
+            request (HttpRequest): Django request object.
+            pk (int): Primary key of the MoneyBox instance.
+        Returns:
+            HttpResponse: The wealth data serialized with MoneyBoxWealthSerializer.
+        """
+        money_box = await self.get_money_box(pk)
+        request_data = self.parser.parse(BytesIO(request.body))
+        cashes_to_add_serializer = MoneyBoxContentSerializer(data=request_data['cashes'], many=True)
+        # The validation looks the cash up in the cash registry which may have to reload it from the database
+        if not await sync_to_async(cashes_to_add_serializer.is_valid)():
+            errors = [error for error in cashes_to_add_serializer.errors if 'cashes' in error][0]
+            return self.render(errors, status=status.HTTP_400_BAD_REQUEST)
+        if not await money_box.asave_money(cashes_to_add_serializer.data):
+            raise MoneyBoxBrokenError
+        await money_box.aload_contents()
+        wealth_data = await self.serialize_wealth(money_box)
+        await wealth_cache.aset(money_box, wealth_data)
+        return self.render(wealth_data, status=status.HTTP_201_CREATED)
+
+    @async_idempotent
+    async def break_moneybox(self, request: HttpRequest, pk: int) -> HttpResponse:
+        """
+        Break a money box, see MoneyBoxViewSet.break_moneybox.
+        Args:
+            request (HttpRequest): Django request object.
+            pk (int): Primary key of the MoneyBox instance.
+        Returns:
+            HttpResponse: The final wealth data serialized with MoneyBoxFinalWealthSerializer.
+        """
+        money_box = await self.get_money_box(pk)
+        await money_box.abreak_moneybox()
+        # The final contents are built with the Cash objects of the cash registry, which may have to reload it
+        return self.render(await sync_to_async(lambda: MoneyBoxFinalWealthSerializer(money_box).data)())
+
+    @staticmethod
+    def get_serializer_class(request: Request) -> type:
+        """
+        Get the serializer class of the list and retrieve actions, see MoneyBoxViewSet.get_serializer_class.
+        Args:
+            request (Request): DRF request object.
+        Returns:
+            type: MoneyBoxWithWealthSerializer if the wealth was requested, MoneyBoxSerializer otherwise.
+        """
+        return MoneyBoxWithWealthSerializer if is_wealth_included(request) else MoneyBoxSerializer
+
+    async def serialize_wealth(self, money_box: MoneyBox) -> dict:
+        """
+        Serialize the wealth data of a money box whose contents are loaded.
+        In the sharded and ledger deposit modes the pending amounts are merged with the Cash objects of the cash
+        registry, which may have to reload it from the database.
+        Args:
+            money_box (MoneyBox): MoneyBox instance.
+        Returns:
+            dict: The MoneyBoxWealthSerializer data.
+        """
+        if money_box.pending_amounts:
+            return await sync_to_async(lambda: MoneyBoxWealthSerializer(money_box).data)()
+        return MoneyBoxWealthSerializer(money_box).data
@@ -0,0 +1,358 @@
+import asyncio
+import json
+import random
+import statistics
+import time
+from contextlib import ExitStack, contextmanager
+from io import BytesIO
+from threading import Thread
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import connection, connections
+from django.test import AsyncClient, Client
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+from djangorestframework_camel_case.parser import CamelCaseJSONParser
+from djangorestframework_camel_case.render import CamelCaseJSONRenderer
+from rest_framework import serializers
+from rest_framework.reverse import reverse
+from rest_framework.test import APIClient
+
+from app.caches import wealth_cache
+from app.middleware import RequestMetrics
+from app.models import Cash, MoneyBox, MoneyBoxContent, MoneyBoxContentShard
+from app.parsers import CamelCaseORJSONParser
+from app.renderers import CamelCaseORJSONRenderer
+from app.serializers import MoneyBoxWealthSerializer
+
+
+@contextmanager
+def benchmark_database() -> Iterator[None]:
+    """
+    Run the benchmarks against a throwaway test database created from the configured settings profile,
+    so they never touch the data of the configured database.
+    """
+    setup_test_environment()
+    old_config = setup_databases(verbosity=0, interactive=False)
+    try:
+        yield
+    finally:
+        teardown_databases(old_config, verbosity=0)
+        teardown_test_environment()
+
+
+def summarize_latencies(latencies: List[float]) -> Dict[str, float]:
+    """
+    Summarize latencies in milliseconds with their percentiles.
+    Args:
+        latencies (List[float]): The latencies in seconds.
+    Returns:
+        Dict[str, float]: The count, mean, p50, p95, p99 and max latencies in milliseconds.
+    """
+    latencies_ms = sorted(latency * 1000 for latency in latencies)
+    quantiles = statistics.quantiles(latencies_ms, n=100, method='inclusive') if len(latencies_ms) > 1 else [
+        latencies_ms[0]
+    ] * 99
+    return {
+        'count': len(latencies_ms),
+        'mean_ms': round(statistics.fmean(latencies_ms), 3),
+        'p50_ms': round(quantiles[49], 3),
+        'p95_ms': round(quantiles[94], 3),
+        'p99_ms': round(quantiles[98], 3),
+        'max_ms': round(latencies_ms[-1], 3),
+    }
+
+
+def run_wsgi_requests(urls: List[str], concurrency: int) -> Dict[str, float]:
+    """
+    Send GET requests through the WSGI handler from a pool of threads, like a threaded WSGI server would.
+    Args:
+        urls (List[str]): The URLs to request.
+        concurrency (int): The number of threads.
+    Returns:
+        Dict[str, float]: The throughput in requests per second and the latencies summary.
+    """
+    latencies = []
+
+    def send_requests(thread_urls: List[str]) -> None:
+        client = Client()
+        try:
+            for url in thread_urls:
+                start = time.perf_counter()
+                response = client.get(url)
+                latencies.append(time.perf_counter() - start)
+                assert response.status_code == 200, response.status_code
+        finally:
+            connections.close_all()
+
+    threads = [Thread(target=send_requests, args=(urls[index::concurrency],)) for index in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return {'requests_per_second': round(len(latencies) / elapsed, 1), **summarize_latencies(latencies)}
+
+
+def run_asgi_requests(urls: List[str], concurrency: int) -> Dict[str, float]:
+    """
+    Send GET requests through the ASGI handler from a single event loop, with at most concurrency in flight.
+    Args:
+        urls (List[str]): The URLs to request.
+        concurrency (int): The maximum number of concurrent requests.
+    Returns:
+        Dict[str, float]: The throughput in requests per second and the latencies summary.
+    """
+    latencies = []
+
+    async def send_requests() -> None:
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def send_request(url: str) -> None:
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.get(url)
+                latencies.append(time.perf_counter() - start)
+                assert response.status_code == 200, response.status_code
+
+        await asyncio.gather(*(send_request(url) for url in urls))
+
+    start = time.perf_counter()
+    asyncio.run(send_requests())
+    elapsed = time.perf_counter() - start
+    return {'requests_per_second': round(len(latencies) / elapsed, 1), **summarize_latencies(latencies)}
+
+
+class MoneyBoxBenchmarkSuite:
+    """
+    Benchmarks of the MoneyBoxViewSet endpoints and of the MoneyBox and Cash model methods on the hot paths.
+    Each case runs for every number of money boxes and every denomination mix, the money boxes hold one of each cash
+    of the mix. The latency percentiles and the median number of queries of each case are reported.
+    """
+    # Number of distinct cashes held by the money boxes for each denomination mix (None for all the cashes)
+    DENOMINATION_MIXES = {'single': 1, 'mixed': 5, 'all': None}
+
+    def __init__(
+        self,
+        sizes: List[int],
+        mixes: List[str],
+        iterations: int,
+        batch_size: int = 10000,
+        log: Optional[Callable[[str], None]] = None,
+    ):
+        self.sizes = sorted(sizes)
+        self.mixes = mixes
+        self.iterations = iterations
+        self.batch_size = batch_size
+        self.log = log or (lambda message: None)
+        self.client = APIClient()
+        self.random = random.Random(0)
+
+    def run(self) -> dict:
+        """
+        Run every case of the suite.
+        Returns:
+            dict: The profile the suite ran with and the results of the cases, keyed by case, size and mix.
+        """
+        results = {}
+        for mix in self.mixes:
+            self.clear_money_boxes()
+            money_box_ids = []
+            for size in self.sizes:
+                # The money boxes of a size are reused by the next larger size of the same mix
+                money_box_ids += self.populate(size - len(money_box_ids), mix)
+                for name, setup, run in self.get_cases(money_box_ids, mix):
+                    key = f'{name}[boxes={size},mix={mix}]'
+                    self.log(f'Running {key}')
+                    results[key] = self.measure(setup, run)
+        return {
+            'profile': {
+                'vendor': connection.vendor,
+                'settings': settings.SETTINGS_MODULE,
+                'deposit_mode': settings.MONEYBOX_DEPOSIT_MODE,
+                'iterations': self.iterations,
+            },
+            'results': results,
+        }
+
+    def get_mix_cashes(self, mix: str) -> List[Cash]:
+        return Cash.get_all()[:self.DENOMINATION_MIXES[mix]]
+
+    def get_cashes_to_add(self, mix: str) -> List[dict]:
+        return [
+            {'cash_type': cash.cash_type, 'value': str(cash.value), 'amount': 1} for cash in self.get_mix_cashes(mix)
+        ]
+
+    def populate(self, count: int, mix: str) -> List[int]:
+        """
+        Create money boxes holding one of each cash of the denomination mix, with bulk inserts.
+        Args:
+            count (int): Number of money boxes to create.
+            mix (str): Name of the denomination mix.
+        Returns:
+            List[int]: The ids of the money boxes created.
+        """
+        cashes = self.get_mix_cashes(mix)
+        wealth_minor = sum(cash.minor_value for cash in cashes)
+        money_box_ids = []
+        for start in range(0, count, self.batch_size):
+            money_boxes = MoneyBox.objects.bulk_create([
+                MoneyBox(name=f'Benchmark {mix} {start + index}', wealth_minor=wealth_minor)
+                for index in range(min(self.batch_size, count - start))
+            ])
+            MoneyBoxContent.objects.bulk_create([
+                MoneyBoxContent(money_box=money_box, cash=cash, amount=1)
+                for money_box in money_boxes
+                for cash in cashes
+            ])
+            money_box_ids += [money_box.id for money_box in money_boxes]
+        return money_box_ids
+
+    @staticmethod
+    def clear_money_boxes() -> None:
+        MoneyBoxContent.objects.all().delete()
+        MoneyBoxContentShard.objects.all().delete()
+        MoneyBox.objects.all().delete()
+        wealth_cache.backend.clear()
+
+    def get_cases(self, money_box_ids: List[int], mix: str) -> List[Tuple[str, Callable, Callable]]:
+        """
+        Build the cases to run on the money boxes.
+        Args:
+            money_box_ids (List[int]): The ids of the money boxes.
+            mix (str): Name of the denomination mix.
+        Returns:
+            List[Tuple[str, Callable, Callable]]: The name, the untimed setup and the timed run of each case.
+        """
+        cashes_to_add = self.get_cashes_to_add(mix)
+        cash = self.get_mix_cashes(mix)[-1]
+        state = {}
+
+        def pick_money_box() -> None:
+            state['money_box_id'] = self.random.choice(money_box_ids)
+
+        def pick_uncached_money_box() -> None:
+            pick_money_box()
+            wealth_cache.delete_many([state['money_box_id']])
+
+        def pick_money_box_instance() -> None:
+            pick_money_box()
+            state['money_box'] = MoneyBox.objects.get(id=state['money_box_id'])
+
+        def load_money_box() -> None:
+            pick_money_box()
+            state['money_box'] = (
+                MoneyBox.objects.prefetch_related(MoneyBox.ordered_contents_prefetch()).get(id=state['money_box_id'])
+            )
+
+        def make_money_box_to_break() -> None:
+            state['money_box_id'] = self.populate(1, mix)[0]
+
+        def load_list_payload() -> None:
+            # The wealth data of every money box, built once for the size
+            if 'list_payload' not in state:
+                state['list_payload'] = MoneyBoxWealthSerializer(
+                    MoneyBox.objects.prefetch_related(MoneyBox.ordered_contents_prefetch()).order_by('id'),
+                    many=True,
+                ).data
+
+        def load_bulk_payload() -> None:
+            # A bulk save request body with camelCase keys depositing in every money box, built once for the size
+            if 'bulk_payload' not in state:
+                state['bulk_payload'] = json.dumps({'deposits': [
+                    {'moneyboxId': money_box_id, 'cashes': [
+                        {'cashType': cash['cash_type'], 'value': cash['value'], 'amount': cash['amount']}
+                        for cash in cashes_to_add
+                    ]}
+                    for money_box_id in money_box_ids
+                ]}).encode()
+
+        def request(method: str, url_name: str, data: Optional[dict] = None, detail: bool = True) -> Callable:
+            def run() -> None:
+                url = reverse(url_name, args=(state['money_box_id'],) if detail else ())
+                response = getattr(self.client, method)(url, data, format='json')
+                assert response.status_code < 300, f'{url} returned {response.status_code}'
+            return run
+
+        return [
+            ('api.create', None, request('post', 'api:moneyboxes-list', {'name': 'Benchmark'}, detail=False)),
+            ('api.list', None, request('get', 'api:moneyboxes-list', detail=False)),
+            ('api.shake', pick_uncached_money_box, request('get', 'api:moneyboxes-shake')),
+            ('api.save', pick_money_box, request('post', 'api:moneyboxes-save', {'cashes': cashes_to_add})),
+            ('api.break', make_money_box_to_break, request('delete', 'api:moneyboxes-break')),
+            ('api.statistics', None, request('get', 'api:moneyboxes-statistics', detail=False)),
+            ('serializer.wealth', load_money_box, lambda: MoneyBoxWealthSerializer(state['money_box']).data),
+            # The same data built by the declared fields, as DRF does by default, to compare with serializer.wealth
+            (
+                'serializer.wealth.fields',
+                load_money_box,
+                lambda: serializers.ModelSerializer.to_representation(
+                    MoneyBoxWealthSerializer(state['money_box']), state['money_box'],
+                ),
+            ),
+            ('renderer.list', load_list_payload, lambda: CamelCaseORJSONRenderer().render(state['list_payload'])),
+            # The renderer and parser of djangorestframework_camel_case, to compare with renderer.list and parser.bulk
+            (
+                'renderer.list.library',
+                load_list_payload,
+                lambda: CamelCaseJSONRenderer().render(state['list_payload']),
+            ),
+            ('parser.bulk', load_bulk_payload, lambda: CamelCaseORJSONParser().parse(BytesIO(state['bulk_payload']))),
+            (
+                'parser.bulk.library',
+                load_bulk_payload,
+                lambda: CamelCaseJSONParser().parse(BytesIO(state['bulk_payload'])),
+            ),
+            ('model.save_money', pick_money_box_instance, lambda: state['money_box'].save_money(cashes_to_add)),
+            ('model.wealth', pick_money_box, lambda: MoneyBox.objects.get(id=state['money_box_id']).wealth),
+            ('model.find_from_type_and_value', None, lambda: Cash.find_from_type_and_value(cash.cash_type, cash.value)),
+        ]
+
+    def measure(self, setup: Optional[Callable], run: Callable) -> dict:
+        """
+        Time a case and count its queries over the iterations of the suite.
+        Args:
+            setup (Optional[Callable]): Untimed preparation of each iteration.
+            run (Callable): Timed code of each iteration.
+        Returns:
+            dict: The latencies summary and the median number of queries.
+        """
+        latencies, query_counts = [], []
+        for _ in range(self.iterations):
+            if setup is not None:
+                setup()
+            metrics = RequestMetrics()
+            with ExitStack() as stack:
+                for database_connection in connections.all():
+                    stack.enter_context(database_connection.execute_wrapper(metrics))
+                start = time.perf_counter()
+                run()
+                latencies.append(time.perf_counter() - start)
+            query_counts.append(metrics.query_count)
+        return {**summarize_latencies(latencies), 'queries': statistics.median_low(query_counts)}
+
+
+def compare_with_baseline(report: dict, baseline: dict, tolerance: float) -> List[str]:
+    """
+    Find the cases of a benchmark report that regressed against a baseline report.
+    A case regresses when its median latency exceeds the baseline one by more than the tolerance, or when it runs
+    more queries than in the baseline. The cases missing from one of the reports are ignored.
+    Args:
+        report (dict): The benchmark report.
+        baseline (dict): The baseline benchmark report.
+        tolerance (float): The accepted relative increase of the median latency (e.g. 0.2 for 20%).
+    Returns:
+        List[str]: A description of each regression.
+    """
+    regressions = []
+    for key, result in report['results'].items():
+        baseline_result = baseline['results'].get(key)
+        if baseline_result is None:
+            continue
+        if result['p50_ms'] > baseline_result['p50_ms'] * (1 + tolerance):
+            regressions.append(f"{key}: p50 {result['p50_ms']}ms, baseline {baseline_result['p50_ms']}ms")
+        if result['queries'] > baseline_result['queries']:
+            regressions.append(f"{key}: {result['queries']} queries, baseline {baseline_result['queries']}")
+    return regressions
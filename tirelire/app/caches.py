@@ -0,0 +1,172 @@
+import logging
+from threading import Lock
+from time import monotonic
+from typing import Dict, Iterable, Optional
+
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+
+class WealthResponseCache:
+    """
+    Cache of the MoneyBoxWealthSerializer data of the money boxes, working with any Django cache backend.
+    Each entry is stored under the money box id along with the money box ETag, an entry whose ETag differs from
+    the money box one is a miss, so a worker can never serve the data of an older version.
+    The entries are rewritten by the views after a save and invalidated by save_money and break_moneybox.
+    The hits and misses are counted by each worker and added to counters of the backend, shared by the workers,
+    every MONEYBOX_WEALTH_CACHE_STATS_FLUSH_INTERVAL seconds at most, the totals are then logged.
+    """
+    KEY_PREFIX = 'moneybox-wealth'
+    COUNTERS = ('hits', 'misses')
+
+    def __init__(self):
+        self._counters_lock = Lock()
+        # Hits and misses of this worker not added to the counters of the backend yet
+        self._pending_counts = dict.fromkeys(self.COUNTERS, 0)
+        self._last_flush = monotonic()
+
+    @property
+    def backend(self):
+        return caches[settings.MONEYBOX_WEALTH_CACHE_ALIAS]
+
+    @property
+    def enabled(self) -> bool:
+        """
+        Whether the cache is used, it is disabled in the sharded and ledger deposit modes where deposits do not bump
+        the ETag.
+        Returns:
+            bool: True if the cache is used.
+        """
+        # Imported here as the models import this module
+        from app.models import MoneyBox
+
+        return settings.MONEYBOX_DEPOSIT_MODE == MoneyBox.DepositModeChoice.ATOMIC
+
+    def make_key(self, money_box_id: int) -> str:
+        return f'{self.KEY_PREFIX}:{money_box_id}'
+
+    def get(self, money_box) -> Optional[dict]:
+        """
+        Get the cached wealth data of a money box.
+        Args:
+            money_box (MoneyBox): MoneyBox instance.
+        Returns:
+            Optional[dict]: The wealth data, or None on a miss.
+        """
+        entry = self.backend.get(self.make_key(money_box.id)) if self.enabled else None
+        data = self._read_entry(money_box, entry)
+        counts = self._take_counts_to_flush()
+        if counts is not None:
+            self._log_counters({name: self._add_to_counter(name, count) for name, count in counts.items()})
+        return data
+
+    async def aget(self, money_box) -> Optional[dict]:
+        """
+        Async version of get.
+        Args:
+            money_box (MoneyBox): MoneyBox instance.
+        Returns:
+            Optional[dict]: The wealth data, or None on a miss.
+        """
+        entry = await self.backend.aget(self.make_key(money_box.id)) if self.enabled else None
+        data = self._read_entry(money_box, entry)
+        counts = self._take_counts_to_flush()
+        if counts is not None:
+            self._log_counters({name: await self._aadd_to_counter(name, count) for name, count in counts.items()})
+        return data
+
+    def set(self, money_box, data: dict) -> None:
+        """
+        Cache the wealth data of a money box for its current version.
+        Args:
+            money_box (MoneyBox): MoneyBox instance.
+            data (dict): The MoneyBoxWealthSerializer data.
+        Returns:
+            None
+        """
+        if self.enabled:
+            self.backend.set(self.make_key(money_box.id), (money_box.etag, data))
+
+    async def aset(self, money_box, data: dict) -> None:
+        """
+        Async version of set.
+        Args:
+            money_box (MoneyBox): MoneyBox instance.
+            data (dict): The MoneyBoxWealthSerializer data.
+        Returns:
+            None
+        """
+        if self.enabled:
+            await self.backend.aset(self.make_key(money_box.id), (money_box.etag, data))
+
+    def delete_many(self, money_box_ids: Iterable[int]) -> None:
+        """
+        Invalidate the cached wealth data of money boxes.
+        Args:
+            money_box_ids (Iterable[int]): The ids of the money boxes.
+        Returns:
+            None
+        """
+        self.backend.delete_many([self.make_key(money_box_id) for money_box_id in money_box_ids])
+
+    def make_counter_key(self, name: str) -> str:
+        return f'{self.KEY_PREFIX}:stats:{name}'
+
+    def _read_entry(self, money_box, entry: Optional[tuple]) -> Optional[dict]:
+        hit = entry is not None and entry[0] == money_box.etag
+        with self._counters_lock:
+            self._pending_counts['hits' if hit else 'misses'] += 1
+        return entry[1] if hit else None
+
+    def _take_counts_to_flush(self) -> Optional[Dict[str, int]]:
+        """
+        Take the pending counts of this worker once the flush interval is elapsed.
+        Returns:
+            Optional[Dict[str, int]]: The counts to add to the counters of the backend, or None if it is too soon.
+        """
+        with self._counters_lock:
+            now = monotonic()
+            if now - self._last_flush < settings.MONEYBOX_WEALTH_CACHE_STATS_FLUSH_INTERVAL:
+                return None
+            counts = self._pending_counts
+            self._pending_counts = dict.fromkeys(self.COUNTERS, 0)
+            self._last_flush = now
+        return counts
+
+    def _add_to_counter(self, name: str, count: int) -> int:
+        # The counter is created by the first flush, then incremented atomically by the shared backends
+        key = self.make_counter_key(name)
+        if self.backend.add(key, count, timeout=None):
+            return count
+        return self.backend.incr(key, count)
+
+    async def _aadd_to_counter(self, name: str, count: int) -> int:
+        key = self.make_counter_key(name)
+        if await self.backend.aadd(key, count, timeout=None):
+            return count
+        return await self.backend.aincr(key, count)
+
+    @staticmethod
+    def _log_counters(totals: Dict[str, int]) -> None:
+        lookups = totals['hits'] + totals['misses']
+        logger.info(
+            'Wealth cache: %d hits and %d misses', totals['hits'], totals['misses'],
+            extra={**totals, 'hit_ratio': round(totals['hits'] / lookups, 4) if lookups else None},
+        )
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Hit and miss counters of all the workers, with the counts of this worker not added to the backend yet.
+        Returns:
+            Dict[str, int]: The number of hits and misses.
+        """
+        totals = self.backend.get_many([self.make_counter_key(name) for name in self.COUNTERS])
+        with self._counters_lock:
+            return {
+                name: totals.get(self.make_counter_key(name), 0) + self._pending_counts[name] for name in self.COUNTERS
+            }
+
+
+wealth_cache = WealthResponseCache()
@@ -0,0 +1,111 @@
+from functools import lru_cache
+from typing import Any
+
+from django.conf import settings
+from django.core.files import File
+from django.http import QueryDict
+from django.utils.datastructures import MultiValueDict
+from django.utils.encoding import force_str
+from django.utils.functional import Promise
+from djangorestframework_camel_case.settings import api_settings
+from djangorestframework_camel_case.util import camel_to_underscore, camelize_re, is_iterable, underscore_to_camel
+
+# Types returned as they are by camelize and underscoreize, checked before the costly iterable check
+_SCALAR_TYPES = (str, int, float, bool, type(None))
+
+
+@lru_cache(maxsize=settings.JSON_CAMEL_CASE_KEY_CACHE_SIZE)
+def camelize_key(key: str) -> str:
+    """
+    Translate a snake_case key into camelCase like djangorestframework_camel_case does, memoized since
+    the API only uses a few keys.
+    Args:
+        key (str): The snake_case key.
+    Returns:
+        str: The camelCase key.
+    """
+    return camelize_re.sub(underscore_to_camel, key) if '_' in key else key
+
+
+@lru_cache(maxsize=settings.JSON_CAMEL_CASE_KEY_CACHE_SIZE)
+def underscoreize_key(key: str) -> str:
+    """
+    Translate a camelCase key into snake_case like djangorestframework_camel_case does, memoized since
+    the API only uses a few keys.
+    Args:
+        key (str): The camelCase key.
+    Returns:
+        str: The snake_case key.
+    """
+    return camel_to_underscore(key, **api_settings.JSON_UNDERSCOREIZE)
+
+
+def camelize(data: Any) -> Any:
+    """
+    Translate the keys of the dictionaries of some data into camelCase, recursively, with the same result as
+    djangorestframework_camel_case.util.camelize and its JSON_UNDERSCOREIZE settings, but plain dictionaries
+    and memoized keys.
+    Args:
+        data (Any): The data.
+    Returns:
+        Any: The data with camelCase keys.
+    """
+    if isinstance(data, _SCALAR_TYPES):
+        return data
+    if isinstance(data, Promise):
+        return force_str(data)
+    if isinstance(data, dict):
+        ignore_fields = api_settings.JSON_UNDERSCOREIZE['ignore_fields'] or ()
+        ignore_keys = api_settings.JSON_UNDERSCOREIZE['ignore_keys'] or ()
+        new_dict = {}
+        for key, value in data.items():
+            if isinstance(key, Promise):
+                key = force_str(key)
+            new_key = camelize_key(key) if isinstance(key, str) else key
+            if ignore_fields and (key in ignore_fields or new_key in ignore_fields):
+                result = value
+            else:
+                result = camelize(value)
+            new_dict[key if ignore_keys and (key in ignore_keys or new_key in ignore_keys) else new_key] = result
+        return new_dict
+    if isinstance(data, (list, tuple)) or is_iterable(data):
+        return [camelize(item) for item in data]
+    return data
+
+
+def underscoreize(data: Any) -> Any:
+    """
+    Translate the keys of the dictionaries of some data into snake_case, recursively, with the same result as
+    djangorestframework_camel_case.util.underscoreize and its JSON_UNDERSCOREIZE settings, but memoized keys.
+    Args:
+        data (Any): The data.
+    Returns:
+        Any: The data with snake_case keys.
+    """
+    if isinstance(data, _SCALAR_TYPES):
+        return data
+    if isinstance(data, dict):
+        if type(data) is MultiValueDict:
+            new_data = MultiValueDict()
+            for key in data:
+                new_data.setlist(underscoreize_key(key), data.getlist(key))
+            return new_data
+        ignore_fields = api_settings.JSON_UNDERSCOREIZE['ignore_fields'] or ()
+        ignore_keys = api_settings.JSON_UNDERSCOREIZE['ignore_keys'] or ()
+        new_dict = {}
+        for key, value in (data.lists() if isinstance(data, QueryDict) else data.items()):
+            new_key = underscoreize_key(key) if isinstance(key, str) else key
+            if ignore_fields and (key in ignore_fields or new_key in ignore_fields):
+                result = value
+            else:
+                result = underscoreize(value)
+            new_dict[key if ignore_keys and (key in ignore_keys or new_key in ignore_keys) else new_key] = result
+        if isinstance(data, QueryDict):
+            new_query = QueryDict(mutable=True)
+            for key, value in new_dict.items():
+                new_query.setlist(key, value)
+            return new_query
+        return new_dict
+    if isinstance(data, list) or (is_iterable(data) and not isinstance(data, File)):
+        return [underscoreize(item) for item in data]
+    return data
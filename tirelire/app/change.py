@@ -0,0 +1,133 @@
+from math import ceil, gcd, inf, lcm
+from typing import Dict, List, Optional, Set, Tuple
+
+# Largest modulus of the residue sets of make_change, which are stored as bit sets of this many bits
+MAX_RESIDUE_MODULUS = 1 << 20
+
+
+def make_change(amount: int, available: Dict[int, int]) -> Optional[Dict[int, int]]:
+    """
+    Pick pieces adding up exactly to an amount with as few pieces as possible, from a limited number of pieces
+    of each denomination (the bounded change-making problem).
+    It is a depth-first branch and bound over the denominations from the largest one, trying the largest count
+    of each denomination first: the first solution found is the greedy one, which is optimal for canonical
+    systems such as the euro while the pieces available do not run out. The other branches are pruned with
+    the lower bound of the fractional relaxation, with the residues the smaller denominations can make modulo
+    the least common multiple of the denominations, and with the remainders already proven unreachable,
+    instead of filling a table as large as the amount.
+    Args:
+        amount (int): The amount to make, in minor units.
+        available (Dict[int, int]): The number of pieces available by denomination, in minor units.
+    Returns:
+        Optional[Dict[int, int]]: The number of pieces picked by denomination, only the denominations picked,
+        or None if the amount cannot be made from the pieces available.
+    """
+    denominations = sorted((value for value, count in available.items() if value > 0 and count > 0), reverse=True)
+    counts = [min(available[value], amount // value) for value in denominations]
+    modulus = lcm(*denominations) if denominations else 1
+    if modulus > MAX_RESIDUE_MODULUS:
+        # Every residue is reachable modulo 1, which disables this pruning
+        modulus = 1
+    # Total value of the pieces, and bit set of the residues they can make, from each denomination to the smallest
+    suffix_values = [0] * (len(denominations) + 1)
+    suffix_residues = [1] * (len(denominations) + 1)
+    for index in range(len(denominations) - 1, -1, -1):
+        suffix_values[index] = suffix_values[index + 1] + denominations[index] * counts[index]
+        suffix_residues[index] = _add_residues(suffix_residues[index + 1], denominations[index], counts[index], modulus)
+    if not suffix_residues[0] >> (amount % modulus) & 1:
+        return None
+    search = _ChangeSearch(denominations, counts, suffix_values, suffix_residues, modulus)
+    search.run(0, amount, 0)
+    if search.best is None:
+        return None
+    return {value: count for value, count in zip(denominations, search.best) if count}
+
+
+def _add_residues(residues: int, value: int, count: int, modulus: int) -> int:
+    """
+    Add up to count pieces of a denomination to the sums of a bit set of residues, splitting the count
+    in powers of two so it takes a logarithmic number of rotations.
+    """
+    all_residues = (1 << modulus) - 1
+    # The residues of the multiples of the value repeat after this many pieces
+    count = min(count, modulus // gcd(value, modulus) - 1)
+    size = 1
+    while count > 0 and residues != all_residues:
+        taken = min(size, count)
+        shift = taken * value % modulus
+        residues |= ((residues << shift) | (residues >> (modulus - shift))) & all_residues
+        count -= taken
+        size *= 2
+    return residues
+
+
+class _ChangeSearch:
+    """
+    State of the branch and bound search of make_change.
+    """
+
+    def __init__(
+        self,
+        denominations: List[int],
+        counts: List[int],
+        suffix_values: List[int],
+        suffix_residues: List[int],
+        modulus: int,
+    ):
+        self.denominations = denominations
+        self.counts = counts
+        self.suffix_values = suffix_values
+        self.suffix_residues = suffix_residues
+        self.modulus = modulus
+        self.chosen = [0] * len(denominations)
+        self.best: Optional[List[int]] = None
+        self.best_pieces = inf
+        self.unreachable: Set[Tuple[int, int]] = set()
+
+    def lower_bound(self, index: int, remaining: int) -> float:
+        """
+        Minimum number of pieces making the remaining amount from the given denomination, if the last piece
+        could be split. It grows by at least one piece when the remaining amount grows by a larger denomination,
+        so a count of the larger denomination failing this bound lets the smaller counts fail it too.
+        """
+        pieces = 0
+        for value, count in zip(self.denominations[index:], self.counts[index:]):
+            if remaining <= value * count:
+                return pieces + ceil(remaining / value)
+            pieces += count
+            remaining -= value * count
+        return inf if remaining else pieces
+
+    def run(self, index: int, remaining: int, pieces: int) -> bool:
+        """
+        Search the pieces making the remaining amount from the given denomination.
+        Returns:
+            bool: False if the remaining amount is proven unreachable from this denomination, True otherwise.
+        """
+        if remaining == 0:
+            if pieces < self.best_pieces:
+                self.best_pieces = pieces
+                self.best = list(self.chosen)
+            return True
+        if remaining > self.suffix_values[index] or (index, remaining) in self.unreachable:
+            return False
+        value = self.denominations[index]
+        next_residues = self.suffix_residues[index + 1]
+        # The smaller denominations cannot make more than their total value
+        lowest_count = max(0, -(-(remaining - self.suffix_values[index + 1]) // value))
+        reachable = False
+        for count in range(min(self.counts[index], remaining // value), lowest_count - 1, -1):
+            rest = remaining - count * value
+            if not next_residues >> (rest % self.modulus) & 1:
+                # The smaller denominations cannot make this remainder whatever their counts
+                continue
+            if pieces + count + self.lower_bound(index + 1, rest) >= self.best_pieces:
+                # Not proven unreachable, only not better than the best solution found
+                reachable = True
+                break
+            self.chosen[index] = count
+            reachable = self.run(index + 1, rest, pieces + count) or reachable
+        self.chosen[index] = 0
+        if not reachable:
+            self.unreachable.add((index, remaining))
+        return reachable
@@ -0,0 +1,134 @@
+import csv
+import json
+from itertools import groupby, islice
+from operator import itemgetter
+from typing import AsyncIterator, Iterator, List, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from rest_framework import serializers
+
+from app.camel_case import camelize
+from app.models import Cash, MoneyBox
+
+# Content type of each export format
+EXPORT_CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+CSV_HEADER = [
+    'id', 'name', 'createdAt', 'updatedAt', 'broken', 'wealth', 'cashType', 'currency', 'value', 'amount',
+]
+
+
+class _EchoBuffer:
+    """
+    File-like object returning what is written to it, so the csv module can format rows one at a time.
+    """
+
+    def write(self, value: str) -> str:
+        return value
+
+
+def iter_money_boxes(chunk_size: Optional[int] = None) -> Iterator[Tuple[dict, List[dict]]]:
+    """
+    Iterate over every money box with its contents, read with a single query joining MoneyBoxContent and Cash
+    which is fetched by chunks through a server-side cursor, so the memory does not grow with the number of money boxes.
+    The deposits not compacted yet in the sharded and ledger deposit modes are not included.
+    The broken money boxes moved to the archive are not included either.
+    Args:
+        chunk_size (Optional[int]): Number of rows fetched at once, MONEYBOX_EXPORT_CHUNK_SIZE by default.
+    Returns:
+        Iterator[Tuple[dict, List[dict]]]: The data of each money box, with its wealth, and the data of its contents
+        ordered by cash value.
+    """
+    datetime_field = serializers.DateTimeField()
+    rows = (
+        MoneyBox.objects
+        .order_by('id', 'moneyboxcontent__cash__minor_value')
+        .values_list(
+            'id', 'name', 'created_at', 'updated_at', 'broken', 'wealth_minor',
+            'moneyboxcontent__cash__cash_type', 'moneyboxcontent__cash__currency', 'moneyboxcontent__cash__minor_value',
+            'moneyboxcontent__amount',
+        )
+        .iterator(chunk_size=chunk_size or settings.MONEYBOX_EXPORT_CHUNK_SIZE)
+    )
+    for _, money_box_rows in groupby(rows, key=itemgetter(0)):
+        money_box_rows = list(money_box_rows)
+        money_box_id, name, created_at, updated_at, broken, wealth_minor = money_box_rows[0][:6]
+        money_box = {
+            'id': money_box_id,
+            'name': name,
+            'created_at': datetime_field.to_representation(created_at),
+            'updated_at': datetime_field.to_representation(updated_at),
+            'broken': broken,
+            'wealth': str(Cash.to_major_units(wealth_minor)),
+        }
+        contents = [
+            {
+                'cash_type': cash_type,
+                'currency': currency,
+                'value': str(Cash.to_major_units(minor_value, currency)),
+                'amount': amount,
+            }
+            for *_, cash_type, currency, minor_value, amount in money_box_rows
+            if cash_type is not None
+        ]
+        yield money_box, contents
+
+
+def export_ndjson(chunk_size: Optional[int] = None) -> Iterator[str]:
+    """
+    Export every money box with its contents as newline delimited JSON, one money box per line,
+    with the camelCase keys of the API.
+    Args:
+        chunk_size (Optional[int]): Number of rows fetched at once, see iter_money_boxes.
+    Returns:
+        Iterator[str]: The lines of the export.
+    """
+    for money_box, contents in iter_money_boxes(chunk_size):
+        yield json.dumps(camelize({**money_box, 'cashes': contents}), separators=(',', ':')) + '\n'
+
+
+def export_csv(chunk_size: Optional[int] = None) -> Iterator[str]:
+    """
+    Export every money box with its contents as CSV, one row per money box and cash,
+    the money boxes without contents have a single row with empty cash columns.
+    Args:
+        chunk_size (Optional[int]): Number of rows fetched at once, see iter_money_boxes.
+    Returns:
+        Iterator[str]: The rows of the export, starting with the header.
+    """
+    writer = csv.writer(_EchoBuffer())
+    yield writer.writerow(CSV_HEADER)
+    for money_box, contents in iter_money_boxes(chunk_size):
+        money_box_columns = list(money_box.values())
+        for content in contents or [{'cash_type': '', 'currency': '', 'value': '', 'amount': ''}]:
+            yield writer.writerow(money_box_columns + list(content.values()))
+
+
+async def aiter_export(export: Iterator[str], batch_size: Optional[int] = None) -> AsyncIterator[str]:
+    """
+    Iterate asynchronously over an export, for the streaming responses served through ASGI which Django would
+    otherwise read entirely in memory before sending them. The export reads the database so its lines are produced
+    by batches in the thread running the sync code of the request, each batch is sent as a single chunk.
+    Args:
+        export (Iterator[str]): The export, see EXPORTERS.
+        batch_size (Optional[int]): Number of lines produced at once, MONEYBOX_EXPORT_CHUNK_SIZE by default.
+    Returns:
+        AsyncIterator[str]: The chunks of the export.
+    """
+    next_batch = sync_to_async(lambda: ''.join(islice(export, batch_size or settings.MONEYBOX_EXPORT_CHUNK_SIZE)))
+    try:
+        while batch := await next_batch():
+            yield batch
+    finally:
+        # Close the database cursor of an export interrupted by the client
+        await sync_to_async(export.close)()
+
+
+EXPORTERS = {
+    'ndjson': export_ndjson,
+    'csv': export_csv,
+}
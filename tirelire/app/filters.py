@@ -0,0 +1,191 @@
+from decimal import Decimal, InvalidOperation
+from typing import Optional, Tuple
+
+import coreapi
+import coreschema
+from django.db.models import QuerySet
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend, OrderingFilter
+from rest_framework.request import Request
+
+from app.models import Cash
+
+# Value of the include_wealth query parameter enabling the wealth in the money boxes data
+TRUE_VALUES = {'true', '1', 'yes'}
+
+
+def is_wealth_included(request: Request) -> bool:
+    """
+    Whether the wealth of the money boxes was requested with the include_wealth query parameter.
+    Args:
+        request (Request): DRF request object.
+    Returns:
+        bool: True if the wealth must be serialized.
+    """
+    return request.query_params.get('include_wealth', '').lower() in TRUE_VALUES
+
+
+class MoneyBoxFilter(BaseFilterBackend):
+    """
+    Filter the money boxes in the database with the query parameters: broken, created_after and created_before,
+    updated_since, name_prefix and search, each supported by an index of the money boxes.
+    On PostgreSQL the name filters are case insensitive and supported by expression indexes on the uppercase name,
+    a pattern index for name_prefix and a trigram index for search.
+    """
+    # Field parsing each query parameter, and lookup it is filtered with. The broken state is filtered with IN
+    # as the exact lookup is written NOT broken, a condition SQLite does not match to an index
+    params = {
+        'broken': (serializers.BooleanField(), 'broken__in'),
+        'created_after': (serializers.DateTimeField(), 'created_at__gte'),
+        'created_before': (serializers.DateTimeField(), 'created_at__lt'),
+        'updated_since': (serializers.DateTimeField(), 'updated_at__gte'),
+        'name_prefix': (serializers.CharField(max_length=200), 'name__istartswith'),
+        'search': (serializers.CharField(max_length=200), 'name__icontains'),
+    }
+
+    def filter_queryset(self, request: Request, queryset: QuerySet, view) -> QuerySet:
+        filters = {}
+        for param, (field, lookup) in self.params.items():
+            value = request.query_params.get(param)
+            if not value:
+                continue
+            try:
+                value = field.run_validation(value)
+            except ValidationError as error:
+                raise ValidationError({param: error.detail[0]})
+            filters[lookup] = [value] if lookup.endswith('__in') else value
+        return queryset.filter(**filters) if filters else queryset
+
+    def get_schema_fields(self, view) -> list:
+        return [
+            coreapi.Field(
+                name='broken',
+                required=False,
+                location='query',
+                schema=coreschema.Boolean(title='Broken', description='Whether the money boxes are broken.'),
+            ),
+            coreapi.Field(
+                name='created_after',
+                required=False,
+                location='query',
+                schema=coreschema.String(
+                    title='Created after',
+                    description='Money boxes created at or after this ISO 8601 date and time.',
+                    format='date-time',
+                ),
+            ),
+            coreapi.Field(
+                name='created_before',
+                required=False,
+                location='query',
+                schema=coreschema.String(
+                    title='Created before',
+                    description='Money boxes created before this ISO 8601 date and time.',
+                    format='date-time',
+                ),
+            ),
+            coreapi.Field(
+                name='updated_since',
+                required=False,
+                location='query',
+                schema=coreschema.String(
+                    title='Updated since',
+                    description='Money boxes updated at or after this ISO 8601 date and time.',
+                    format='date-time',
+                ),
+            ),
+            coreapi.Field(
+                name='name_prefix',
+                required=False,
+                location='query',
+                schema=coreschema.String(title='Name prefix', description='Start of the name of the money boxes.'),
+            ),
+            coreapi.Field(
+                name='search',
+                required=False,
+                location='query',
+                schema=coreschema.String(title='Search', description='Part of the name of the money boxes.'),
+            ),
+        ]
+
+
+class MoneyBoxWealthFilter(BaseFilterBackend):
+    """
+    Filter the money boxes on their wealth with the min_wealth and max_wealth query parameters, in the database.
+    The money boxes are annotated with their current wealth whenever it is filtered, ordered on or included.
+    """
+
+    def filter_queryset(self, request: Request, queryset: QuerySet, view) -> QuerySet:
+        min_wealth = self.get_wealth_param(request, 'min_wealth')
+        max_wealth = self.get_wealth_param(request, 'max_wealth')
+        ordering = request.query_params.get(MoneyBoxOrderingFilter.ordering_param, '')
+        if min_wealth is None and max_wealth is None and 'wealth' not in ordering and not is_wealth_included(request):
+            return queryset
+        queryset = queryset.with_wealth()
+        if min_wealth is not None:
+            queryset = queryset.filter(current_wealth_minor__gte=Cash.to_minor_units(min_wealth))
+        if max_wealth is not None:
+            queryset = queryset.filter(current_wealth_minor__lte=Cash.to_minor_units(max_wealth))
+        return queryset
+
+    @staticmethod
+    def get_wealth_param(request: Request, param: str) -> Optional[Decimal]:
+        """
+        Parse a wealth query parameter.
+        Args:
+            request (Request): DRF request object.
+            param (str): Name of the query parameter.
+        Returns:
+            Optional[Decimal]: The wealth, or None if the parameter is not given.
+        """
+        value = request.query_params.get(param)
+        if value is None:
+            return None
+        try:
+            wealth = Decimal(value)
+        except InvalidOperation:
+            raise ValidationError({param: 'A valid number is required.'})
+        if not wealth.is_finite():
+            raise ValidationError({param: 'A valid number is required.'})
+        return wealth
+
+    def get_schema_fields(self, view) -> list:
+        return [
+            coreapi.Field(
+                name='min_wealth',
+                required=False,
+                location='query',
+                schema=coreschema.Number(title='Minimum wealth', description='Minimum wealth of the money boxes.'),
+            ),
+            coreapi.Field(
+                name='max_wealth',
+                required=False,
+                location='query',
+                schema=coreschema.Number(title='Maximum wealth', description='Maximum wealth of the money boxes.'),
+            ),
+            coreapi.Field(
+                name='include_wealth',
+                required=False,
+                location='query',
+                schema=coreschema.Boolean(title='Include wealth', description='Include the wealth of the money boxes.'),
+            ),
+        ]
+
+
+class MoneyBoxOrderingFilter(OrderingFilter):
+    """
+    Ordering of the money boxes, where the public ordering names are translated to the database expressions.
+    The ordering is applied by the keyset pagination, which reads it from this filter.
+    """
+    # Database expressions ordered on for the public ordering names which are not model fields
+    ordering_aliases = {
+        'wealth': 'current_wealth_minor',
+    }
+
+    def get_ordering(self, request: Request, queryset: QuerySet, view) -> Tuple[str, ...]:
+        ordering = super().get_ordering(request, queryset, view)
+        return tuple(
+            f'{"-" if order.startswith("-") else ""}{self.ordering_aliases.get(order.lstrip("-"), order.lstrip("-"))}'
+            for order in ordering
+        )
@@ -0,0 +1,259 @@
+import asyncio
+import hashlib
+import json
+import time
+import uuid
+from functools import wraps
+from io import BytesIO
+from typing import Callable, NamedTuple, Optional, Union
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpRequest, HttpResponse
+from drf_yasg import openapi
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+IDEMPOTENCY_KEY_HEADER = 'Idempotency-Key'
+# Header set on the responses replayed from the store
+IDEMPOTENT_REPLAYED_HEADER = 'Idempotent-Replayed'
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+# Seconds between two checks of a concurrent duplicate waiting for the response of the request holding the key
+IDEMPOTENCY_POLL_INTERVAL = 0.05
+
+# Swagger parameter of the actions accepting an idempotency key
+IDEMPOTENCY_KEY_PARAMETER = openapi.Parameter(
+    IDEMPOTENCY_KEY_HEADER,
+    openapi.IN_HEADER,
+    description=(
+        'Unique key of the request, such as a UUID, sent again with its retries so they replay the response '
+        'of the first request instead of running it again.'
+    ),
+    type=openapi.TYPE_STRING,
+    required=False,
+)
+
+
+class IdempotencyKeyInUseError(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'A request with this idempotency key is still in progress, retry later.'
+
+
+class IdempotencyKeyReusedError(APIException):
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = 'This idempotency key was already used by another request.'
+
+
+class StoredResponse(NamedTuple):
+    fingerprint: str
+    status_code: int
+    data: object
+
+
+class IdempotentResponseStore:
+    """
+    Store of the responses of the requests sent with an idempotency key, working with any Django cache backend
+    whose timeout and maximum number of entries bound it. Each key is held by a lock, added with the atomic add of
+    the cache, while its request runs so the concurrent duplicates wait for its response instead of running it too.
+    The backend must be shared by the workers for the retries reaching another worker to be replayed.
+    """
+    KEY_PREFIX = 'moneybox-idempotency'
+
+    @property
+    def backend(self):
+        return caches[settings.MONEYBOX_IDEMPOTENCY_CACHE_ALIAS]
+
+    def make_key(self, request: Union[HttpRequest, Request], idempotency_key: str) -> str:
+        # The key is scoped to the endpoint and hashed as it is chosen by the client
+        digest = hashlib.sha256(f'{request.method} {request.path} {idempotency_key}'.encode()).hexdigest()
+        return f'{self.KEY_PREFIX}:{digest}'
+
+    @staticmethod
+    def make_fingerprint(data) -> str:
+        """
+        Fingerprint of the payload of a request, telling a retry from another request sent with the same key.
+        Args:
+            data: The parsed payload of the request.
+        Returns:
+            str: The fingerprint.
+        """
+        payload = json.dumps(data, sort_keys=True, separators=(',', ':'), default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[StoredResponse]:
+        entry = self.backend.get(key)
+        return StoredResponse(*entry) if entry is not None else None
+
+    def set(self, key: str, stored_response: StoredResponse) -> None:
+        self.backend.set(key, tuple(stored_response))
+
+    def acquire(self, key: str) -> Optional[str]:
+        """
+        Take the lock of a key, for MONEYBOX_IDEMPOTENCY_LOCK_TIMEOUT seconds at most.
+        Args:
+            key (str): The key of the store.
+        Returns:
+            Optional[str]: The token of the lock, or None if another request holds it.
+        """
+        token = uuid.uuid4().hex
+        if self.backend.add(f'{key}:lock', token, timeout=settings.MONEYBOX_IDEMPOTENCY_LOCK_TIMEOUT):
+            return token
+        return None
+
+    def release(self, key: str, token: str) -> None:
+        # A lock which expired may have been taken by another request since
+        if self.backend.get(f'{key}:lock') == token:
+            self.backend.delete(f'{key}:lock')
+
+    async def aget(self, key: str) -> Optional[StoredResponse]:
+        entry = await self.backend.aget(key)
+        return StoredResponse(*entry) if entry is not None else None
+
+    async def aset(self, key: str, stored_response: StoredResponse) -> None:
+        await self.backend.aset(key, tuple(stored_response))
+
+    async def aacquire(self, key: str) -> Optional[str]:
+        """
+        Async version of acquire.
+        Args:
+            key (str): The key of the store.
+        Returns:
+            Optional[str]: The token of the lock, or None if another request holds it.
+        """
+        token = uuid.uuid4().hex
+        if await self.backend.aadd(f'{key}:lock', token, timeout=settings.MONEYBOX_IDEMPOTENCY_LOCK_TIMEOUT):
+            return token
+        return None
+
+    async def arelease(self, key: str, token: str) -> None:
+        if await self.backend.aget(f'{key}:lock') == token:
+            await self.backend.adelete(f'{key}:lock')
+
+
+idempotent_response_store = IdempotentResponseStore()
+
+
+def idempotent(action: Callable) -> Callable:
+    """
+    Make a viewset action idempotent for the requests sent with an Idempotency-Key header: the successful response
+    is stored for the timeout of the store and replayed, without running the action again, to the retries sent
+    with the same key and payload. A concurrent duplicate waits up to MONEYBOX_IDEMPOTENCY_WAIT_TIMEOUT seconds
+    for the response of the request holding the key, then gets a 409. The failed requests are not stored,
+    they did not write anything and run again when retried.
+    Args:
+        action (Callable): The viewset action.
+    Returns:
+        Callable: The idempotent action.
+    """
+    @wraps(action)
+    def idempotent_action(view, request: Request, *args, **kwargs) -> Response:
+        idempotency_key = get_idempotency_key(request)
+        if idempotency_key is None:
+            return action(view, request, *args, **kwargs)
+        store = idempotent_response_store
+        key = store.make_key(request, idempotency_key)
+        fingerprint = store.make_fingerprint(request.data)
+        deadline = time.monotonic() + settings.MONEYBOX_IDEMPOTENCY_WAIT_TIMEOUT
+        while True:
+            stored_response = store.get(key)
+            if stored_response is not None:
+                return replay(stored_response, fingerprint)
+            token = store.acquire(key)
+            if token is not None:
+                break
+            if time.monotonic() >= deadline:
+                raise IdempotencyKeyInUseError
+            time.sleep(IDEMPOTENCY_POLL_INTERVAL)
+        try:
+            # The request holding the key before may have stored its response after the first check
+            stored_response = store.get(key)
+            if stored_response is not None:
+                return replay(stored_response, fingerprint)
+            response = action(view, request, *args, **kwargs)
+            if status.is_success(response.status_code):
+                store.set(key, StoredResponse(fingerprint, response.status_code, response.data))
+            return response
+        finally:
+            store.release(key, token)
+
+    return idempotent_action
+
+
+def async_idempotent(action: Callable) -> Callable:
+    """
+    Async version of idempotent for the actions of AsyncMoneyBoxViewSet, sharing the store and its locks.
+    The view parses the payloads and renders the responses, the stored data is the parsed rendered response.
+    Args:
+        action (Callable): The async viewset action.
+    Returns:
+        Callable: The idempotent async action.
+    """
+    @wraps(action)
+    async def idempotent_action(view, request: HttpRequest, *args, **kwargs) -> HttpResponse:
+        idempotency_key = get_idempotency_key(request)
+        if idempotency_key is None:
+            return await action(view, request, *args, **kwargs)
+        store = idempotent_response_store
+        key = store.make_key(request, idempotency_key)
+        fingerprint = store.make_fingerprint(view.parser.parse(BytesIO(request.body)) if request.body else {})
+        deadline = time.monotonic() + settings.MONEYBOX_IDEMPOTENCY_WAIT_TIMEOUT
+        while True:
+            stored_response = await store.aget(key)
+            if stored_response is not None:
+                return replay(stored_response, fingerprint, view.render)
+            token = await store.aacquire(key)
+            if token is not None:
+                break
+            if time.monotonic() >= deadline:
+                raise IdempotencyKeyInUseError
+            await asyncio.sleep(IDEMPOTENCY_POLL_INTERVAL)
+        try:
+            stored_response = await store.aget(key)
+            if stored_response is not None:
+                return replay(stored_response, fingerprint, view.render)
+            response = await action(view, request, *args, **kwargs)
+            if status.is_success(response.status_code):
+                response_data = view.parser.parse(BytesIO(response.content))
+                await store.aset(key, StoredResponse(fingerprint, response.status_code, response_data))
+            return response
+        finally:
+            await store.arelease(key, token)
+
+    return idempotent_action
+
+
+def get_idempotency_key(request: Union[HttpRequest, Request]) -> Optional[str]:
+    """
+    Get the idempotency key sent in the headers of a request.
+    Args:
+        request (Union[HttpRequest, Request]): Django or DRF request object.
+    Returns:
+        Optional[str]: The idempotency key, or None if the request was sent without one.
+    """
+    idempotency_key = request.headers.get(IDEMPOTENCY_KEY_HEADER)
+    if idempotency_key is not None and (not idempotency_key or len(idempotency_key) > IDEMPOTENCY_KEY_MAX_LENGTH):
+        raise ValidationError({
+            IDEMPOTENCY_KEY_HEADER: f'Ensure this header has between 1 and {IDEMPOTENCY_KEY_MAX_LENGTH} characters.'
+        })
+    return idempotency_key
+
+
+def replay(stored_response: StoredResponse, fingerprint: str, render: Callable = Response) -> HttpResponse:
+    """
+    Build the response of a retry from the stored response of its first request.
+    Args:
+        stored_response (StoredResponse): The stored response.
+        fingerprint (str): The fingerprint of the payload of the retry.
+        render (Callable): The function building the response from the data, a DRF response by default.
+    Returns:
+        HttpResponse: The response object.
+    """
+    if stored_response.fingerprint != fingerprint:
+        raise IdempotencyKeyReusedError
+    return render(
+        stored_response.data,
+        status=stored_response.status_code,
+        headers={IDEMPOTENT_REPLAYED_HEADER: 'true'},
+    )
@@ -0,0 +1,262 @@
+import csv
+import json
+import time
+from collections import defaultdict
+from decimal import InvalidOperation
+from io import StringIO
+from itertools import islice
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, TextIO, Tuple
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from app.caches import wealth_cache
+from app.camel_case import underscoreize
+from app.models import ArchivedMoneyBox, Cash, CashRollup, MoneyBox, MoneyBoxContent, cash_registry
+
+IMPORT_FORMATS = ['csv', 'ndjson']
+
+
+class ImportRow(NamedTuple):
+    external_ref: str
+    name: str
+    cash_id: int
+    amount: int
+
+
+class ImportRowError(Exception):
+    """
+    Error raised for an invalid row of an import file.
+    """
+
+    def __init__(self, line_number: int, message: str):
+        super().__init__(f'Line {line_number}: {message}')
+        self.line_number = line_number
+
+
+def read_records(import_file: TextIO, file_format: str) -> Iterator[Tuple[int, dict]]:
+    """
+    Read the records of an import file one at a time.
+    Args:
+        import_file (TextIO): The import file.
+        file_format (str): 'csv' for a file with a header row, or 'ndjson' for one JSON object per line.
+    Returns:
+        Iterator[Tuple[int, dict]]: The line number and the snake_case fields of each record.
+    """
+    if file_format == 'csv':
+        reader = csv.DictReader(import_file)
+        for record in reader:
+            yield reader.line_num, underscoreize(record)
+        return
+    for line_number, line in enumerate(import_file, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        if not isinstance(record, dict):
+            raise ImportRowError(line_number, 'not a JSON object.')
+        yield line_number, underscoreize(record)
+
+
+def validate_record(line_number: int, record: dict) -> ImportRow:
+    """
+    Validate a deposit record of an import file against the cash registry.
+    Args:
+        line_number (int): The line number of the record.
+        record (dict): The fields of the record: external_ref, name (optional), cash_type, value, currency (optional)
+        and amount.
+    Returns:
+        ImportRow: The validated deposit.
+    """
+    external_ref = str(record.get('external_ref') or '').strip()
+    if not external_ref:
+        raise ImportRowError(line_number, 'the external_ref is missing.')
+    currency = record.get('currency') or Cash.CurrencyChoice.EUR
+    try:
+        cash = Cash.find_from_type_and_value(record.get('cash_type'), str(record.get('value')), currency)
+    except (InvalidOperation, KeyError):
+        cash = None
+    if cash is None:
+        raise ImportRowError(
+            line_number,
+            f"the {record.get('cash_type')} with the value {record.get('value')} {currency} does not exist.",
+        )
+    try:
+        amount = int(record.get('amount'))
+    except (TypeError, ValueError):
+        amount = 0
+    if amount <= 0:
+        raise ImportRowError(line_number, f"the amount {record.get('amount')} is not a positive integer.")
+    name = str(record.get('name') or external_ref)[:MoneyBox._meta.get_field('name').max_length]
+    return ImportRow(external_ref, name, cash.id, amount)
+
+
+class MoneyBoxImporter:
+    """
+    Import deposits into money boxes identified by their external reference, creating the missing money boxes.
+    The rows are validated while the file is read and loaded by batches, each in its own transaction:
+    on PostgreSQL a batch is copied into a staging table with COPY then merged with set-based statements,
+    other databases merge the batch aggregated in memory with bulk inserts.
+    The deposits into broken money boxes, archived or not, are ignored.
+    """
+    STAGING_TABLE = 'moneybox_import_staging'
+
+    def __init__(self, batch_size: int, on_progress: Optional[Callable[[int, int, float], None]] = None):
+        """
+        Args:
+            batch_size (int): Number of rows loaded per batch.
+            on_progress (Optional[Callable[[int, int, float], None]]): Called after each batch with the number of
+            rows imported, the number of rows rejected and the rows per second so far.
+        """
+        self.batch_size = batch_size
+        self.on_progress = on_progress or (lambda imported, rejected, rate: None)
+        self.errors: List[ImportRowError] = []
+        self.imported_count = 0
+
+    def run(self, records: Iterable[Tuple[int, dict]]) -> int:
+        """
+        Import the records of a file, see read_records.
+        Args:
+            records (Iterable[Tuple[int, dict]]): The line number and the fields of each record.
+        Returns:
+            int: The number of rows imported.
+        """
+        start = time.perf_counter()
+        rows = self._validate(records)
+        use_copy = connection.vendor == 'postgresql'
+        if use_copy:
+            self._create_staging_table()
+        try:
+            while True:
+                batch = list(islice(rows, self.batch_size))
+                if not batch:
+                    break
+                with transaction.atomic():
+                    if use_copy:
+                        self._copy_batch(batch)
+                    else:
+                        self._merge_batch(batch)
+                self.imported_count += len(batch)
+                self.on_progress(
+                    self.imported_count, len(self.errors), self.imported_count / (time.perf_counter() - start)
+                )
+        finally:
+            if use_copy:
+                with connection.cursor() as cursor:
+                    cursor.execute(f'DROP TABLE IF EXISTS {self.STAGING_TABLE}')
+        return self.imported_count
+
+    def _validate(self, records: Iterable[Tuple[int, dict]]) -> Iterator[ImportRow]:
+        for line_number, record in records:
+            try:
+                yield validate_record(line_number, record)
+            except ImportRowError as error:
+                self.errors.append(error)
+
+    def _create_staging_table(self) -> None:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE TEMPORARY TABLE IF NOT EXISTS {self.STAGING_TABLE} '
+                f'(external_ref varchar(100) NOT NULL, name varchar(200) NOT NULL, '
+                f'cash_id bigint NOT NULL, amount bigint NOT NULL)'
+            )
+
+    def _copy_batch(self, batch: List[ImportRow]) -> None:
+        """
+        Load a batch with COPY into the staging table, then merge it into the money boxes, their contents
+        and the cash rollups with set-based statements.
+        """
+        buffer = StringIO()
+        csv.writer(buffer).writerows(batch)
+        buffer.seek(0)
+        money_box_table = MoneyBox._meta.db_table
+        content_table = MoneyBoxContent._meta.db_table
+        cash_table = Cash._meta.db_table
+        rollup_table = CashRollup._meta.db_table
+        archive_table = ArchivedMoneyBox._meta.db_table
+        now = timezone.now()
+        with connection.cursor() as cursor:
+            cursor.execute(f'TRUNCATE {self.STAGING_TABLE}')
+            cursor.copy_expert(
+                f'COPY {self.STAGING_TABLE} (external_ref, name, cash_id, amount) FROM STDIN WITH (FORMAT csv)', buffer
+            )
+            cursor.execute(
+                f'INSERT INTO {money_box_table} (created_at, updated_at, name, broken, wealth_minor, external_ref) '
+                f'SELECT %s, %s, MIN(name), false, 0, external_ref FROM {self.STAGING_TABLE} staging '
+                f'WHERE NOT EXISTS ('
+                f'SELECT FROM {archive_table} archive WHERE archive.external_ref = staging.external_ref'
+                f') '
+                f'GROUP BY external_ref ON CONFLICT (external_ref) DO NOTHING',
+                [now, now],
+            )
+            # Lock the money boxes before their contents like the deposits do, then drop the rows of broken ones
+            cursor.execute(
+                f'SELECT id FROM {money_box_table} '
+                f'WHERE external_ref IN (SELECT external_ref FROM {self.STAGING_TABLE}) ORDER BY id FOR UPDATE'
+            )
+            cursor.execute(
+                f'CREATE TEMPORARY TABLE {self.STAGING_TABLE}_totals ON COMMIT DROP AS '
+                f'SELECT money_box.id AS money_box_id, staging.cash_id, SUM(staging.amount) AS amount '
+                f'FROM {self.STAGING_TABLE} staging JOIN {money_box_table} money_box '
+                f'ON money_box.external_ref = staging.external_ref AND NOT money_box.broken '
+                f'GROUP BY money_box.id, staging.cash_id'
+            )
+            cursor.execute(
+                f'UPDATE {money_box_table} money_box SET wealth_minor = money_box.wealth_minor + wealth.total, '
+                f'updated_at = %s FROM ('
+                f'SELECT totals.money_box_id, SUM(totals.amount * cash.minor_value) AS total '
+                f'FROM {self.STAGING_TABLE}_totals totals JOIN {cash_table} cash ON cash.id = totals.cash_id '
+                f'GROUP BY totals.money_box_id'
+                f') wealth WHERE money_box.id = wealth.money_box_id RETURNING money_box.id',
+                [now],
+            )
+            money_box_ids = [money_box_id for money_box_id, in cursor.fetchall()]
+            cursor.execute(
+                f'INSERT INTO {content_table} (money_box_id, cash_id, amount) '
+                f'SELECT money_box_id, cash_id, amount FROM {self.STAGING_TABLE}_totals ORDER BY money_box_id, cash_id '
+                f'ON CONFLICT (money_box_id, cash_id) DO UPDATE SET amount = {content_table}.amount + EXCLUDED.amount'
+            )
+            cursor.execute(
+                f'INSERT INTO {rollup_table} (cash_id, shard, amount) '
+                f'SELECT cash_id, 0, SUM(amount) FROM {self.STAGING_TABLE}_totals GROUP BY cash_id ORDER BY cash_id '
+                f'ON CONFLICT (cash_id, shard) DO UPDATE SET amount = {rollup_table}.amount + EXCLUDED.amount'
+            )
+        transaction.on_commit(lambda: wealth_cache.delete_many(money_box_ids))
+
+    def _merge_batch(self, batch: List[ImportRow]) -> None:
+        """
+        Merge a batch aggregated in memory into the money boxes, their contents and the cash rollups,
+        creating the missing money boxes with a bulk insert.
+        """
+        names = {}
+        for row in batch:
+            names.setdefault(row.external_ref, row.name)
+        money_boxes = dict(
+            MoneyBox.objects.select_for_update().filter(external_ref__in=names).values_list('external_ref', 'id')
+        )
+        archived_external_refs = set(
+            ArchivedMoneyBox.objects.filter(external_ref__in=names.keys() - money_boxes.keys())
+            .values_list('external_ref', flat=True)
+        )
+        MoneyBox.objects.bulk_create([
+            MoneyBox(external_ref=external_ref, name=name)
+            for external_ref, name in names.items()
+            if external_ref not in money_boxes and external_ref not in archived_external_refs
+        ])
+        money_boxes = dict(
+            MoneyBox.objects.filter(external_ref__in=names, broken=False).values_list('external_ref', 'id')
+        )
+        amounts_to_add: Dict[Tuple[int, int], int] = defaultdict(int)
+        wealth_deltas: Dict[int, int] = defaultdict(int)
+        for row in batch:
+            money_box_id = money_boxes.get(row.external_ref)
+            if money_box_id is None:
+                continue
+            amounts_to_add[(money_box_id, row.cash_id)] += row.amount
+            wealth_deltas[money_box_id] += row.amount * cash_registry.get_by_id(row.cash_id).minor_value
+        MoneyBox._increment_wealth(wealth_deltas)
+        MoneyBoxContent.objects.add_amounts(amounts_to_add)
+        CashRollup.record_contents_amounts(amounts_to_add)
+        transaction.on_commit(lambda: wealth_cache.delete_many(wealth_deltas))
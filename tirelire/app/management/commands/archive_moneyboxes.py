@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from app.models import ArchivedMoneyBox
+
+
+class Command(BaseCommand):
+    help = (
+        'Move the broken money boxes with their final snapshot from the money boxes table to the archive, '
+        'where they can still be retrieved.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=settings.MONEYBOX_ARCHIVE_BATCH_SIZE,
+            help='Number of money boxes archived per transaction.',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        archived_count = 0
+        while True:
+            money_box_ids = ArchivedMoneyBox.archive_broken_money_boxes(batch_size)
+            archived_count += len(money_box_ids)
+            if len(money_box_ids) < batch_size:
+                break
+            self.stdout.write(f'Archived {archived_count} money boxes')
+        self.stdout.write(self.style.SUCCESS(f'Archived {archived_count} broken money boxes.'))
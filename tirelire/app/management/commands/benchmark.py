@@ -0,0 +1,58 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app.benchmarks import MoneyBoxBenchmarkSuite, benchmark_database, compare_with_baseline
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the money box API endpoints and model methods on a throwaway test database created from the '
+        'settings profile (e.g. --settings tirelire.settings_benchmark_sqlite), and write the latency percentiles '
+        'and query counts to a JSON report.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes',
+            default='10,100,1000,10000',
+            help='Comma separated numbers of money boxes to run the cases on, e.g. 10,1000,1000000.',
+        )
+        parser.add_argument(
+            '--mixes',
+            default=','.join(MoneyBoxBenchmarkSuite.DENOMINATION_MIXES),
+            help='Comma separated denomination mixes held by the money boxes.',
+        )
+        parser.add_argument('--iterations', type=int, default=50, help='Number of runs of each case.')
+        parser.add_argument('--output', default='benchmark.json', help='Path of the JSON report written.')
+        parser.add_argument('--baseline', help='Path of a JSON report to compare the results with.')
+        parser.add_argument(
+            '--tolerance',
+            type=float,
+            default=0.2,
+            help='Accepted relative increase of the median latencies over the baseline ones.',
+        )
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        mixes = options['mixes'].split(',')
+        unknown_mixes = set(mixes) - set(MoneyBoxBenchmarkSuite.DENOMINATION_MIXES)
+        if unknown_mixes:
+            raise CommandError(f'Unknown denomination mixes: {", ".join(sorted(unknown_mixes))}.')
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as baseline_file:
+                baseline = json.load(baseline_file)
+
+        with benchmark_database():
+            suite = MoneyBoxBenchmarkSuite(sizes, mixes, options['iterations'], log=self.stdout.write)
+            report = suite.run()
+        with open(options['output'], 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+        self.stdout.write(f'Benchmark report written to {options["output"]}.')
+
+        if baseline is not None:
+            regressions = compare_with_baseline(report, baseline, options['tolerance'])
+            if regressions:
+                raise CommandError('Regressions against the baseline:\n' + '\n'.join(regressions))
+            self.stdout.write(self.style.SUCCESS('No regression against the baseline.'))
@@ -0,0 +1,47 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.urls import reverse
+from model_bakery import baker
+
+from app.benchmarks import benchmark_database, run_asgi_requests, run_wsgi_requests
+from app.models import MoneyBox
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the throughput of the sync MoneyBoxViewSet endpoints served through WSGI '
+        'with the async ones served through ASGI, on a throwaway test database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--endpoint', choices=['list', 'detail', 'shake'], default='shake')
+        parser.add_argument('--boxes', type=int, default=100, help='Number of money boxes created.')
+        parser.add_argument('--requests', type=int, default=2000, help='Number of requests sent to each stack.')
+        parser.add_argument('--concurrency', type=int, default=16, help='Number of concurrent requests.')
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            money_boxes = baker.make(MoneyBox, _quantity=options['boxes'])
+            for money_box in money_boxes:
+                money_box.save_money([
+                    {'cash_type': 'bill', 'value': '20', 'amount': 1},
+                    {'cash_type': 'coin', 'value': '0.5', 'amount': 3},
+                ])
+            results = {}
+            for stack, url_name_prefix, run_requests in [
+                ('wsgi', 'api:moneyboxes', run_wsgi_requests),
+                ('asgi', 'api:async-moneyboxes', run_asgi_requests),
+            ]:
+                if options['endpoint'] == 'list':
+                    urls = [reverse(f'{url_name_prefix}-list')] * options['requests']
+                else:
+                    urls = [
+                        reverse(
+                            f'{url_name_prefix}-{options["endpoint"]}',
+                            args=(money_boxes[index % len(money_boxes)].id,),
+                        )
+                        for index in range(options['requests'])
+                    ]
+                results[stack] = run_requests(urls, options['concurrency'])
+        self.stdout.write(json.dumps(results, indent=2))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from app.models import Deposit, MoneyBox, MoneyBoxContentShard
+
+
+class Command(BaseCommand):
+    help = 'Compact the sharded deposit counters and the ledger deposits into the money boxes contents and wealth.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Number of money boxes compacted per batch.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        compacted_count = 0
+        # Both sources are compacted whatever the deposit mode, so rows left by a previous mode are folded too
+        for pending_queryset in (MoneyBoxContentShard.objects.all(), Deposit.objects.filter(compacted=False)):
+            last_id = 0
+            while True:
+                money_box_ids = list(
+                    pending_queryset
+                    .filter(money_box_id__gt=last_id)
+                    .order_by('money_box_id')
+                    .values_list('money_box_id', flat=True)
+                    .distinct()[:batch_size]
+                )
+                if not money_box_ids:
+                    break
+                last_id = money_box_ids[-1]
+                compacted_count += MoneyBox.compact_pending_amounts(money_box_ids)
+        self.stdout.write(self.style.SUCCESS(f'Compacted {compacted_count} sharded counters and ledger deposits.'))
@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from app.exports import EXPORTERS
+
+
+class Command(BaseCommand):
+    help = 'Export every money box with its contents and wealth as NDJSON or CSV, streamed with a constant memory.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=list(EXPORTERS), default='ndjson', help='Format of the export.')
+        parser.add_argument('--output', help='Path of the file written, the standard output by default.')
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=settings.MONEYBOX_EXPORT_CHUNK_SIZE,
+            help='Number of rows fetched from the database at once.',
+        )
+
+    def handle(self, *args, **options):
+        exporter = EXPORTERS[options['format']]
+        if options['output'] is None:
+            self._write(exporter(options['chunk_size']), self.stdout)
+            return
+        with open(options['output'], 'w', newline='') as output_file:
+            self._write(exporter(options['chunk_size']), output_file)
+
+    @staticmethod
+    def _write(lines, output) -> None:
+        for line in lines:
+            output.write(line)
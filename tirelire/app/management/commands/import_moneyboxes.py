@@ -0,0 +1,49 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from app.imports import IMPORT_FORMATS, ImportRowError, MoneyBoxImporter, read_records
+
+
+class Command(BaseCommand):
+    help = (
+        'Import deposits from a CSV or NDJSON file into money boxes matched by their external reference, '
+        'creating the missing ones. Each row has an externalRef, an optional name, a cashType, a value, '
+        'an optional currency and an amount.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Path of the file imported.')
+        parser.add_argument(
+            '--format',
+            choices=IMPORT_FORMATS,
+            help='Format of the import, inferred from the extension of the file by default.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=settings.MONEYBOX_IMPORT_BATCH_SIZE,
+            help='Number of rows loaded per transaction.',
+        )
+
+    def handle(self, *args, **options):
+        file_format = options['format'] or os.path.splitext(options['path'])[1].lstrip('.').lower()
+        if file_format not in IMPORT_FORMATS:
+            raise CommandError(f'Unknown import format {file_format!r}, use --format {"|".join(IMPORT_FORMATS)}.')
+        importer = MoneyBoxImporter(options['batch_size'], on_progress=self._report_progress)
+        with open(options['path'], newline='') as import_file:
+            try:
+                importer.run(read_records(import_file, file_format))
+            except ImportRowError as error:
+                raise CommandError(str(error))
+        for error in importer.errors:
+            self.stderr.write(str(error))
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {importer.imported_count} rows, rejected {len(importer.errors)} rows.'
+        ))
+
+    def _report_progress(self, imported_count: int, rejected_count: int, rows_per_second: float) -> None:
+        self.stdout.write(
+            f'Imported {imported_count} rows, rejected {rejected_count} rows ({rows_per_second:.0f} rows/s)'
+        )
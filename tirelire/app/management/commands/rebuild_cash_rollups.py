@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Sum
+
+from app.models import Cash, CashRollup, MoneyBoxContent
+
+
+class Command(BaseCommand):
+    help = 'Rebuild or verify the rollups of the cash amounts held by all the money boxes from their contents.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Only verify the rollups, fail if any cash is out of sync.',
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                # Hold the writes to the contents until the rollups are fixed, the reads are not blocked
+                with connection.cursor() as cursor:
+                    cursor.execute(f'LOCK TABLE {MoneyBoxContent._meta.db_table} IN SHARE MODE')
+            expected_amounts = dict(
+                MoneyBoxContent.objects.values('cash_id').annotate(total=Sum('amount')).values_list('cash_id', 'total')
+            )
+            rollup_amounts = CashRollup.get_amounts()
+            mismatches = [
+                (cash_id, rollup_amounts.get(cash_id, 0), expected_amounts.get(cash_id, 0))
+                for cash_id in sorted(expected_amounts.keys() | rollup_amounts.keys())
+                if rollup_amounts.get(cash_id, 0) != expected_amounts.get(cash_id, 0)
+            ]
+            if mismatches and not options['check']:
+                # Add the differences rather than rewriting the rows so the other shards stay untouched
+                CashRollup.objects.add_amounts({
+                    (cash_id, 0): expected_amount - rollup_amount
+                    for cash_id, rollup_amount, expected_amount in mismatches
+                })
+
+        for cash_id, rollup_amount, expected_amount in mismatches:
+            cash = Cash.objects.get(id=cash_id)
+            self.stdout.write(
+                f'{cash.cash_type.capitalize()} of {cash.value} {cash.currency}: '
+                f'rollup amount {rollup_amount}, computed amount {expected_amount}'
+            )
+        if options['check']:
+            if mismatches:
+                raise CommandError(f'{len(mismatches)} cash rollups are out of sync.')
+            self.stdout.write(self.style.SUCCESS('All the cash rollups are in sync.'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Rebuilt {len(mismatches)} cash rollups.'))
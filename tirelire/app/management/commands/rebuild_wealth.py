@@ -0,0 +1,63 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from app.models import MoneyBox
+
+
+class Command(BaseCommand):
+    help = 'Rebuild or verify the persisted wealth of the money boxes from their contents.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Only verify the persisted wealth, fail if any money box is out of sync.',
+        )
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of money boxes handled per batch.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        checked_count = 0
+        mismatches = []
+        last_id = 0
+        while True:
+            # The batch is locked while its wealth is computed and written, so a deposit committed in between
+            # is neither lost nor reported as a mismatch, deposits lock the money box rows first as well
+            with transaction.atomic():
+                money_boxes = list(
+                    MoneyBox.objects
+                    .select_for_update()
+                    .filter(id__gt=last_id)
+                    .order_by('id')
+                    .only('id', 'wealth_minor', 'updated_at')[:batch_size]
+                )
+                if not money_boxes:
+                    break
+                last_id = money_boxes[-1].id
+                computed_wealth = MoneyBox.compute_wealth_minor([money_box.id for money_box in money_boxes])
+                out_of_sync = []
+                for money_box in money_boxes:
+                    expected_wealth = computed_wealth.get(money_box.id, 0)
+                    if money_box.wealth_minor != expected_wealth:
+                        mismatches.append((money_box.id, money_box.wealth_minor, expected_wealth))
+                        money_box.wealth_minor = expected_wealth
+                        # Bump the last update so the conditional requests see the fixed wealth
+                        money_box.updated_at = timezone.now()
+                        out_of_sync.append(money_box)
+                if out_of_sync and not options['check']:
+                    MoneyBox.objects.bulk_update(out_of_sync, ['wealth_minor', 'updated_at'])
+            checked_count += len(money_boxes)
+
+        for money_box_id, persisted_wealth, expected_wealth in mismatches:
+            self.stdout.write(
+                f'Money box {money_box_id}: persisted wealth {persisted_wealth}, computed wealth {expected_wealth}'
+            )
+        if options['check']:
+            if mismatches:
+                raise CommandError(f'{len(mismatches)} of {checked_count} money boxes have an out of sync wealth.')
+            self.stdout.write(self.style.SUCCESS(f'The wealth of all {checked_count} money boxes is in sync.'))
+        else:
+            self.stdout.write(
+                self.style.SUCCESS(f'Rebuilt the wealth of {len(mismatches)} of {checked_count} money boxes.')
+            )
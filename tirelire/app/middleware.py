@@ -0,0 +1,158 @@
+import logging
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Callable, Dict, Iterator, Optional, Set
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import HttpRequest, HttpResponse
+
+from app.camel_case import underscoreize
+
+logger = logging.getLogger(__name__)
+
+_current_metrics: ContextVar[Optional['RequestMetrics']] = ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    """
+    Metrics collected during a request: the SQL queries run through the execute wrapper and the durations of the
+    phases timed with timed.
+    """
+
+    def __init__(self):
+        self.query_count = 0
+        self.durations: Dict[str, float] = {'db': 0.0, 'serialize': 0.0, 'render': 0.0}
+        self._active_phases: Set[str] = set()
+        self._render_start: Optional[float] = None
+
+    def __call__(self, execute: Callable, sql, params, many: bool, context: dict):
+        """
+        Database execute wrapper counting the queries and their duration.
+        """
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.durations['db'] += perf_counter() - start
+            self.query_count += 1
+
+    def get_server_timing(self) -> str:
+        """
+        Format the metrics as a Server-Timing header value.
+        Returns:
+            str: The header value, with the durations in milliseconds.
+        """
+        metrics = [
+            f'{name};dur={duration * 1000:.3f}' + (f';desc="{self.query_count} queries"' if name == 'db' else '')
+            for name, duration in self.durations.items()
+        ]
+        return ', '.join(metrics)
+
+
+@contextmanager
+def timed(phase: str) -> Iterator[None]:
+    """
+    Add the time spent in the block to a phase of the current request metrics, a nested block timing the same phase
+    is only counted once. It does nothing outside of a request instrumented by RequestMetricsMiddleware.
+    Args:
+        phase (str): Name of the phase, as reported in the Server-Timing header.
+    """
+    metrics = _current_metrics.get()
+    if metrics is None or phase in metrics._active_phases:
+        yield
+        return
+    metrics._active_phases.add(phase)
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        metrics.durations[phase] = metrics.durations.get(phase, 0.0) + perf_counter() - start
+        metrics._active_phases.discard(phase)
+
+
+class CamelCaseMiddleware:
+    """
+    Translate the camelCase keys of the query string into snake_case like djangorestframework_camel_case's
+    CamelCaseMiddleWare, with memoized keys.
+    Like RequestMetricsMiddleware it is sync only on purpose: under ASGI, Django then runs the built-in middlewares
+    above them in sync mode in a single thread switch per request, instead of one switch per hook of each of them.
+    """
+
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]):
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        if request.GET:
+            request.GET = underscoreize(request.GET)
+        return self.get_response(request)
+
+
+class RequestMetricsMiddleware:
+    """
+    Record the number of SQL queries, the database, serialization, rendering and total times of each request and
+    send them in a Server-Timing header. A warning is logged when the queries of a view exceed its budget in
+    REQUEST_METRICS_QUERY_BUDGETS. The middleware is removed from the chain when REQUEST_METRICS_ENABLED is False.
+    """
+
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]):
+        if not settings.REQUEST_METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        metrics = RequestMetrics()
+        token = _current_metrics.set(metrics)
+        start = perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(metrics))
+                response = self.get_response(request)
+        finally:
+            _current_metrics.reset(token)
+        metrics.durations['total'] = perf_counter() - start
+        response['Server-Timing'] = metrics.get_server_timing()
+        self.check_query_budget(request, metrics)
+        return response
+
+    def process_template_response(self, request: HttpRequest, response: HttpResponse) -> HttpResponse:
+        """
+        Time the rendering of the DRF responses, which happens right after this hook.
+        """
+        metrics = _current_metrics.get()
+        if metrics is not None:
+            metrics._render_start = perf_counter()
+            response.add_post_render_callback(lambda rendered: self._stop_render_timer(metrics))
+        return response
+
+    @staticmethod
+    def _stop_render_timer(metrics: RequestMetrics) -> None:
+        metrics.durations['render'] += perf_counter() - metrics._render_start
+
+    @staticmethod
+    def check_query_budget(request: HttpRequest, metrics: RequestMetrics) -> None:
+        """
+        Log a structured warning when the request ran more queries than the budget of its view.
+        Args:
+            request (HttpRequest): The request.
+            metrics (RequestMetrics): The metrics of the request.
+        """
+        view_name = request.resolver_match.view_name if request.resolver_match else None
+        budget = settings.REQUEST_METRICS_QUERY_BUDGETS.get(view_name, settings.REQUEST_METRICS_DEFAULT_QUERY_BUDGET)
+        if budget is None or metrics.query_count <= budget:
+            return
+        logger.warning(
+            'Query budget exceeded by %s: %d queries for a budget of %d',
+            view_name, metrics.query_count, budget,
+            extra={
+                'view_name': view_name,
+                'method': request.method,
+                'path': request.path,
+                'query_count': metrics.query_count,
+                'query_budget': budget,
+                'db_ms': round(metrics.durations['db'] * 1000, 3),
+            },
+        )
@@ -0,0 +1,33 @@
+from decimal import Decimal
+
+from django.db import migrations, models
+
+
+def compute_wealth_minor(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
+    MoneyBox = apps.get_model('app', 'MoneyBox')
+    MoneyBoxContent = apps.get_model('app', 'MoneyBoxContent')
+    wealth_by_money_box = {}
+    contents = MoneyBoxContent.objects.using(db_alias).values_list('money_box_id', 'cash__value', 'amount')
+    for money_box_id, value, amount in contents:
+        wealth_by_money_box[money_box_id] = wealth_by_money_box.get(money_box_id, 0) + int(
+            (Decimal(value) * 100) * amount
+        )
+    for money_box_id, wealth_minor in wealth_by_money_box.items():
+        MoneyBox.objects.using(db_alias).filter(id=money_box_id).update(wealth_minor=wealth_minor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0003_alter_cash_options'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='moneybox',
+            name='wealth_minor',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(compute_wealth_minor, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+from django.db import migrations, models
+
+
+def merge_duplicate_contents(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
+    MoneyBoxContent = apps.get_model('app', 'MoneyBoxContent')
+    duplicates = (
+        MoneyBoxContent.objects.using(db_alias)
+        .values('money_box_id', 'cash_id')
+        .annotate(count=models.Count('id'), total=models.Sum('amount'), kept_id=models.Min('id'))
+        .filter(count__gt=1)
+    )
+    for duplicate in duplicates:
+        MoneyBoxContent.objects.using(db_alias).filter(id=duplicate['kept_id']).update(amount=duplicate['total'])
+        MoneyBoxContent.objects.using(db_alias).filter(
+            money_box_id=duplicate['money_box_id'],
+            cash_id=duplicate['cash_id'],
+        ).exclude(id=duplicate['kept_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0004_moneybox_wealth_minor'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_contents, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='moneyboxcontent',
+            constraint=models.UniqueConstraint(fields=('money_box', 'cash'), name='unique_moneybox_content_cash'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2 on 2026-10-18 01:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_moneyboxcontent_unique_moneybox_content_cash'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='moneybox',
+            index=models.Index(fields=['-created_at', '-id'], name='moneybox_created_at_id_idx'),
+        ),
+    ]
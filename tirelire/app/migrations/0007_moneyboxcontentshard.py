@@ -0,0 +1,31 @@
+# Generated by Django 4.2 on 2026-10-18 01:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_moneybox_created_at_id_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MoneyBoxContentShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('amount', models.IntegerField()),
+                ('cash', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='app.cash')),
+                ('money_box', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='app.moneybox')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='moneyboxcontentshard',
+            constraint=models.UniqueConstraint(
+                fields=('money_box', 'cash', 'shard'),
+                name='unique_moneybox_content_shard',
+            ),
+        ),
+    ]
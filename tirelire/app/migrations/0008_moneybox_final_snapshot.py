@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-18 01:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_moneyboxcontentshard'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='moneybox',
+            name='final_snapshot',
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+    ]
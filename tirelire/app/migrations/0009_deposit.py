@@ -0,0 +1,33 @@
+# Generated by Django 4.2 on 2026-10-18 01:33
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0008_moneybox_final_snapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Deposit',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.IntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('compacted', models.BooleanField(default=False)),
+                ('cash', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='app.cash')),
+                ('money_box', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='app.moneybox')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='deposit',
+            index=models.Index(
+                condition=models.Q(('compacted', False)),
+                fields=['money_box'],
+                name='deposit_uncompacted_idx',
+            ),
+        ),
+    ]
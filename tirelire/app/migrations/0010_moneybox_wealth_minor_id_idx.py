@@ -0,0 +1,17 @@
+# Generated by Django 4.2 on 2026-10-18 01:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0009_deposit'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='moneybox',
+            index=models.Index(fields=['wealth_minor', 'id'], name='moneybox_wealth_minor_id_idx'),
+        ),
+    ]
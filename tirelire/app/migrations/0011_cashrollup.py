@@ -0,0 +1,44 @@
+# Generated by Django 4.2 on 2026-10-18 01:36
+
+from django.db import migrations, models
+from django.db.models import Sum
+import django.db.models.deletion
+
+
+def build_cash_rollups(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
+    CashRollup = apps.get_model('app', 'CashRollup')
+    MoneyBoxContent = apps.get_model('app', 'MoneyBoxContent')
+    totals = (
+        MoneyBoxContent.objects.using(db_alias)
+        .values('cash_id')
+        .annotate(total=Sum('amount'))
+        .values_list('cash_id', 'total')
+    )
+    CashRollup.objects.using(db_alias).bulk_create([
+        CashRollup(cash_id=cash_id, shard=0, amount=total) for cash_id, total in totals if total
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0010_moneybox_wealth_minor_id_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CashRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('amount', models.BigIntegerField()),
+                ('cash', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='app.cash')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='cashrollup',
+            constraint=models.UniqueConstraint(fields=('cash', 'shard'), name='unique_cash_rollup_shard'),
+        ),
+        migrations.RunPython(build_cash_rollups, migrations.RunPython.noop),
+    ]
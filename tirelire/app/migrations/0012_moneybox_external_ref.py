@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-18 01:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0011_cashrollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='moneybox',
+            name='external_ref',
+            field=models.CharField(blank=True, max_length=100, null=True, unique=True),
+        ),
+    ]
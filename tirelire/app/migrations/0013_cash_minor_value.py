@@ -0,0 +1,58 @@
+# Generated by Django 4.2 on 2026-10-18 01:52
+
+from decimal import Decimal
+
+from django.db import migrations, models
+
+# Number of decimal places between the major and the minor unit of each currency, as of this migration
+MINOR_UNIT_EXPONENTS = {
+    'EUR': 2,
+}
+
+
+def convert_values_to_minor_units(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
+    Cash = apps.get_model('app', 'Cash')
+    cashes = list(Cash.objects.using(db_alias).all())
+    for cash in cashes:
+        cash.minor_value = int(cash.value.scaleb(MINOR_UNIT_EXPONENTS[cash.currency]))
+    Cash.objects.using(db_alias).bulk_update(cashes, ['minor_value'])
+
+
+def convert_values_to_major_units(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
+    Cash = apps.get_model('app', 'Cash')
+    cashes = list(Cash.objects.using(db_alias).all())
+    for cash in cashes:
+        cash.value = Decimal(cash.minor_value).scaleb(-MINOR_UNIT_EXPONENTS[cash.currency])
+    Cash.objects.using(db_alias).bulk_update(cashes, ['value'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0012_moneybox_external_ref'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cash',
+            name='minor_value',
+            field=models.PositiveIntegerField(default=0),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name='cash',
+            name='value',
+            field=models.DecimalField(decimal_places=2, max_digits=5, null=True),
+        ),
+        migrations.RunPython(convert_values_to_minor_units, convert_values_to_major_units),
+        migrations.AlterModelOptions(
+            name='cash',
+            options={'ordering': ['minor_value']},
+        ),
+        migrations.RemoveField(
+            model_name='cash',
+            name='value',
+        ),
+    ]
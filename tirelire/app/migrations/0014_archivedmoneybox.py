@@ -0,0 +1,29 @@
+# Generated by Django 4.2 on 2026-10-18 02:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0013_cash_minor_value'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedMoneyBox',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('name', models.CharField(max_length=200)),
+                ('final_snapshot', models.JSONField(blank=True, editable=False, null=True)),
+                ('external_ref', models.CharField(blank=True, max_length=100, null=True, unique=True)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='moneybox',
+            index=models.Index(condition=models.Q(('broken', True)), fields=['id'], name='moneybox_broken_id_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2 on 2026-10-18 02:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0014_archivedmoneybox'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='moneybox',
+            index=models.Index(fields=['broken', '-created_at', '-id'], name='moneybox_broken_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='moneybox',
+            index=models.Index(fields=['updated_at'], name='moneybox_updated_at_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2 on 2026-10-18 02:05
+
+from django.db import migrations
+
+# Expression index on the uppercase name which the case insensitive lookups of PostgreSQL filter on:
+# name__istartswith is supported by the pattern index, the trigram index of name__icontains is created by
+# 0018_moneybox_name_trigram_index as it needs the pg_trgm extension
+NAME_INDEXES = {
+    'moneybox_name_prefix_idx': 'USING btree (UPPER(name::text) text_pattern_ops)',
+}
+
+
+def create_name_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    table = schema_editor.quote_name(apps.get_model('app', 'MoneyBox')._meta.db_table)
+    for name, definition in NAME_INDEXES.items():
+        schema_editor.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} {definition}')
+
+
+def drop_name_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name in NAME_INDEXES:
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+    # The indexes are built concurrently, outside of a transaction, so the money boxes stay writable meanwhile
+    atomic = False
+
+    dependencies = [
+        ('app', '0015_moneybox_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_name_indexes, drop_name_indexes),
+    ]
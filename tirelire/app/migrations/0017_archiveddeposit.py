@@ -0,0 +1,27 @@
+# Generated by Django 4.2 on 2026-10-18 02:39
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0016_moneybox_name_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedDeposit',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('amount', models.IntegerField()),
+                ('created_at', models.DateTimeField()),
+                ('compacted', models.BooleanField(default=False)),
+                ('cash', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='app.cash')),
+                ('money_box', models.ForeignKey(
+                    on_delete=django.db.models.deletion.CASCADE, to='app.archivedmoneybox',
+                )),
+            ],
+        ),
+    ]
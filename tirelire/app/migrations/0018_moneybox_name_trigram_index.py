@@ -0,0 +1,39 @@
+# Generated by Django 4.2 on 2026-10-18 03:10
+
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+# Expression index on the uppercase name supporting the name__icontains lookup of PostgreSQL
+NAME_TRIGRAM_INDEX = 'moneybox_name_trgm_idx'
+
+
+def create_name_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    table = schema_editor.quote_name(apps.get_model('app', 'MoneyBox')._meta.db_table)
+    schema_editor.execute(
+        f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {NAME_TRIGRAM_INDEX} ON {table} '
+        f'USING gin (UPPER(name::text) gin_trgm_ops)'
+    )
+
+
+def drop_name_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {NAME_TRIGRAM_INDEX}')
+
+
+class Migration(migrations.Migration):
+    # The index is built concurrently, outside of a transaction, so the money boxes stay writable meanwhile
+    atomic = False
+
+    dependencies = [
+        ('app', '0017_archiveddeposit'),
+    ]
+
+    operations = [
+        # Only creates the pg_trgm extension when it is missing, which needs a role allowed to create it: where the
+        # role of the application is not, the extension has to be created beforehand in the database by one who is
+        TrigramExtension(),
+        migrations.RunPython(create_name_trigram_index, drop_name_trigram_index),
+    ]
@@ -1,8 +1,23 @@
+import random
+import time
+from collections import defaultdict
 from decimal import Decimal
-from functools import cache
-from typing import List
+from functools import reduce
+from itertools import chain
+from operator import or_
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Union
 
-from django.db import models
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, models, router, transaction
+from django.db.models import Case, F, OuterRef, Prefetch, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+from app.caches import wealth_cache
+from app.change import make_change
 
 
 class Cash(models.Model):
@@ -10,7 +25,7 @@ class Cash(models.Model):
     DB model to store all the different accepted cash values.
     """
     class Meta:
-        ordering = ['value']
+        ordering = ['minor_value']
 
     class CashTypeChoice(models.TextChoices):
         BILL = "bill"
@@ -19,6 +34,11 @@ class Cash(models.Model):
     class CurrencyChoice(models.TextChoices):
         EUR = "EUR", "€"
 
+    # Number of decimal places between the major and the minor unit of each currency (e.g. euros and cents)
+    MINOR_UNIT_EXPONENTS = {
+        CurrencyChoice.EUR: 2,
+    }
+
     cash_type = models.CharField(
         max_length=4,
         choices=CashTypeChoice.choices,
@@ -28,38 +48,258 @@ class Cash(models.Model):
         choices=CurrencyChoice.choices,
         default=CurrencyChoice.EUR
     )
-    value = models.DecimalField(max_digits=5, decimal_places=2)
+    # Value of the cash expressed in minor units of its currency (e.g. cents for euros)
+    minor_value = models.PositiveIntegerField()
+
+    @property
+    def value(self) -> Decimal:
+        """
+        Value of the cash expressed in the major unit of its currency, for the API.
+        Returns:
+            Decimal: The value in major units.
+        """
+        return self.to_major_units(self.minor_value, self.currency)
+
+    @value.setter
+    def value(self, value: Union[str, Decimal]) -> None:
+        self.minor_value = self.to_minor_units(value, self.currency)
+
+    @classmethod
+    def to_minor_units(cls, amount: Decimal, currency: str = CurrencyChoice.EUR) -> int:
+        """
+        Convert a Decimal amount of the currency's major unit into an amount of minor units.
+        Args:
+            amount (Decimal): The amount in major units.
+            currency (str): The currency of the amount.
+        Returns:
+            int: The amount in minor units.
+        """
+        return int(Decimal(amount).scaleb(cls.MINOR_UNIT_EXPONENTS[currency]))
+
+    @classmethod
+    def to_major_units(cls, minor_amount: int, currency: str = CurrencyChoice.EUR) -> Decimal:
+        """
+        Convert an amount of minor units into a Decimal amount of the currency's major unit.
+        Args:
+            minor_amount (int): The amount in minor units.
+            currency (str): The currency of the amount.
+        Returns:
+            Decimal: The amount in major units.
+        """
+        return Decimal(minor_amount).scaleb(-cls.MINOR_UNIT_EXPONENTS[currency])
 
     @classmethod
-    @cache
     def get_all(cls) -> List['Cash']:
         """
-        Retrieve all Cash objects from the database, after the first call it will return the list from the cache.
+        Retrieve all Cash objects from the cash registry, which only hits the database after a Cash change.
         Returns:
             List['Cash']: A list of Cash objects.
         """
-        return list(cls.objects.all())
+        return cash_registry.get_all()
 
     @classmethod
-    def find_from_type_and_value(cls, cash_type: str, value: str) -> 'Cash':
+    def find_from_type_and_value(
+        cls,
+        cash_type: str,
+        value: Union[str, Decimal],
+        currency: str = CurrencyChoice.EUR,
+    ) -> Optional['Cash']:
+        """
+        Find a Cash object from the cash registry based on its cash_type and value.
+        Args:
+            cash_type (str): The type of cash.
+            value (Union[str, Decimal]): The value of cash.
+            currency (str): The currency of cash.
+        Returns:
+            Optional['Cash']: The found Cash object, or None if not found.
+        """
+        return cash_registry.find(currency, cash_type, value)
+
+
+class CashRegistry:
+    """
+    In-process index of the Cash objects keyed by (currency, cash_type, value) for constant time lookups.
+    The index is cleared locally by the Cash signals, and a version stamp stored in the cache, bumped once the change
+    is committed, lets the other workers notice it, it is checked at most once every CASH_REGISTRY_CHECK_INTERVAL
+    seconds.
+    """
+    VERSION_CACHE_KEY = 'cash-registry-version'
+
+    def __init__(self):
+        # Tuple of the Cash objects list, by key and by id, replaced as a whole on reload
+        self._index = None
+        self._version = None
+        self._checked_at = None
+
+    @staticmethod
+    def make_key(currency: str, cash_type: str, value: Union[str, Decimal]) -> Tuple[str, str, Optional[int]]:
+        """
+        Build the registry key of a cash from its value in major units, equal values share the same key
+        whatever their exponent.
+        Args:
+            currency (str): The currency of cash.
+            cash_type (str): The type of cash.
+            value (Union[str, Decimal]): The value of cash.
+        Returns:
+            Tuple[str, str, Optional[int]]: The registry key, with the value in minor units or None when the value
+            is not a whole number of minor units.
+        """
+        minor_value = Decimal(value).scaleb(Cash.MINOR_UNIT_EXPONENTS[currency])
+        if not minor_value.is_finite() or minor_value != minor_value.to_integral_value():
+            return currency, cash_type, None
+        return currency, cash_type, int(minor_value)
+
+    def get_all(self) -> List[Cash]:
+        """
+        Retrieve all the registered Cash objects.
+        Returns:
+            List[Cash]: A list of Cash objects.
         """
-        Find a Cash object from the cached list based on its cash_type and value.
+        cashes, _, _ = self._get_index()
+        return cashes
+
+    def find(self, currency: str, cash_type: str, value: Union[str, Decimal]) -> Optional[Cash]:
+        """
+        Find a registered Cash object.
         Args:
+            currency (str): The currency of cash.
             cash_type (str): The type of cash.
-            value (str): The value of cash.
+            value (Union[str, Decimal]): The value of cash.
         Returns:
-            'Cash': The found Cash object, or None if not found.
+            Optional[Cash]: The found Cash object, or None if not found.
+        """
+        _, cashes_by_key, _ = self._get_index()
+        return cashes_by_key.get(self.make_key(currency, cash_type, value))
+
+    def get_by_id(self, cash_id: int) -> Optional[Cash]:
+        """
+        Find a registered Cash object by its id.
+        Args:
+            cash_id (int): The id of cash.
+        Returns:
+            Optional[Cash]: The found Cash object, or None if not found.
+        """
+        _, _, cashes_by_id = self._get_index()
+        return cashes_by_id.get(cash_id)
+
+    def clear(self) -> None:
+        """
+        Clear the registry of this worker only, it is reloaded on the next lookup.
+        Returns:
+            None
         """
-        return next(
-            (cash for cash in cls.get_all() if cash.cash_type == cash_type and cash.value == Decimal(value)),
+        self._index = None
+
+    def invalidate(self) -> None:
+        """
+        Clear the registry of this worker and bump the shared version stamp so the other workers reload theirs.
+        It should be called once the change of the Cash objects is committed, or the other workers may reload
+        the Cash objects before the change and keep them until the next one.
+        Returns:
             None
+        """
+        try:
+            cache.incr(self.VERSION_CACHE_KEY)
+        except ValueError:
+            cache.add(self.VERSION_CACHE_KEY, 1, timeout=None)
+        self.clear()
+
+    def _get_index(self) -> Tuple[List[Cash], Dict[Tuple[str, str, int], Cash], Dict[int, Cash]]:
+        index = self._index
+        now = time.monotonic()
+        if index is not None and now - self._checked_at < settings.CASH_REGISTRY_CHECK_INTERVAL:
+            return index
+        version = cache.get(self.VERSION_CACHE_KEY, 0)
+        if index is None or version != self._version:
+            cashes = list(Cash.objects.all())
+            index = (
+                cashes,
+                {(cash.currency, cash.cash_type, cash.minor_value): cash for cash in cashes},
+                {cash.id: cash for cash in cashes},
+            )
+            self._index = index
+            self._version = version
+        self._checked_at = now
+        return index
+
+
+cash_registry = CashRegistry()
+
+
+class MoneyBoxQuerySet(models.QuerySet):
+
+    def lock_ids_for_share(self) -> Set[int]:
+        """
+        Lock the money boxes of the QuerySet, ordered by id, and return their ids. On PostgreSQL the rows are locked
+        with FOR SHARE, which does not block the other shared locks but conflicts with select_for_update, other
+        databases take the lock of select_for_update. It should be called inside a transaction.
+        Returns:
+            Set[int]: The ids of the locked money boxes.
+        """
+        database = self._db or router.db_for_write(self.model, **self._hints)
+        queryset = self.using(database).order_by('id').values_list('id', flat=True)
+        connection = connections[database]
+        if connection.vendor != 'postgresql':
+            return set(queryset.select_for_update())
+        sql, params = queryset.query.get_compiler(database).as_sql()
+        with connection.cursor() as cursor:
+            cursor.execute(f'{sql} FOR SHARE', params)
+            return {money_box_id for money_box_id, in cursor.fetchall()}
+
+    def with_wealth(self) -> 'MoneyBoxQuerySet':
+        """
+        Annotate the current wealth in minor units of the money boxes, computed in the database so it can be
+        filtered and ordered on: the wealth column plus, in the sharded and ledger deposit modes,
+        the amounts not compacted yet.
+        Returns:
+            MoneyBoxQuerySet: The money boxes annotated with current_wealth_minor.
+        """
+        pending_queryset = self.model.get_pending_queryset()
+        if pending_queryset is None:
+            return self.annotate(current_wealth_minor=F('wealth_minor'))
+        pending_wealth_minor = (
+            pending_queryset
+            .filter(money_box=OuterRef('pk'))
+            .order_by()
+            .values('money_box')
+            .annotate(total=Sum(F('amount') * F('cash__minor_value'), output_field=models.BigIntegerField()))
+            .values('total')
         )
+        return self.annotate(current_wealth_minor=Case(
+            # The pending rows of a broken money box were written by deposits racing its break before the deposits
+            # locked the money boxes, see compact_pending_amounts
+            When(broken=True, then=F('wealth_minor')),
+            default=F('wealth_minor') + Coalesce(Subquery(pending_wealth_minor), 0),
+            output_field=models.BigIntegerField(),
+        ))
 
 
 class MoneyBox(models.Model):
     """
     DB model to store all the money boxes where you can save cash until it is broken.
     """
+    class Meta:
+        indexes = [
+            # Supports the keyset pagination of the list endpoint
+            models.Index(fields=['-created_at', '-id'], name='moneybox_created_at_id_idx'),
+            # Supports the ordering and the filtering on the wealth of the list endpoint
+            models.Index(fields=['wealth_minor', 'id'], name='moneybox_wealth_minor_id_idx'),
+            # Supports the scan of the broken money boxes to archive, which are few next to the live ones
+            models.Index(fields=['id'], condition=Q(broken=True), name='moneybox_broken_id_idx'),
+            # Support the broken and updated_since filters of the list endpoint, the created_at range filter is
+            # supported by moneybox_created_at_id_idx, the name filters by PostgreSQL indexes of migration 0016
+            models.Index(fields=['broken', '-created_at', '-id'], name='moneybox_broken_created_idx'),
+            models.Index(fields=['updated_at'], name='moneybox_updated_at_idx'),
+        ]
+
+    class DepositModeChoice(models.TextChoices):
+        # Deposits increment the MoneyBoxContent rows and the wealth column with database-side atomic increments
+        ATOMIC = "atomic"
+        # Deposits increment one of several MoneyBoxContentShard rows, compacted later by a background job
+        SHARDED = "sharded"
+        # Deposits are appended to the Deposit ledger, compacted later by a background job
+        LEDGER = "ledger"
+
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     name = models.CharField(max_length=200)
@@ -69,31 +309,190 @@ class MoneyBox(models.Model):
         through_fields=("money_box", "cash"),
     )
     broken = models.BooleanField(default=False)
+    # Denormalized total of the contents in minor units, maintained by save_money and break_moneybox
+    wealth_minor = models.BigIntegerField(default=0)
+    # Wealth in minor units and [cash id, amount] pairs of the contents when the money box was broken
+    final_snapshot = models.JSONField(null=True, blank=True, editable=False)
+    # Reference of the money box in an external system, used to match the rows of the bulk imports
+    external_ref = models.CharField(max_length=100, unique=True, null=True, blank=True)
+
+    objects = MoneyBoxQuerySet.as_manager()
 
     @property
-    def moneyboxcontent_set_ordered(self) -> models.QuerySet:
+    def moneyboxcontent_set_ordered(self) -> Union[models.QuerySet, List['MoneyBoxContent']]:
         """
         Retrieve the MoneyBoxContent objects associated with the MoneyBox object,
         ordered by the value of the corresponding Cash objects.
+        In the sharded and ledger deposit modes the amounts not compacted yet are merged into them.
+        Returns:
+            Union[QuerySet, List[MoneyBoxContent]]: The MoneyBoxContent objects, ordered by cash value,
+            or the list prefetched by ordered_contents_prefetch, always empty for a broken money box.
+        """
+        if self.broken:
+            return []
+        if hasattr(self, 'prefetched_contents_ordered'):
+            moneybox_contents = self.prefetched_contents_ordered
+        else:
+            moneybox_contents = self.moneyboxcontent_set.select_related('cash').order_by('cash__minor_value')
+        if not self.pending_amounts:
+            return moneybox_contents
+        amounts_by_cash = {moneybox_content.cash_id: moneybox_content.amount for moneybox_content in moneybox_contents}
+        for cash_id, amount in self.pending_amounts.items():
+            amounts_by_cash[cash_id] = amounts_by_cash.get(cash_id, 0) + amount
+        return sorted(
+            (
+                MoneyBoxContent(money_box=self, cash=cash_registry.get_by_id(cash_id), amount=amount)
+                for cash_id, amount in amounts_by_cash.items()
+            ),
+            key=lambda moneybox_content: moneybox_content.cash.minor_value,
+        )
+
+    @classmethod
+    def get_pending_queryset(cls) -> Optional[models.QuerySet]:
+        """
+        Rows of the amounts deposited and not compacted into the MoneyBoxContent objects yet in the deposit mode:
+        the MoneyBoxContentShard objects in the sharded mode and the uncompacted Deposit objects in the ledger mode.
+        Returns:
+            Optional[QuerySet]: The rows of all the money boxes, None in the atomic deposit mode.
+        """
+        if settings.MONEYBOX_DEPOSIT_MODE == cls.DepositModeChoice.SHARDED:
+            return MoneyBoxContentShard.objects.all()
+        if settings.MONEYBOX_DEPOSIT_MODE == cls.DepositModeChoice.LEDGER:
+            return Deposit.objects.filter(compacted=False)
+        return None
+
+    def _get_pending_amounts_queryset(self) -> Optional[models.QuerySet]:
+        pending_queryset = self.get_pending_queryset()
+        if pending_queryset is None or self.broken:
+            return None
+        return (
+            pending_queryset
+            .filter(money_box=self)
+            .values('cash_id')
+            .annotate(total=Sum('amount'))
+            .values_list('cash_id', 'total')
+        )
+
+    @cached_property
+    def pending_amounts(self) -> Dict[int, int]:
+        """
+        Amounts deposited in the sharded counters or the ledger and not compacted into the MoneyBoxContent objects yet.
+        Returns:
+            Dict[int, int]: The pending amounts by cash id, always empty in the atomic deposit mode
+            and for a broken money box.
+        """
+        pending_amounts_queryset = self._get_pending_amounts_queryset()
+        return dict(pending_amounts_queryset) if pending_amounts_queryset is not None else {}
+
+    async def aload_contents(self) -> None:
+        """
+        Load the ordered MoneyBoxContent objects, and the pending amounts in the sharded and ledger deposit modes,
+        with the async ORM so moneyboxcontent_set_ordered and wealth can be read without any query afterwards.
+        Returns:
+            None
+        """
+        self.prefetched_contents_ordered = [
+            moneybox_content async for moneybox_content in
+            self.moneyboxcontent_set.select_related('cash').order_by('cash__minor_value').aiterator()
+        ]
+        self.pending_amounts = {}
+        pending_amounts_queryset = self._get_pending_amounts_queryset()
+        if pending_amounts_queryset is not None:
+            async for cash_id, total in pending_amounts_queryset.aiterator():
+                self.pending_amounts[cash_id] = total
+
+    def clear_loaded_contents(self) -> None:
+        """
+        Forget the contents, pending amounts and annotated wealth loaded on the MoneyBox object, after they changed.
+        Returns:
+            None
+        """
+        self.__dict__.pop('current_wealth_minor', None)
+        self.__dict__.pop('pending_amounts', None)
+        self.__dict__.pop('prefetched_contents_ordered', None)
+
+    @staticmethod
+    def ordered_contents_prefetch() -> Prefetch:
+        """
+        Prefetch of the MoneyBoxContent objects ordered by cash value, served by moneyboxcontent_set_ordered.
+        Returns:
+            Prefetch: The prefetch to give to prefetch_related.
+        """
+        return Prefetch(
+            'moneyboxcontent_set',
+            queryset=MoneyBoxContent.objects.select_related('cash').order_by('cash__minor_value'),
+            to_attr='prefetched_contents_ordered',
+        )
+
+    @property
+    def etag(self) -> str:
+        """
+        Entity tag of the MoneyBox object, derived from its last update which every write bumps.
         Returns:
-            QuerySet: A QuerySet of MoneyBoxContent objects, ordered by cash value.
+            str: The quoted entity tag.
         """
-        return self.moneyboxcontent_set.order_by('cash__value')
+        return f'"{self.id}-{self.updated_at.strftime("%Y%m%d%H%M%S%f")}"'
 
     @property
     def wealth(self) -> Decimal:
         """
-        Calculate the total wealth associated with the MoneyBox object,
-        by summing up the value of the Cash objects in the MoneyBoxContent objects.
+        Total wealth associated with the MoneyBox object, read from the persisted wealth column
+        plus the amounts not compacted yet in the sharded and ledger deposit modes,
+        or from the annotation of MoneyBoxQuerySet.with_wealth when the MoneyBox object was fetched with it.
         Returns:
             Decimal: The total wealth.
         """
-        wealth_total = Decimal('0')
-        for moneybox_content in self.moneyboxcontent_set.select_related('cash'):
-            wealth_total += moneybox_content.cash.value * moneybox_content.amount
-        return wealth_total
+        if hasattr(self, 'current_wealth_minor'):
+            return Cash.to_major_units(self.current_wealth_minor)
+        pending_wealth_minor = sum(
+            cash_registry.get_by_id(cash_id).minor_value * amount for cash_id, amount in self.pending_amounts.items()
+        )
+        return Cash.to_major_units(self.wealth_minor + pending_wealth_minor)
+
+    @property
+    def final_contents(self) -> List['MoneyBoxContent']:
+        """
+        Unsaved MoneyBoxContent objects of the contents the money box held when it was broken,
+        built from its final snapshot without any query on the contents table.
+        Returns:
+            List[MoneyBoxContent]: The final contents ordered by cash value, empty if the money box is not broken.
+        """
+        if self.final_snapshot is None:
+            return []
+        return [
+            MoneyBoxContent(money_box=self, cash=cash_registry.get_by_id(cash_id), amount=amount)
+            for cash_id, amount in self.final_snapshot['cashes']
+        ]
+
+    @property
+    def final_wealth(self) -> Decimal:
+        """
+        Total wealth the money box held when it was broken, read from its final snapshot.
+        Returns:
+            Decimal: The final wealth, zero if the money box is not broken.
+        """
+        return Cash.to_major_units(self.final_snapshot['wealth_minor'] if self.final_snapshot is not None else 0)
+
+    @classmethod
+    def compute_wealth_minor(cls, money_box_ids: Iterable[int]) -> Dict[int, int]:
+        """
+        Compute the total wealth in minor units of the given money boxes from their MoneyBoxContent objects,
+        used to rebuild or verify the persisted wealth column.
+        Args:
+            money_box_ids (Iterable[int]): The ids of the money boxes.
+        Returns:
+            Dict[int, int]: The total wealth in minor units by money box id, money boxes without content are omitted.
+        """
+        totals = (
+            MoneyBoxContent.objects
+            .filter(money_box_id__in=money_box_ids)
+            .values('money_box_id')
+            .annotate(total=Sum(F('amount') * F('cash__minor_value'), output_field=models.BigIntegerField()))
+            .values_list('money_box_id', 'total')
+        )
+        return dict(totals)
 
-    def save_money(self, cashes_to_add: List[dict]) -> None:
+    def save_money(self, cashes_to_add: List[dict]) -> bool:
         """
         Add cash to the MoneyBox object.
         Args:
@@ -101,43 +500,598 @@ class MoneyBox(models.Model):
             A list of dictionaries containing the details of cash to be added.
             Each dictionary should have keys 'cash_type', 'value', and 'amount'.
         Returns:
-            None
+            bool: False if nothing was added because the money box was broken, or archived, in the meantime.
         """
-        existing_moneybox_contents = list(self.moneyboxcontent_set.select_related('cash').all())
-        for cash_to_add in cashes_to_add:
-            cash_object = Cash.find_from_type_and_value(cash_to_add['cash_type'], cash_to_add['value'])
-            existing_moneybox_content = next(
-                (
-                    moneybox_content for moneybox_content in existing_moneybox_contents
-                    if moneybox_content.cash == cash_object
-                ),
-                None
+        if self.id in self.bulk_save_money({self.id: cashes_to_add}):
+            return False
+        self.refresh_from_db(fields=['wealth_minor', 'updated_at'])
+        self.clear_loaded_contents()
+        return True
+
+    async def asave_money(self, cashes_to_add: List[dict]) -> bool:
+        """
+        Async version of save_money, which runs in a thread since the async ORM does not support transactions yet.
+        Args:
+            cashes_to_add (List[dict]): The details of cash to be added, see save_money.
+        Returns:
+            bool: False if nothing was added because the money box was broken, or archived, in the meantime.
+        """
+        return await sync_to_async(self.save_money)(cashes_to_add)
+
+    @classmethod
+    def bulk_save_money(cls, cashes_to_add_by_money_box: Dict[int, List[dict]]) -> Set[int]:
+        """
+        Add cash to several MoneyBox objects at once, with set-based statements inside a single transaction.
+        The money boxes broken, or archived, since they were checked by the caller are skipped.
+        Args:
+            cashes_to_add_by_money_box (Dict[int, List[dict]]):
+            The details of cash to be added by money box id, see save_money.
+        Returns:
+            Set[int]: The ids of the money boxes skipped, nothing was added to them.
+        """
+        amounts_to_add = defaultdict(int)
+        wealth_deltas = defaultdict(int)
+        for money_box_id, cashes_to_add in cashes_to_add_by_money_box.items():
+            for cash_to_add in cashes_to_add:
+                cash_object = Cash.find_from_type_and_value(cash_to_add['cash_type'], cash_to_add['value'])
+                amounts_to_add[(money_box_id, cash_object.id)] += cash_to_add['amount']
+                wealth_deltas[money_box_id] += cash_object.minor_value * cash_to_add['amount']
+        if not wealth_deltas:
+            return set()
+        if settings.MONEYBOX_DEPOSIT_MODE != cls.DepositModeChoice.ATOMIC:
+            with transaction.atomic():
+                # The money boxes rows are only updated by the compaction in these modes, the deposits lock them
+                # with a shared lock so they do not wait for each other, but a break, which locks them exclusively,
+                # either waits for the deposit to be committed or is committed before the deposit checks them
+                unbroken_money_box_ids = cls.objects.filter(id__in=wealth_deltas, broken=False).lock_ids_for_share()
+                amounts_to_add = {
+                    (money_box_id, cash_id): amount
+                    for (money_box_id, cash_id), amount in amounts_to_add.items()
+                    if money_box_id in unbroken_money_box_ids
+                }
+                if settings.MONEYBOX_DEPOSIT_MODE == cls.DepositModeChoice.SHARDED:
+                    # Spread the writes on random shards
+                    shard = random.randrange(settings.MONEYBOX_COUNTER_SHARDS)
+                    MoneyBoxContentShard.objects.add_amounts({
+                        (money_box_id, cash_id, shard): amount
+                        for (money_box_id, cash_id), amount in amounts_to_add.items()
+                    })
+                else:
+                    # Only insert into the ledger, inserts never conflict
+                    Deposit.objects.bulk_create([
+                        Deposit(money_box_id=money_box_id, cash_id=cash_id, amount=amount)
+                        for (money_box_id, cash_id), amount in amounts_to_add.items()
+                    ])
+            return set(wealth_deltas) - unbroken_money_box_ids
+        with transaction.atomic():
+            # Lock the money boxes before the contents like break_moneybox does, and check again they are not broken
+            # once locked since a break may have been committed after the caller checked them
+            unbroken_money_box_ids = set(
+                cls.objects
+                .select_for_update()
+                .filter(id__in=wealth_deltas, broken=False)
+                .order_by('id')
+                .values_list('id', flat=True)
             )
-            if existing_moneybox_content:
-                existing_moneybox_content.amount += cash_to_add['amount']
-                existing_moneybox_content.save()
-            else:
-                new_money_box = MoneyBoxContent(cash=cash_object, amount=cash_to_add['amount'])
-                self.moneyboxcontent_set.add(new_money_box, bulk=False)
-                existing_moneybox_contents.append(new_money_box)
-        self.save()
+            unbroken_wealth_deltas = {
+                money_box_id: delta for money_box_id, delta in wealth_deltas.items()
+                if money_box_id in unbroken_money_box_ids
+            }
+            amounts_to_add = {
+                (money_box_id, cash_id): amount
+                for (money_box_id, cash_id), amount in amounts_to_add.items()
+                if money_box_id in unbroken_money_box_ids
+            }
+            if unbroken_wealth_deltas:
+                cls._increment_wealth(unbroken_wealth_deltas)
+                MoneyBoxContent.objects.add_amounts(amounts_to_add)
+                CashRollup.record_contents_amounts(amounts_to_add)
+                transaction.on_commit(lambda: wealth_cache.delete_many(unbroken_wealth_deltas))
+        return set(wealth_deltas) - unbroken_money_box_ids
+
+    @classmethod
+    def compact_pending_amounts(cls, money_box_ids: Iterable[int]) -> int:
+        """
+        Fold the sharded counters and the uncompacted ledger deposits of the given money boxes into their
+        MoneyBoxContent objects and wealth column.
+        Args:
+            money_box_ids (Iterable[int]): The ids of the money boxes to compact.
+        Returns:
+            int: The number of sharded counters and ledger deposits compacted.
+        """
+        with transaction.atomic():
+            # Lock the money boxes before the pending rows like break_moneybox does. The deposits lock them too, so
+            # a broken money box only has pending rows written by deposits racing its break before they locked the
+            # money boxes, these rows are not folded
+            unbroken_money_box_ids = set(
+                cls.objects
+                .select_for_update()
+                .filter(id__in=money_box_ids, broken=False)
+                .order_by('id')
+                .values_list('id', flat=True)
+            )
+            # Lock the shards so concurrent deposits into them wait for the compaction to be committed
+            shards = list(
+                MoneyBoxContentShard.objects
+                .select_for_update()
+                .filter(money_box_id__in=money_box_ids)
+                .values_list('id', 'money_box_id', 'cash_id', 'amount')
+            )
+            deposits = list(
+                Deposit.objects
+                .select_for_update()
+                .filter(money_box_id__in=money_box_ids, compacted=False)
+                .values_list('id', 'money_box_id', 'cash_id', 'amount')
+            )
+            amounts_to_add = defaultdict(int)
+            wealth_deltas = defaultdict(int)
+            for _, money_box_id, cash_id, amount in chain(shards, deposits):
+                if money_box_id not in unbroken_money_box_ids:
+                    continue
+                amounts_to_add[(money_box_id, cash_id)] += amount
+                wealth_deltas[money_box_id] += cash_registry.get_by_id(cash_id).minor_value * amount
+            MoneyBoxContentShard.objects.filter(id__in=[shard_id for shard_id, _, _, _ in shards]).delete()
+            # The ledger is append-only, the compacted deposits are kept as the history of the money boxes
+            Deposit.objects.filter(id__in=[deposit_id for deposit_id, _, _, _ in deposits]).update(compacted=True)
+            cls._increment_wealth(wealth_deltas)
+            MoneyBoxContent.objects.add_amounts(amounts_to_add)
+            CashRollup.record_contents_amounts(amounts_to_add)
+        return len(shards) + len(deposits)
+
+    @classmethod
+    def _increment_wealth(cls, wealth_deltas: Dict[int, int]) -> None:
+        if not wealth_deltas:
+            return
+        # Increment in the database so concurrent deposits cannot overwrite each other's total
+        cls.objects.filter(id__in=wealth_deltas).update(
+            wealth_minor=F('wealth_minor') + Case(
+                *(When(id=money_box_id, then=Value(delta)) for money_box_id, delta in wealth_deltas.items()),
+                output_field=models.BigIntegerField(),
+            ),
+            updated_at=timezone.now(),
+        )
+
+    def withdraw_money(self, amount_minor: int) -> Optional[List['MoneyBoxContent']]:
+        """
+        Withdraw an amount from the MoneyBox with as few pieces as possible, picked from its contents by make_change,
+        in a single transaction. In the sharded and ledger deposit modes, the pending deposits are compacted first.
+        Args:
+            amount_minor (int): The amount to withdraw, in minor units.
+        Returns:
+            Optional[List[MoneyBoxContent]]: Unsaved MoneyBoxContent objects of the pieces withdrawn ordered by cash
+            value, or None if the amount cannot be made from the contents or the money box is broken.
+        """
+        with transaction.atomic():
+            if settings.MONEYBOX_DEPOSIT_MODE != self.DepositModeChoice.ATOMIC:
+                self.compact_pending_amounts([self.id])
+            # Lock the money box before its contents like the deposits and break_moneybox do
+            self.broken = MoneyBox.objects.select_for_update().values_list('broken', flat=True).get(id=self.id)
+            if self.broken:
+                return None
+            contents = dict(
+                self.moneyboxcontent_set.select_for_update().order_by('cash_id').values_list('cash_id', 'amount')
+            )
+            cashes_by_minor_value = {cash_registry.get_by_id(cash_id).minor_value: cash_id for cash_id in contents}
+            pieces = make_change(
+                amount_minor,
+                {minor_value: contents[cash_id] for minor_value, cash_id in cashes_by_minor_value.items()},
+            )
+            if pieces is None:
+                return None
+            amounts_withdrawn = {
+                (self.id, cashes_by_minor_value[minor_value]): -count for minor_value, count in pieces.items()
+            }
+            self._increment_wealth({self.id: -amount_minor})
+            MoneyBoxContent.objects.add_amounts(amounts_withdrawn)
+            self.moneyboxcontent_set.filter(amount=0).delete()
+            CashRollup.record_contents_amounts(amounts_withdrawn)
+            transaction.on_commit(lambda: wealth_cache.delete_many([self.id]))
+        self.refresh_from_db(fields=['wealth_minor', 'updated_at'])
+        self.clear_loaded_contents()
+        return [
+            MoneyBoxContent(
+                money_box=self, cash=cash_registry.get_by_id(cashes_by_minor_value[minor_value]), amount=count,
+            )
+            for minor_value, count in sorted(pieces.items())
+        ]
 
     def break_moneybox(self) -> None:
         """
-        Empty the MoneyBox by deleting all MoneyBoxContent objects associated with it,
-        and mark the MoneyBox as broken.
+        Empty the MoneyBox by deleting all MoneyBoxContent objects associated with it, and mark the MoneyBox as broken
+        with a snapshot of its final contents built from the deleted rows, in a single transaction.
+        The uncompacted ledger deposits are included in the snapshot and marked as compacted.
+        Breaking a money box which is already broken keeps its first snapshot.
+        Returns:
+            None
+        """
+        with transaction.atomic():
+            # Lock the money box first so the deposits, which update it before the contents, wait for the break
+            self.broken = MoneyBox.objects.select_for_update().values_list('broken', flat=True).get(id=self.id)
+            if self.broken:
+                self.refresh_from_db(fields=['wealth_minor', 'final_snapshot', 'updated_at'])
+                return
+            amounts_by_cash = defaultdict(int)
+            contents = self.moneyboxcontent_set.all().delete_returning('cash_id', 'amount')
+            shards = self.moneyboxcontentshard_set.all().delete_returning('cash_id', 'amount')
+            for cash_id, amount in chain(contents, shards):
+                amounts_by_cash[cash_id] += amount
+            # Only the compacted contents are counted in the rollups
+            CashRollup.record_contents_amounts({(self.id, cash_id): -amount for cash_id, amount in contents})
+            deposits = list(
+                self.deposit_set.select_for_update().filter(compacted=False).values_list('id', 'cash_id', 'amount')
+            )
+            for _, cash_id, amount in deposits:
+                amounts_by_cash[cash_id] += amount
+            Deposit.objects.filter(id__in=[deposit_id for deposit_id, _, _ in deposits]).update(compacted=True)
+            cashes = sorted(
+                ([cash_id, amount] for cash_id, amount in amounts_by_cash.items() if amount),
+                key=lambda cash_amount: cash_registry.get_by_id(cash_amount[0]).minor_value,
+            )
+            self.final_snapshot = {
+                'wealth_minor': sum(
+                    cash_registry.get_by_id(cash_id).minor_value * amount for cash_id, amount in cashes
+                ),
+                'cashes': cashes,
+            }
+            self.broken = True
+            self.wealth_minor = 0
+            self.save(update_fields=['broken', 'wealth_minor', 'final_snapshot', 'updated_at'])
+            transaction.on_commit(lambda: wealth_cache.delete_many([self.id]))
+        self.clear_loaded_contents()
+
+    async def abreak_moneybox(self) -> None:
+        """
+        Async version of break_moneybox, which runs in a thread since the async ORM does not support transactions yet.
+        Returns:
+            None
+        """
+        await sync_to_async(self.break_moneybox)()
+
+
+class CounterQuerySet(models.QuerySet):
+    """
+    QuerySet of counter rows holding an amount, identified by the fields listed in the model's COUNTER_KEY_FIELDS
+    which must be covered by a unique constraint.
+    """
+
+    def add_amounts(self, amounts_to_add: Dict[Tuple[int, ...], int]) -> None:
+        """
+        Merge amounts into the counters, creating the missing rows.
+        On PostgreSQL the whole payload is merged with a single INSERT ... ON CONFLICT DO UPDATE statement,
+        other databases use a portable UPDATE followed by a bulk INSERT of the missing rows.
+        It should be called inside a transaction.
+        Args:
+            amounts_to_add (Dict[Tuple[int, ...], int]):
+            The amounts to add by counter key, e.g. (money_box_id, cash_id).
         Returns:
             None
         """
-        self.moneyboxcontent_set.all().delete()
-        self.broken = True
-        self.save()
+        if not amounts_to_add:
+            return
+        connection = connections[self.db]
+        if connection.vendor == 'postgresql':
+            self._upsert_amounts(connection, amounts_to_add)
+        else:
+            self._merge_amounts(amounts_to_add)
+
+    def delete_returning(self, *field_names: str) -> List[tuple]:
+        """
+        Delete the rows of the QuerySet and return the values of the given fields of the deleted rows.
+        On databases supporting it the rows are deleted and returned by a single DELETE ... RETURNING statement,
+        other databases lock and read the rows before deleting them. It should be called inside a transaction.
+        Args:
+            *field_names (str): The names of the fields to return, e.g. 'cash_id' and 'amount'.
+        Returns:
+            List[tuple]: The values of the fields of each deleted row.
+        """
+        connection = connections[self.db]
+        if not connection.features.can_return_rows_from_bulk_insert:
+            rows = list(self.select_for_update().values_list('pk', *field_names))
+            self.model.objects.filter(pk__in=[row[0] for row in rows]).delete()
+            return [row[1:] for row in rows]
+        quote_name = connection.ops.quote_name
+        table = quote_name(self.model._meta.db_table)
+        pk_column = quote_name(self.model._meta.pk.column)
+        columns = ', '.join(quote_name(self.model._meta.get_field(field_name).column) for field_name in field_names)
+        pks_sql, params = self.values('pk').query.get_compiler(self.db).as_sql()
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {table} WHERE {pk_column} IN ({pks_sql}) RETURNING {columns}', params)
+            return cursor.fetchall()
+
+    def _get_key_attnames(self) -> List[str]:
+        return [self.model._meta.get_field(field_name).attname for field_name in self.model.COUNTER_KEY_FIELDS]
+
+    def _upsert_amounts(self, connection, amounts_to_add: Dict[Tuple[int, ...], int]) -> None:
+        quote_name = connection.ops.quote_name
+        table = quote_name(self.model._meta.db_table)
+        key_columns = ', '.join(
+            quote_name(self.model._meta.get_field(field_name).column) for field_name in self.model.COUNTER_KEY_FIELDS
+        )
+        amount_column = quote_name(self.model._meta.get_field('amount').column)
+        row_sql = '({})'.format(', '.join(['%s'] * (len(self.model.COUNTER_KEY_FIELDS) + 1)))
+        values_sql = ', '.join([row_sql] * len(amounts_to_add))
+        params = [param for key, amount in amounts_to_add.items() for param in (*key, amount)]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} ({key_columns}, {amount_column}) VALUES {values_sql} '
+                f'ON CONFLICT ({key_columns}) '
+                f'DO UPDATE SET {amount_column} = {table}.{amount_column} + EXCLUDED.{amount_column}',
+                params,
+            )
+
+    def _merge_amounts(self, amounts_to_add: Dict[Tuple[int, ...], int]) -> None:
+        key_attnames = self._get_key_attnames()
+        existing_keys = set(
+            self.select_for_update()
+            .filter(**{
+                f'{attname}__in': {key[index] for key in amounts_to_add}
+                for index, attname in enumerate(key_attnames)
+            })
+            .values_list(*key_attnames)
+        ) & amounts_to_add.keys()
+        if existing_keys:
+            self.filter(
+                reduce(or_, (Q(**dict(zip(key_attnames, key))) for key in existing_keys))
+            ).update(amount=F('amount') + Case(
+                *(
+                    When(**dict(zip(key_attnames, key)), then=Value(amounts_to_add[key]))
+                    for key in existing_keys
+                ),
+                output_field=models.BigIntegerField(),
+            ))
+        self.bulk_create([
+            self.model(**dict(zip(key_attnames, key)), amount=amount)
+            for key, amount in amounts_to_add.items()
+            if key not in existing_keys
+        ])
 
 
 class MoneyBoxContent(models.Model):
     """
     DB model that keeps a record of the amount of each cash value against a money box.
     """
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['money_box', 'cash'], name='unique_moneybox_content_cash'),
+        ]
+
+    COUNTER_KEY_FIELDS = ('money_box', 'cash')
+
+    objects = CounterQuerySet.as_manager()
+
+    money_box = models.ForeignKey(MoneyBox, on_delete=models.CASCADE)
+    cash = models.ForeignKey(Cash, on_delete=models.CASCADE)
+    amount = models.IntegerField()
+
+
+class MoneyBoxContentShard(models.Model):
+    """
+    DB model of the sharded counters used by the 'sharded' deposit mode: each deposit increments one of
+    MONEYBOX_COUNTER_SHARDS rows per money box and cash instead of the single MoneyBoxContent row,
+    the shards are summed on read and compacted into MoneyBoxContent by the compact_moneybox_counters command.
+    """
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['money_box', 'cash', 'shard'],
+                name='unique_moneybox_content_shard',
+            ),
+        ]
+
+    COUNTER_KEY_FIELDS = ('money_box', 'cash', 'shard')
+
+    objects = CounterQuerySet.as_manager()
+
     money_box = models.ForeignKey(MoneyBox, on_delete=models.CASCADE)
     cash = models.ForeignKey(Cash, on_delete=models.CASCADE)
+    shard = models.PositiveSmallIntegerField()
+    amount = models.IntegerField()
+
+
+class Deposit(models.Model):
+    """
+    DB model of the append-only deposit ledger used by the 'ledger' deposit mode: each deposit inserts one row per
+    money box and cash, the uncompacted rows are summed on read and folded into MoneyBoxContent by the
+    compact_moneybox_counters command, which keeps them as the history of the money boxes.
+    """
+    class Meta:
+        indexes = [
+            # Supports the reads and the compaction of the uncompacted tail of the ledger
+            models.Index(fields=['money_box'], condition=Q(compacted=False), name='deposit_uncompacted_idx'),
+        ]
+
+    money_box = models.ForeignKey(MoneyBox, on_delete=models.CASCADE)
+    cash = models.ForeignKey(Cash, on_delete=models.CASCADE)
+    amount = models.IntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    compacted = models.BooleanField(default=False)
+
+
+class CashRollup(models.Model):
+    """
+    DB model of the rollup of the amount of each cash held in the MoneyBoxContent objects of all the money boxes,
+    updated with them by the atomic deposits, the compactions and the breaks, and rebuilt by the
+    rebuild_cash_rollups command. Each cash is spread on MONEYBOX_COUNTER_SHARDS rows so concurrent deposits do not
+    all wait on the same row, the statistics sum them which reads a bounded number of rows.
+    """
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['cash', 'shard'], name='unique_cash_rollup_shard'),
+        ]
+
+    COUNTER_KEY_FIELDS = ('cash', 'shard')
+
+    objects = CounterQuerySet.as_manager()
+
+    cash = models.ForeignKey(Cash, on_delete=models.CASCADE)
+    shard = models.PositiveSmallIntegerField()
+    amount = models.BigIntegerField()
+
+    @classmethod
+    def record_contents_amounts(cls, amounts_added: Dict[Tuple[int, int], int]) -> None:
+        """
+        Add the amounts added to the MoneyBoxContent objects to the rollups, in a random shard.
+        It should be called inside the transaction changing the contents.
+        Args:
+            amounts_added (Dict[Tuple[int, int], int]): The amounts added by (money_box_id, cash_id),
+            negative for removed amounts.
+        Returns:
+            None
+        """
+        amounts_by_cash = defaultdict(int)
+        for (_, cash_id), amount in amounts_added.items():
+            amounts_by_cash[cash_id] += amount
+        shard = random.randrange(settings.MONEYBOX_COUNTER_SHARDS)
+        # The rows are always written in the order of the cashes so concurrent transactions cannot deadlock on them
+        cls.objects.add_amounts({
+            (cash_id, shard): amounts_by_cash[cash_id]
+            for cash_id in sorted(amounts_by_cash)
+            if amounts_by_cash[cash_id]
+        })
+
+    @classmethod
+    def get_amounts(cls) -> Dict[int, int]:
+        """
+        Total amount of each cash held in the contents of all the money boxes.
+        Returns:
+            Dict[int, int]: The amounts by cash id, the cashes never deposited are omitted.
+        """
+        return dict(cls.objects.values('cash_id').annotate(total=Sum('amount')).values_list('cash_id', 'total'))
+
+    @classmethod
+    def get_statistics(cls) -> dict:
+        """
+        Statistics of all the money boxes: the total wealth of each currency and the amount of each cash,
+        computed from the rollups whatever the number of money boxes.
+        Returns:
+            dict: The 'currencies' list of currency and wealth dictionaries,
+            and the 'cashes' list of unsaved MoneyBoxContent objects ordered by cash value.
+        """
+        amounts_by_cash = cls.get_amounts()
+        cashes = [MoneyBoxContent(cash=cash, amount=amounts_by_cash.get(cash.id, 0)) for cash in Cash.get_all()]
+        wealth_minor_by_currency = defaultdict(int)
+        for content in cashes:
+            wealth_minor_by_currency[content.cash.currency] += content.cash.minor_value * content.amount
+        return {
+            'currencies': [
+                {'currency': currency, 'wealth': Cash.to_major_units(wealth_minor, currency)}
+                for currency, wealth_minor in sorted(wealth_minor_by_currency.items())
+            ],
+            'cashes': cashes,
+        }
+
+
+class ArchivedMoneyBox(models.Model):
+    """
+    DB model to store the broken money boxes moved out of the MoneyBox table by the archive_moneyboxes command,
+    with the id and the final snapshot they had, so the live table only holds the money boxes still in use
+    while the archived ones can still be retrieved.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    created_at = models.DateTimeField()
+    # Last update of the money box, which was its break
+    updated_at = models.DateTimeField()
+    name = models.CharField(max_length=200)
+    final_snapshot = models.JSONField(null=True, blank=True, editable=False)
+    # Kept so the bulk imports keep ignoring the deposits into the archived money boxes
+    external_ref = models.CharField(max_length=100, unique=True, null=True, blank=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def to_money_box(self) -> MoneyBox:
+        """
+        Build the broken MoneyBox object the archived money box was, without saving it.
+        Returns:
+            MoneyBox: The unsaved broken MoneyBox object.
+        """
+        return MoneyBox(
+            id=self.id,
+            created_at=self.created_at,
+            updated_at=self.updated_at,
+            name=self.name,
+            broken=True,
+            wealth_minor=0,
+            final_snapshot=self.final_snapshot,
+            external_ref=self.external_ref,
+        )
+
+    @classmethod
+    def archive_broken_money_boxes(cls, batch_size: int) -> List[int]:
+        """
+        Move a batch of broken money boxes, the first broken ones by id, from the MoneyBox table to the archive
+        in a single transaction, along with their ledger deposits, the counters left with them are deleted.
+        The money boxes locked by a request are skipped until the next batch.
+        Args:
+            batch_size (int): Maximum number of money boxes moved.
+        Returns:
+            List[int]: The ids of the money boxes archived.
+        """
+        with transaction.atomic():
+            money_boxes = list(
+                MoneyBox.objects
+                .select_for_update(skip_locked=True)
+                .filter(broken=True)
+                .order_by('id')
+                .only('id', 'created_at', 'updated_at', 'name', 'final_snapshot', 'external_ref')[:batch_size]
+            )
+            if not money_boxes:
+                return []
+            cls.objects.bulk_create([
+                cls(
+                    id=money_box.id,
+                    created_at=money_box.created_at,
+                    updated_at=money_box.updated_at,
+                    name=money_box.name,
+                    final_snapshot=money_box.final_snapshot,
+                    external_ref=money_box.external_ref,
+                )
+                for money_box in money_boxes
+            ])
+            money_box_ids = [money_box.id for money_box in money_boxes]
+            # The ledger deposits are the history of the money boxes, they are copied before being deleted with them
+            ArchivedDeposit.objects.bulk_create([
+                ArchivedDeposit(**deposit)
+                for deposit in Deposit.objects.filter(money_box_id__in=money_box_ids).order_by('id').values(
+                    'id', 'money_box_id', 'cash_id', 'amount', 'created_at', 'compacted',
+                )
+            ])
+            # The contents and counters of the money boxes are deleted with them
+            MoneyBox.objects.filter(id__in=money_box_ids).delete()
+            transaction.on_commit(lambda: wealth_cache.delete_many(money_box_ids))
+        return money_box_ids
+
+    @classmethod
+    def get_money_box(cls, pk) -> Optional[MoneyBox]:
+        """
+        Get the broken MoneyBox object of an archived money box by its primary key.
+        Args:
+            pk: Primary key of the money box.
+        Returns:
+            Optional[MoneyBox]: The unsaved broken MoneyBox object, or None if no money box with this id is archived.
+        """
+        archived_money_box = cls.objects.filter(id=pk).first()
+        return archived_money_box.to_money_box() if archived_money_box is not None else None
+
+    @classmethod
+    async def aget_money_box(cls, pk) -> Optional[MoneyBox]:
+        """
+        Async version of get_money_box.
+        Args:
+            pk: Primary key of the money box.
+        Returns:
+            Optional[MoneyBox]: The unsaved broken MoneyBox object, or None if no money box with this id is archived.
+        """
+        archived_money_box = await cls.objects.filter(id=pk).afirst()
+        return archived_money_box.to_money_box() if archived_money_box is not None else None
+
+
+class ArchivedDeposit(models.Model):
+    """
+    DB model of the ledger deposits of the archived money boxes, copied with their id by the archive_moneyboxes
+    command so the history of the money boxes is kept once they leave the MoneyBox table.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    money_box = models.ForeignKey(ArchivedMoneyBox, on_delete=models.CASCADE)
+    cash = models.ForeignKey(Cash, on_delete=models.CASCADE)
     amount = models.IntegerField()
+    created_at = models.DateTimeField()
+    compacted = models.BooleanField(default=False)
@@ -0,0 +1,194 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+from collections import OrderedDict, namedtuple
+from functools import reduce
+from operator import or_
+from typing import List, Optional, Tuple
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Field, Model, Q, QuerySet
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, _reverse_ordering
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+KeysetCursor = namedtuple('KeysetCursor', ['reverse', 'position'])
+
+
+class KeysetCursorPagination(CursorPagination):
+    """
+    Cursor pagination seeking on every field of the ordering (e.g. created_at and id) instead of the first one
+    and an offset, so each page is a single index range scan whatever its depth.
+    The ordering must end with a unique field, the primary key is appended when it does not.
+    """
+
+    def paginate_queryset(self, queryset: QuerySet, request: Request, view=None) -> Optional[List[Model]]:
+        """
+        Paginate a queryset from the cursor given in the request.
+        Args:
+            queryset (QuerySet): The queryset to paginate.
+            request (Request): DRF request object.
+            view: The view paginating the queryset.
+        Returns:
+            Optional[List[Model]]: The objects of the page, or None if pagination is disabled.
+        """
+        page_queryset = self.get_page_queryset(queryset, request, view)
+        if page_queryset is None:
+            return None
+        return self.set_page(list(page_queryset))
+
+    def get_page_queryset(self, queryset: QuerySet, request: Request, view=None) -> Optional[QuerySet]:
+        """
+        Build the queryset of the page requested by the cursor, without evaluating it,
+        it fetches one extra object to know if a following page exists.
+        Args:
+            queryset (QuerySet): The queryset to paginate.
+            request (Request): DRF request object.
+            view: The view paginating the queryset.
+        Returns:
+            Optional[QuerySet]: The queryset of the page, or None if pagination is disabled.
+        """
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        if not {'pk', '-pk', 'id', '-id'} & set(self.ordering):
+            self.ordering += ('-id' if self.ordering[0].startswith('-') else 'id',)
+
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor.reverse
+        ordering = _reverse_ordering(self.ordering) if reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if self.cursor is not None:
+            position = self._parse_position(queryset, ordering, self.cursor.position)
+            queryset = queryset.filter(self._get_seek_filter(ordering, position))
+        return queryset[:self.page_size + 1]
+
+    def set_page(self, results: List[Model]) -> List[Model]:
+        """
+        Set the page from the evaluated page queryset, see get_page_queryset.
+        Args:
+            results (List[Model]): The objects fetched by the page queryset.
+        Returns:
+            List[Model]: The objects of the page.
+        """
+        has_following_item = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if self.cursor is not None and self.cursor.reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_following_item
+        else:
+            self.has_next, self.has_previous = has_following_item, self.cursor is not None
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+
+        return self.page
+
+    def get_next_link(self) -> Optional[str]:
+        if not self.has_next:
+            return None
+        position = self._get_position_from_instance(self.page[-1], self.ordering) if self.page else self.cursor.position
+        return self.encode_cursor(KeysetCursor(reverse=False, position=position))
+
+    def get_previous_link(self) -> Optional[str]:
+        if not self.has_previous:
+            return None
+        position = self._get_position_from_instance(self.page[0], self.ordering) if self.page else self.cursor.position
+        return self.encode_cursor(KeysetCursor(reverse=True, position=position))
+
+    def decode_cursor(self, request: Request) -> Optional[KeysetCursor]:
+        """
+        Given a request with a cursor, return a `KeysetCursor` instance.
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            tokens = json.loads(urlsafe_b64decode(encoded.encode('ascii')))
+            reverse = bool(tokens['r'])
+            position = tuple(str(value) for value in tokens['p'])
+        except (BinasciiError, KeyError, TypeError, UnicodeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return KeysetCursor(reverse=reverse, position=position)
+
+    def encode_cursor(self, cursor: KeysetCursor) -> str:
+        """
+        Given a KeysetCursor instance, return an url with encoded cursor.
+        """
+        tokens = json.dumps({'r': int(cursor.reverse), 'p': list(cursor.position)}, separators=(',', ':'))
+        encoded = urlsafe_b64encode(tokens.encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_paginated_response(self, data: list) -> Response:
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+    def _get_position_from_instance(self, instance: Model, ordering: Tuple[str, ...]) -> Tuple[str, ...]:
+        return tuple(str(getattr(instance, order.lstrip('-'))) for order in ordering)
+
+    def _parse_position(self, queryset: QuerySet, ordering: Tuple[str, ...], position: Tuple[str, ...]) -> tuple:
+        """
+        Convert the values of a cursor position with the fields of the ordering, a tampered cursor is not found
+        instead of failing in the database.
+        """
+        try:
+            values = tuple(
+                self._get_ordering_field(queryset, order.lstrip('-')).to_python(value)
+                for order, value in zip(ordering, position)
+            )
+        except (FieldDoesNotExist, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        if None in values:
+            raise NotFound(self.invalid_cursor_message)
+        return values
+
+    @staticmethod
+    def _get_ordering_field(queryset: QuerySet, field_name: str) -> Field:
+        # The ordering may be on an annotation, e.g. the current wealth of the money boxes
+        annotation = queryset.query.annotations.get(field_name)
+        if annotation is not None:
+            return annotation.output_field
+        if field_name == 'pk':
+            return queryset.model._meta.pk
+        return queryset.model._meta.get_field(field_name)
+
+    @staticmethod
+    def _get_seek_filter(ordering: Tuple[str, ...], position: tuple) -> Q:
+        """
+        Build the filter selecting the rows strictly after the position in the given ordering, e.g. for
+        ('-created_at', '-id'): created_at <= c AND (created_at < c OR (created_at = c AND id < i)),
+        the leading inequality keeps the filter usable as an index range condition.
+        """
+        conditions = []
+        for index, order in enumerate(ordering):
+            field_name = order.lstrip('-')
+            lookup = 'lt' if order.startswith('-') else 'gt'
+            equal_conditions = {
+                previous_order.lstrip('-'): previous_value
+                for previous_order, previous_value in zip(ordering[:index], position)
+            }
+            conditions.append(Q(**equal_conditions, **{f'{field_name}__{lookup}': position[index]}))
+        first_field_name = ordering[0].lstrip('-')
+        first_lookup = 'lte' if ordering[0].startswith('-') else 'gte'
+        return Q(**{f'{first_field_name}__{first_lookup}': position[0]}) & reduce(or_, conditions)
+
+
+class MoneyBoxCursorPagination(KeysetCursorPagination):
+    """
+    Pagination of the money boxes from the most recent to the least recent one.
+    """
+    ordering = ('-created_at', '-id')
+    page_size = settings.MONEYBOX_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.MONEYBOX_MAX_PAGE_SIZE
@@ -0,0 +1,34 @@
+import orjson
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+
+from app.camel_case import underscoreize
+
+
+class CamelCaseORJSONParser(JSONParser):
+    """
+    Parser reading the same data as djangorestframework_camel_case's CamelCaseJSONParser with orjson,
+    followed by a snake_case translation with memoized keys. Like the DRF parser with the default STRICT_JSON,
+    NaN and Infinity are rejected.
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        """
+        Parse a JSON request body with camelCase keys.
+        Args:
+            stream: The stream of the request body.
+            media_type (Optional[str]): The media type of the request.
+            parser_context (Optional[dict]): The context of the request.
+        Returns:
+            The data with snake_case keys.
+        """
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        try:
+            body = stream.read()
+            if encoding.lower().replace('-', '') != 'utf8':
+                body = body.decode(encoding)
+            return underscoreize(orjson.loads(body))
+        except ValueError as exc:
+            raise ParseError(f'JSON parse error - {exc}')
@@ -0,0 +1,81 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.http import HttpRequest, HttpResponseBase
+
+# Database alias the reads of the current request are routed to, None for the default database
+_read_database: ContextVar[Optional[str]] = ContextVar('read_database', default=None)
+
+
+class ReplicaRouter:
+    """
+    Database router sending the reads run inside use_replica to one of the DATABASE_REPLICAS aliases, the other reads
+    and every write go to the default database.
+    """
+
+    def db_for_read(self, model, **hints) -> Optional[str]:
+        return _read_database.get()
+
+    def db_for_write(self, model, **hints) -> str:
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints) -> Optional[bool]:
+        # The replicas hold the same rows as the default database
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+def is_sticky(request: HttpRequest) -> bool:
+    """
+    Whether the client of a request wrote recently enough to read from the default database, see stick_to_primary.
+    Args:
+        request (HttpRequest): Django or DRF request object.
+    Returns:
+        bool: True if the reads of the request must go to the default database.
+    """
+    return settings.DATABASE_REPLICA_STICKINESS_COOKIE in request.COOKIES
+
+
+@contextmanager
+def use_replica(request: HttpRequest) -> Iterator[Optional[str]]:
+    """
+    Route the reads run in the context to a replica picked at random, unless there is no replica or the client
+    of the request sticks to the default database.
+    Args:
+        request (HttpRequest): Django or DRF request object.
+    Returns:
+        Iterator[Optional[str]]: The alias of the replica, or None if the reads go to the default database.
+    """
+    replicas = settings.DATABASE_REPLICAS
+    database = random.choice(replicas) if replicas and not is_sticky(request) else None
+    token = _read_database.set(database)
+    try:
+        yield database
+    finally:
+        _read_database.reset(token)
+
+
+def stick_to_primary(response: HttpResponseBase) -> HttpResponseBase:
+    """
+    Make the client of a successful write read from the default database for DATABASE_REPLICA_STICKINESS_SECONDS,
+    with a cookie expiring at the end of the window, so it reads its own writes despite the replication lag.
+    Args:
+        response (HttpResponseBase): The response of the write.
+    Returns:
+        HttpResponseBase: The response object.
+    """
+    if settings.DATABASE_REPLICAS and response.status_code < 400:
+        response.set_cookie(
+            settings.DATABASE_REPLICA_STICKINESS_COOKIE,
+            '1',
+            max_age=settings.DATABASE_REPLICA_STICKINESS_SECONDS,
+            httponly=True,
+            samesite='Lax',
+        )
+    return response
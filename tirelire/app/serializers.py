@@ -1,8 +1,24 @@
+from decimal import Decimal
+from functools import lru_cache
+from typing import List
+
+from django.conf import settings
 from rest_framework import serializers
+from app.middleware import timed
 from app.models import Cash, MoneyBoxContent, MoneyBox
 
 
-class MoneyBoxSerializer(serializers.ModelSerializer):
+class TimedSerializerMixin:
+    """
+    Report the time spent serializing in the serialize phase of the request metrics.
+    """
+
+    def to_representation(self, instance) -> dict:
+        with timed('serialize'):
+            return super().to_representation(instance)
+
+
+class MoneyBoxSerializer(TimedSerializerMixin, serializers.ModelSerializer):
 
     class Meta:
         model = MoneyBox
@@ -10,7 +26,14 @@ class MoneyBoxSerializer(serializers.ModelSerializer):
         read_only_fields = ['broken']
 
 
-class MoneyBoxContentSerializer(serializers.ModelSerializer):
+class MoneyBoxWithWealthSerializer(MoneyBoxSerializer):
+    wealth = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
+
+    class Meta(MoneyBoxSerializer.Meta):
+        fields = MoneyBoxSerializer.Meta.fields + ['wealth']
+
+
+class MoneyBoxContentSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     cash_type = serializers.ChoiceField(source='cash.cash_type', choices=Cash.CashTypeChoice.choices)
     currency = serializers.ChoiceField(source='cash.currency', choices=Cash.CurrencyChoice.choices, read_only=True)
     value = serializers.DecimalField(source='cash.value', max_digits=5, decimal_places=2)
@@ -37,9 +60,97 @@ class MoneyBoxContentSerializer(serializers.ModelSerializer):
 
 
 class MoneyBoxWealthSerializer(serializers.ModelSerializer):
+    """
+    Read-only wealth data of a money box. The declared fields describe the data for the schema, while the data
+    is built by a hand-written to_representation from the contents loaded, without binding any field.
+    """
     wealth = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
     cashes = MoneyBoxContentSerializer(many=True, source='moneyboxcontent_set_ordered')
 
     class Meta:
         model = MoneyBox
         fields = ['wealth', 'cashes']
+
+    def to_representation(self, instance: MoneyBox) -> dict:
+        """
+        Build the same data as the declared fields would, formatting the values with the declared fields themselves
+        and reusing the representation of each cash from represent_cash.
+        Args:
+            instance (MoneyBox): The money box.
+        Returns:
+            dict: The wealth data.
+        """
+        with timed('serialize'):
+            wealth_field = self._declared_fields['wealth']
+            contents = getattr(instance, self._declared_fields['cashes'].source)
+            return {
+                'wealth': wealth_field.to_representation(getattr(instance, wealth_field.source or 'wealth')),
+                'cashes': [
+                    {**represent_cash(content.cash.cash_type, content.cash.currency, content.cash.minor_value),
+                     'amount': content.amount}
+                    for content in contents
+                ],
+            }
+
+
+@lru_cache(maxsize=None)
+def represent_cash(cash_type: str, currency: str, minor_value: int) -> dict:
+    """
+    Representation of a cash by MoneyBoxContentSerializer without its amount, computed once per cash.
+    Args:
+        cash_type (str): The type of cash.
+        currency (str): The currency of cash.
+        minor_value (int): The value of cash in minor units.
+    Returns:
+        dict: The cash_type, currency and value of cash, not to be modified.
+    """
+    fields = MoneyBoxContentSerializer._declared_fields
+    return {
+        'cash_type': fields['cash_type'].to_representation(cash_type),
+        'currency': fields['currency'].to_representation(currency),
+        'value': fields['value'].to_representation(Cash.to_major_units(minor_value, currency)),
+    }
+
+
+class MoneyBoxFinalWealthSerializer(MoneyBoxWealthSerializer):
+    wealth = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True, source='final_wealth')
+    cashes = MoneyBoxContentSerializer(many=True, source='final_contents')
+
+
+class MoneyBoxWithdrawalSerializer(serializers.Serializer):
+    amount = serializers.DecimalField(max_digits=12, decimal_places=2, min_value=Decimal('0.01'))
+    cashes = MoneyBoxContentSerializer(many=True, read_only=True)
+
+
+class CurrencyStatisticsSerializer(serializers.Serializer):
+    currency = serializers.ChoiceField(choices=Cash.CurrencyChoice.choices)
+    wealth = serializers.DecimalField(max_digits=20, decimal_places=2)
+
+
+class MoneyBoxStatisticsSerializer(serializers.Serializer):
+    currencies = CurrencyStatisticsSerializer(many=True)
+    cashes = MoneyBoxContentSerializer(many=True)
+
+
+class MoneyBoxDepositSerializer(serializers.Serializer):
+    moneybox_id = serializers.IntegerField()
+    cashes = MoneyBoxContentSerializer(many=True, allow_empty=False)
+
+    def to_cashes_to_add(self) -> List[dict]:
+        """
+        Flatten the validated cashes in the format expected by MoneyBox.save_money.
+        Returns:
+            List[dict]: The details of cash to be added.
+        """
+        return [
+            {'cash_type': cash['cash']['cash_type'], 'value': cash['cash']['value'], 'amount': cash['amount']}
+            for cash in self.validated_data['cashes']
+        ]
+
+
+class MoneyBoxBulkDepositSerializer(serializers.Serializer):
+    deposits = serializers.ListField(
+        child=serializers.DictField(),
+        allow_empty=False,
+        max_length=settings.MONEYBOX_BULK_SAVE_MAX_DEPOSITS,
+    )
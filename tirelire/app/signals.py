@@ -0,0 +1,16 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from app.models import Cash, cash_registry
+
+
+@receiver([post_save, post_delete], sender=Cash)
+def invalidate_cash_registry(sender, **kwargs) -> None:
+    """
+    Invalidate the cash registry of every worker when a Cash object is created, updated or deleted.
+    """
+    # The registry of this worker is cleared right away for the rest of the transaction to see the change,
+    # and again on commit as it may have been reloaded before, the other workers reload theirs after the commit
+    cash_registry.clear()
+    transaction.on_commit(cash_registry.invalidate)
@@ -1,11 +1,54 @@
-from datetime import datetime, timedelta
+import csv
+import json
+import os
+from base64 import urlsafe_b64encode
+from datetime import datetime, timedelta, timezone
 from decimal import Decimal
+from io import BytesIO, StringIO
+from uuid import UUID
+from tempfile import TemporaryDirectory
+from threading import Barrier, Thread, Timer
+from typing import Optional
+from unittest import skipIf
+from unittest.mock import patch
 
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, connections, transaction
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from djangorestframework_camel_case.parser import CamelCaseJSONParser
+from djangorestframework_camel_case.render import CamelCaseJSONRenderer
 from model_bakery import baker
+from rest_framework import serializers
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.request import Request
 from rest_framework.reverse import reverse
-from rest_framework.test import APITestCase
+from rest_framework.test import APIRequestFactory, APITestCase
 
-from app.models import Cash, MoneyBox, MoneyBoxContent
+from app.benchmarks import MoneyBoxBenchmarkSuite, compare_with_baseline
+from app.caches import wealth_cache
+from app.change import make_change
+from app.filters import MoneyBoxFilter
+from app.idempotency import StoredResponse, idempotent_response_store
+from app.models import (
+    ArchivedDeposit,
+    ArchivedMoneyBox,
+    Cash,
+    CashRegistry,
+    CashRollup,
+    Deposit,
+    MoneyBox,
+    MoneyBoxContent,
+    MoneyBoxContentShard,
+    cash_registry,
+)
+from app.parsers import CamelCaseORJSONParser
+from app.renderers import CamelCaseORJSONRenderer
+from app.serializers import MoneyBoxFinalWealthSerializer, MoneyBoxWealthSerializer
+from app.views import MoneyBoxViewSet
 
 
 class MoneyBoxRetrieveApiTestCase(APITestCase):
@@ -50,11 +93,198 @@ class MoneyBoxListTestCase(APITestCase):
         """Test to get basic money box data list and check the API's response in the right order."""
         response = self.client.get(self.get_url())
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(len(response.data), 10)
+        self.assertEqual(len(response.data['results']), 10)
+        self.assertIsNone(response.data['next'])
+        self.assertIsNone(response.data['previous'])
         # Reversing list because the endpoint should return by default from most recent to least recent moneyboxes
         self.moneyboxes.reverse()
         for idx, moneybox in enumerate(self.moneyboxes):
-            self.assertEqual(moneybox.id, response.data[idx]['id'])
+            self.assertEqual(moneybox.id, response.data['results'][idx]['id'])
+
+    def test_get_moneyboxes_pages(self):
+        """Test to browse the money box list page by page with the cursors, forward then backward."""
+        response = self.client.get(self.get_url(), {'pageSize': 4})
+        self.assertIsNone(response.data['previous'])
+        pages = [response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            self.assertEqual(response.status_code, 200)
+            pages.append(response.data['results'])
+        self.assertEqual([len(page) for page in pages], [4, 4, 2])
+        self.moneyboxes.reverse()
+        self.assertEqual([moneybox['id'] for page in pages for moneybox in page], [m.id for m in self.moneyboxes])
+        response = self.client.get(response.data['previous'])
+        self.assertEqual(
+            [moneybox['id'] for moneybox in response.data['results']],
+            [moneybox.id for moneybox in self.moneyboxes[4:8]]
+        )
+
+    def test_get_moneyboxes_with_same_creation_date(self):
+        """Test the cursors do not skip or repeat money boxes created at the same time."""
+        MoneyBox.objects.update(created_at=datetime(2023, 1, 1, tzinfo=timezone.utc))
+        response = self.client.get(self.get_url(), {'pageSize': 3})
+        ids = [moneybox['id'] for moneybox in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            ids.extend(moneybox['id'] for moneybox in response.data['results'])
+        self.assertEqual(ids, sorted((moneybox.id for moneybox in self.moneyboxes), reverse=True))
+
+    def test_get_moneyboxes_invalid_cursor(self):
+        """Test to get an error from the API's response when the cursor is invalid."""
+        response = self.client.get(self.get_url(), {'cursor': 'invalid'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_get_moneyboxes_tampered_cursor(self):
+        """Test a cursor whose position values do not match the fields of the ordering is not found."""
+        for tokens, params in [
+            ({'r': 0, 'p': ['abc', '1']}, {}),
+            ({'r': 0, 'p': ['2023-01-01T00:00:00Z', 'abc']}, {}),
+            ({'r': 0, 'p': ['', '1']}, {}),
+            ({'r': 1, 'p': ['1.5', '1']}, {'ordering': 'wealth'}),
+        ]:
+            cursor = urlsafe_b64encode(json.dumps(tokens).encode()).decode()
+            response = self.client.get(self.get_url(), {'cursor': cursor, **params})
+            self.assertEqual(response.status_code, 404, tokens)
+            self.assertEqual(response.data['detail'], 'Invalid cursor', tokens)
+        cursor = urlsafe_b64encode(json.dumps({'r': 0, 'p': ['150', '1']}).encode()).decode()
+        response = self.client.get(self.get_url(), {'cursor': cursor, 'ordering': 'wealth'})
+        self.assertEqual(response.status_code, 200)
+
+
+class MoneyBoxListWealthTestCase(APITestCase):
+
+    def get_url(self) -> str:
+        return reverse('api:moneyboxes-list')
+
+    def setUp(self):
+        self.moneyboxes = baker.make(MoneyBox, _quantity=5)
+        for moneybox, value in zip(self.moneyboxes, ['5', '50', '20', None, '50']):
+            if value is not None:
+                moneybox.save_money([{'cash_type': 'bill', 'value': value, 'amount': 1}])
+
+    def test_get_moneyboxes_with_wealth(self):
+        """Test to get the money box list with the wealth of each money box in a single query."""
+        with self.assertNumQueries(1):
+            response = self.client.get(self.get_url(), {'includeWealth': 'true'})
+        self.assertEqual(
+            {moneybox['id']: moneybox['wealth'] for moneybox in response.data['results']},
+            dict(zip([m.id for m in self.moneyboxes], ['5.00', '50.00', '20.00', '0.00', '50.00']))
+        )
+        response = self.client.get(self.get_url())
+        self.assertNotIn('wealth', response.data['results'][0])
+
+    def test_get_moneybox_with_wealth(self):
+        """Test to get a money box with its wealth."""
+        url = reverse('api:moneyboxes-detail', args=(self.moneyboxes[2].id,))
+        response = self.client.get(url, {'includeWealth': 1})
+        self.assertEqual(response.data['wealth'], '20.00')
+
+    def test_get_moneyboxes_ordered_by_wealth(self):
+        """Test to browse the money box list ordered by wealth page by page, money boxes of equal wealth included."""
+        response = self.client.get(self.get_url(), {'ordering': '-wealth', 'pageSize': 2})
+        ids = [moneybox['id'] for moneybox in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            ids.extend(moneybox['id'] for moneybox in response.data['results'])
+        expected_moneyboxes = [self.moneyboxes[index] for index in (4, 1, 2, 0, 3)]
+        self.assertEqual(ids, [moneybox.id for moneybox in expected_moneyboxes])
+        response = self.client.get(self.get_url(), {'ordering': 'wealth'})
+        self.assertEqual([moneybox['id'] for moneybox in response.data['results']], list(reversed(ids)))
+
+    def test_filter_moneyboxes_by_wealth(self):
+        """Test to filter the money box list by wealth."""
+        response = self.client.get(self.get_url(), {'minWealth': '10', 'maxWealth': '20.00'})
+        self.assertEqual([moneybox['id'] for moneybox in response.data['results']], [self.moneyboxes[2].id])
+        response = self.client.get(self.get_url(), {'minWealth': '20.01'})
+        self.assertEqual(len(response.data['results']), 2)
+
+    def test_filter_moneyboxes_by_invalid_wealth(self):
+        """Test to get an error from the API's response when the wealth filter is not a number."""
+        response = self.client.get(self.get_url(), {'maxWealth': 'ten'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['max_wealth'], 'A valid number is required.')
+
+    @override_settings(MONEYBOX_DEPOSIT_MODE='ledger')
+    def test_filter_moneyboxes_by_wealth_with_pending_deposits(self):
+        """Test the deposits not compacted yet are part of the wealth filtered and ordered on."""
+        self.moneyboxes[3].save_money([{'cash_type': 'coin', 'value': '0.1', 'amount': 3}])
+        response = self.client.get(self.get_url(), {'maxWealth': '1', 'includeWealth': 'true'})
+        self.assertEqual(
+            [(moneybox['id'], moneybox['wealth']) for moneybox in response.data['results']],
+            [(self.moneyboxes[3].id, '0.30')]
+        )
+
+
+class MoneyBoxListFilterTestCase(APITestCase):
+
+    def get_url(self) -> str:
+        return reverse('api:moneyboxes-list')
+
+    def get_ids(self, params: dict) -> list:
+        response = self.client.get(self.get_url(), params)
+        self.assertEqual(response.status_code, 200)
+        return [moneybox['id'] for moneybox in response.data['results']]
+
+    def setUp(self):
+        names = ['Vacances été', 'Vélo', 'Cadeau vacances', 'Voiture', 'Épargne']
+        self.moneyboxes = [baker.make(MoneyBox, name=name) for name in names]
+        for index, moneybox in enumerate(self.moneyboxes):
+            moment = datetime(2023, 1, 1 + index, tzinfo=timezone.utc)
+            MoneyBox.objects.filter(id=moneybox.id).update(created_at=moment, updated_at=moment + timedelta(days=10))
+        self.moneyboxes[1].break_moneybox()
+        MoneyBox.objects.filter(id=self.moneyboxes[1].id).update(updated_at=datetime(2023, 1, 2, tzinfo=timezone.utc))
+
+    def test_filter_moneyboxes(self):
+        """Test to filter the money box list on the broken state, the creation and update dates and the name."""
+        ids = [moneybox.id for moneybox in self.moneyboxes]
+        self.assertEqual(self.get_ids({'broken': 'true'}), [ids[1]])
+        self.assertEqual(self.get_ids({'broken': 'false'}), [ids[4], ids[3], ids[2], ids[0]])
+        self.assertEqual(
+            self.get_ids({'createdAfter': '2023-01-02T00:00:00Z', 'createdBefore': '2023-01-04T00:00:00Z'}),
+            [ids[2], ids[1]],
+        )
+        self.assertEqual(self.get_ids({'updatedSince': '2023-01-13T00:00:00+00:00'}), [ids[4], ids[3], ids[2]])
+        self.assertEqual(self.get_ids({'namePrefix': 'v'}), [ids[3], ids[1], ids[0]])
+        self.assertEqual(self.get_ids({'search': 'vacances'}), [ids[2], ids[0]])
+        self.assertEqual(self.get_ids({'search': 'cances', 'broken': 'false', 'createdAfter': '2023-01-02'}), [ids[2]])
+        self.assertEqual(len(self.get_ids({'search': ''})), 5)
+
+    def test_filter_moneyboxes_by_invalid_values(self):
+        """Test to get an error from the API's response when a filter value is invalid."""
+        response = self.client.get(self.get_url(), {'broken': 'maybe'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['broken'], 'Must be a valid boolean.')
+        response = self.client.get(self.get_url(), {'updatedSince': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Datetime has wrong format.', response.data['updated_since'])
+
+    def get_plan(self, params: dict) -> str:
+        request = APIRequestFactory().get(self.get_url(), params)
+        queryset = MoneyBoxFilter().filter_queryset(Request(request), MoneyBox.objects.all(), None)
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                # The test tables are too small for the planner to prefer an index to a sequential scan
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        return queryset.order_by().values('id').explain()
+
+    def test_filter_query_plans_use_indexes(self):
+        """Test the query plan of each filter uses the index supporting it."""
+        self.assertIn('moneybox_broken_created_idx', self.get_plan({'broken': 'false'}))
+        self.assertIn(
+            'moneybox_created_at_id_idx',
+            self.get_plan({'created_after': '2023-01-02T00:00:00Z', 'created_before': '2023-01-04T00:00:00Z'}),
+        )
+        self.assertIn('moneybox_updated_at_idx', self.get_plan({'updated_since': '2023-01-13T00:00:00Z'}))
+        request = APIRequestFactory().get(self.get_url(), {'broken': 'true'})
+        queryset = MoneyBoxFilter().filter_queryset(Request(request), MoneyBox.objects.all(), None)
+        # The broken index also gives the money boxes in the order of the list
+        self.assertIn('moneybox_broken_created_idx', queryset.order_by('-created_at', '-id')[:11].explain())
+
+    @skipIf(connection.vendor != 'postgresql', 'The name indexes are PostgreSQL expression indexes.')
+    def test_name_filter_query_plans_use_indexes(self):
+        """Test the query plans of the name filters use the pattern and trigram indexes of the uppercase name."""
+        self.assertIn('moneybox_name_prefix_idx', self.get_plan({'name_prefix': 'vac'}))
+        self.assertIn('moneybox_name_trgm_idx', self.get_plan({'search': 'cances'}))
 
 
 class MoneyBoxCreateTestCase(APITestCase):
@@ -127,8 +357,7 @@ class MoneyBoxSaveTestCase(APITestCase):
         """
         Test saving cash in a money box with cash in it already and check the wealth data in the API's response
         """
-        two_euro_coin = Cash.find_from_type_and_value(value=Decimal('2'), cash_type='coin')
-        baker.make(MoneyBoxContent, money_box=self.moneybox, cash=two_euro_coin, amount=2)
+        self.moneybox.save_money([{'cash_type': 'coin', 'value': Decimal('2'), 'amount': 2}])
         response = self.client.post(self.get_url(self.moneybox.id), self.payload, format='json')
         self.assertEqual(response.status_code, 201)
         self.assertEqual(response.data['wealth'], '207.00')
@@ -199,24 +428,11 @@ class MoneyBoxShakeTestCase(APITestCase):
 
     def setUp(self):
         self.moneybox = baker.make(MoneyBox, name='Moneybox test')
-        baker.make(
-            MoneyBoxContent,
-            money_box=self.moneybox,
-            cash=Cash.find_from_type_and_value(value=Decimal('100'), cash_type='bill'),
-            amount=2
-        )
-        baker.make(
-            MoneyBoxContent,
-            money_box=self.moneybox,
-            cash=Cash.find_from_type_and_value(value=Decimal('2'), cash_type='coin'),
-            amount=1
-        )
-        baker.make(
-            MoneyBoxContent,
-            money_box=self.moneybox,
-            cash=Cash.find_from_type_and_value(value=Decimal('0.2'), cash_type='coin'),
-            amount=5
-        )
+        self.moneybox.save_money([
+            {'cash_type': 'bill', 'value': Decimal('100'), 'amount': 2},
+            {'cash_type': 'coin', 'value': Decimal('2'), 'amount': 1},
+            {'cash_type': 'coin', 'value': Decimal('0.2'), 'amount': 5},
+        ])
 
     def test_shake_moneybox(self):
         """Test shaking money box and check the wealth data in the API's response."""
@@ -256,24 +472,11 @@ class MoneyBoxBreakTestCase(APITestCase):
 
     def setUp(self):
         self.moneybox = baker.make(MoneyBox, name='Moneybox test')
-        baker.make(
-            MoneyBoxContent,
-            money_box=self.moneybox,
-            cash=Cash.find_from_type_and_value(value=Decimal('100'), cash_type='bill'),
-            amount=2
-        )
-        baker.make(
-            MoneyBoxContent,
-            money_box=self.moneybox,
-            cash=Cash.find_from_type_and_value(value=Decimal('2'), cash_type='coin'),
-            amount=1
-        )
-        baker.make(
-            MoneyBoxContent,
-            money_box=self.moneybox,
-            cash=Cash.find_from_type_and_value(value=Decimal('0.2'), cash_type='coin'),
-            amount=5
-        )
+        self.moneybox.save_money([
+            {'cash_type': 'bill', 'value': Decimal('100'), 'amount': 2},
+            {'cash_type': 'coin', 'value': Decimal('2'), 'amount': 1},
+            {'cash_type': 'coin', 'value': Decimal('0.2'), 'amount': 5},
+        ])
 
     def test_break_moneybox(self):
         """
@@ -299,6 +502,31 @@ class MoneyBoxBreakTestCase(APITestCase):
         self.assertEqual(response.data['cashes'][2]['value'], '100.00')
         self.assertEqual(response.data['cashes'][2]['amount'], 2)
 
+    def test_break_moneybox_final_snapshot(self):
+        """Test breaking a money box freezes its final contents, which are then read without the contents table."""
+        self.client.delete(self.get_url(self.moneybox.id))
+        moneybox = MoneyBox.objects.get(id=self.moneybox.id)
+        two_euro_coin = Cash.find_from_type_and_value('coin', '2')
+        self.assertEqual(moneybox.final_snapshot['wealth_minor'], 20300)
+        self.assertIn([two_euro_coin.id, 1], moneybox.final_snapshot['cashes'])
+        with self.assertNumQueries(0):
+            self.assertEqual(moneybox.final_wealth, Decimal('203'))
+            self.assertEqual(
+                [(content.cash.value, content.amount) for content in moneybox.final_contents],
+                [(Decimal('0.2'), 5), (Decimal('2'), 1), (Decimal('100'), 2)]
+            )
+            self.assertEqual(moneybox.moneyboxcontent_set_ordered, [])
+            self.assertEqual(moneybox.wealth, Decimal('0'))
+
+    def test_break_moneybox_twice_keeps_first_snapshot(self):
+        """Test breaking a money box a second time, e.g. from a concurrent request, keeps its first snapshot."""
+        self.moneybox.break_moneybox()
+        moneybox = MoneyBox.objects.get(id=self.moneybox.id)
+        moneybox.broken = False
+        moneybox.break_moneybox()
+        self.assertTrue(moneybox.broken)
+        self.assertEqual(moneybox.final_wealth, Decimal('203'))
+
     def test_break_moneybox_not_found(self):
         """Test breaking a not found money box should return an error."""
         response = self.client.delete(self.get_url(111))
@@ -312,3 +540,1334 @@ class MoneyBoxBreakTestCase(APITestCase):
         response = self.client.delete(self.get_url(self.moneybox.id))
         self.assertEqual(response.status_code, 400)
         self.assertEqual(response.data['detail'], 'This money box is broken you cannot use it anymore.')
+
+
+class MoneyBoxWealthSerializerTestCase(APITestCase):
+
+    def test_wealth_data_matches_declared_fields(self):
+        """Test the hand-written wealth data is the one the declared fields build, without any query once loaded."""
+        moneybox = baker.make(MoneyBox)
+        moneybox.save_money([
+            {'cash_type': 'bill', 'value': Decimal('200'), 'amount': 7},
+            {'cash_type': 'coin', 'value': Decimal('0.01'), 'amount': 1},
+        ])
+        moneybox = MoneyBox.objects.prefetch_related(MoneyBox.ordered_contents_prefetch()).get(id=moneybox.id)
+        with self.assertNumQueries(0):
+            data = MoneyBoxWealthSerializer(moneybox).data
+        self.assertEqual(
+            data, serializers.ModelSerializer.to_representation(MoneyBoxWealthSerializer(moneybox), moneybox),
+        )
+        self.assertEqual(data['wealth'], '1400.01')
+        moneybox.break_moneybox()
+        self.assertEqual(
+            MoneyBoxFinalWealthSerializer(moneybox).data,
+            serializers.ModelSerializer.to_representation(MoneyBoxFinalWealthSerializer(moneybox), moneybox),
+        )
+
+
+class CamelCaseORJSONTestCase(APITestCase):
+
+    def assertSameRendering(self, data):
+        self.assertEqual(CamelCaseORJSONRenderer().render(data), CamelCaseJSONRenderer().render(data))
+
+    def test_renderer_matches_library_renderer(self):
+        """Test the orjson renderer writes the same bytes as the djangorestframework_camel_case one."""
+        moneyboxes = baker.make(MoneyBox, _quantity=2, name='Tirelire \u00e9t\u00e9 \U0001f437')
+        moneyboxes[0].save_money([
+            {'cash_type': 'bill', 'value': Decimal('20'), 'amount': 2},
+            {'cash_type': 'coin', 'value': Decimal('0.5'), 'amount': 3},
+        ])
+        queryset = MoneyBox.objects.prefetch_related(MoneyBox.ordered_contents_prefetch()).order_by('id')
+        self.assertSameRendering(MoneyBoxWealthSerializer(queryset, many=True).data)
+        self.assertSameRendering({
+            'created_at': datetime(2023, 4, 1, 12, 30, 15, 123456, tzinfo=timezone.utc),
+            'updated_at': datetime(2023, 4, 1, 12, 30, tzinfo=timezone(timedelta(hours=2))),
+            'request_id': UUID('12345678-1234-5678-1234-567812345678'),
+            'wealth': Decimal('12.30'),
+            'nested_list': [{'cash_type': 'coin', 'is_2_value': None, 'amount': 1}, ('a_b', 2.5, True)],
+            'line\u2028separator': 'quote " backslash \\ control \x01 \u2029',
+            1: 'integer key',
+        })
+        self.assertEqual(CamelCaseORJSONRenderer().render(None), b'')
+        # orjson cannot write integers larger than 64 bits, the DRF renderer does
+        self.assertSameRendering({'big_amount': 2 ** 70})
+
+    def test_renderer_pretty_printing(self):
+        """Test the renderer indents the JSON like the library renderer when the client asks for it."""
+        data = {'cash_type': 'bill', 'amount': 2}
+        media_type = 'application/json; indent=4'
+        self.assertEqual(
+            CamelCaseORJSONRenderer().render(data, media_type), CamelCaseJSONRenderer().render(data, media_type),
+        )
+
+    def test_parser_matches_library_parser(self):
+        """Test the orjson parser reads the same data as the djangorestframework_camel_case one."""
+        body = json.dumps({
+            'deposits': [
+                {'moneyboxId': 1, 'cashes': [{'cashType': 'coin', 'value': '0.50', 'amount': 3}]},
+                {'moneyboxId': 2, 'cashes': [{'cashType': 'bill', 'value': 1.5, 'amount': 1, 'note': '\u00e9t\u00e9'}]},
+            ],
+            'createdAtRange': None,
+        }).encode()
+        self.assertEqual(
+            CamelCaseORJSONParser().parse(BytesIO(body)), CamelCaseJSONParser().parse(BytesIO(body)),
+        )
+        latin_body = '{"cashType": "\u00e9t\u00e9"}'.encode('latin-1')
+        self.assertEqual(
+            CamelCaseORJSONParser().parse(BytesIO(latin_body), parser_context={'encoding': 'latin-1'}),
+            {'cash_type': '\u00e9t\u00e9'},
+        )
+        for invalid_body in (b'{"cashType": ', b'{"amount": NaN}'):
+            with self.assertRaises(ParseError):
+                CamelCaseORJSONParser().parse(BytesIO(invalid_body))
+
+    def test_api_uses_orjson_renderer_and_parser(self):
+        """Test the API reads camelCase request bodies and query strings and writes camelCase responses."""
+        moneybox = baker.make(MoneyBox)
+        url = reverse('api:moneyboxes-save', args=(moneybox.id,))
+        response = self.client.post(
+            url,
+            json.dumps({'cashes': [{'cashType': 'bill', 'value': '5', 'amount': 2}]}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.content, CamelCaseJSONRenderer().render(response.data))
+        self.assertIn(b'"cashType":"bill"', response.content)
+        response = self.client.get(reverse('api:moneyboxes-list'), {'includeWealth': 'true'})
+        self.assertEqual(response.data['results'][0]['wealth'], '10.00')
+
+
+class MoneyBoxWithdrawTestCase(APITestCase):
+
+    def get_url(self, moneybox_id: int) -> str:
+        return reverse('api:moneyboxes-withdraw', args=(moneybox_id,))
+
+    def setUp(self):
+        self.moneybox = baker.make(MoneyBox, name='Moneybox test')
+        self.moneybox.save_money([
+            {'cash_type': 'bill', 'value': Decimal('5'), 'amount': 1},
+            {'cash_type': 'coin', 'value': Decimal('2'), 'amount': 3},
+            {'cash_type': 'coin', 'value': Decimal('0.2'), 'amount': 10},
+        ])
+
+    def test_withdraw_moneybox(self):
+        """Test withdrawing an amount with as few cashes as possible, even when the greedy choice fails."""
+        response = self.client.post(self.get_url(self.moneybox.id), {'amount': '6'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['amount'], '6.00')
+        # The 5 euros bill would leave 1 euro to make with five 0.2 euro coins, three 2 euros coins are fewer
+        self.assertEqual([(cash['value'], cash['amount']) for cash in response.data['cashes']], [('2.00', 3)])
+        self.moneybox.refresh_from_db()
+        self.assertEqual(self.moneybox.wealth, Decimal('7'))
+        self.assertEqual(
+            [(content.cash.value, content.amount) for content in self.moneybox.moneyboxcontent_set_ordered],
+            [(Decimal('0.2'), 10), (Decimal('5'), 1)],
+        )
+        self.assertEqual(CashRollup.get_amounts()[Cash.find_from_type_and_value('coin', '2').id], 0)
+
+    def test_withdraw_moneybox_impossible_amount(self):
+        """Test to get an error from the API's response when the amount cannot be made from the contents."""
+        for amount in ['0.3', '100']:
+            response = self.client.post(self.get_url(self.moneybox.id), {'amount': amount}, format='json')
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('amount', response.data)
+        self.moneybox.refresh_from_db()
+        self.assertEqual(self.moneybox.wealth, Decimal('13'))
+
+    def test_withdraw_broken_moneybox(self):
+        """Test to get an error from the API's response when the money box is broken."""
+        self.moneybox.break_moneybox()
+        response = self.client.post(self.get_url(self.moneybox.id), {'amount': '1'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['detail'], 'This money box is broken you cannot use it anymore.')
+
+    @override_settings(MONEYBOX_DEPOSIT_MODE='ledger')
+    def test_withdraw_ledger_moneybox(self):
+        """Test the pending ledger deposits can be withdrawn."""
+        self.moneybox.save_money([{'cash_type': 'bill', 'value': Decimal('50'), 'amount': 1}])
+        self.assertEqual(self.moneybox.withdraw_money(5000)[0].cash.value, Decimal('50'))
+        self.assertFalse(Deposit.objects.filter(money_box=self.moneybox, compacted=False).exists())
+        self.assertEqual(MoneyBox.objects.get(id=self.moneybox.id).wealth, Decimal('13'))
+
+
+class MakeChangeTestCase(SimpleTestCase):
+
+    def test_make_change_with_fewest_pieces(self):
+        """Test the change is made with the fewest pieces among the pieces available."""
+        euros = {20000: 10, 10000: 10, 5000: 10, 2000: 10, 1000: 10, 500: 10, 200: 10, 100: 10, 50: 10}
+        self.assertEqual(
+            make_change(37850, euros), {20000: 1, 10000: 1, 5000: 1, 2000: 1, 500: 1, 200: 1, 100: 1, 50: 1},
+        )
+        self.assertEqual(make_change(600, {500: 1, 200: 3, 20: 5}), {200: 3})
+        self.assertEqual(make_change(60, {25: 2, 20: 3, 5: 2}), {20: 3})
+        self.assertEqual(make_change(0, {100: 1}), {})
+
+    def test_make_change_impossible(self):
+        """Test no change is made when the pieces available cannot add up to the amount."""
+        self.assertIsNone(make_change(100, {}))
+        self.assertIsNone(make_change(1000001, {500: 10 ** 5, 200: 10 ** 5, 2: 10 ** 5}))
+        self.assertIsNone(
+            make_change(8199899, {20000: 2, 1000: 3, 500: 10 ** 5, 200: 10 ** 5, 20: 10 ** 5, 5: 3, 1: 1}),
+        )
+
+    def test_make_change_large_amount(self):
+        """Test a large amount is made without a table as large as the amount."""
+        pieces = make_change(30000002, {value: 10 ** 5 for value in [20000, 10000, 5000, 2000, 500, 200, 50, 2]})
+        self.assertEqual(pieces, {20000: 1500, 2: 1})
+        pieces = make_change(30000002, {20000: 1000, 10000: 999, 200: 10 ** 5, 2: 10 ** 5})
+        self.assertEqual(pieces, {20000: 1000, 10000: 999, 200: 50, 2: 1})
+
+
+class MoneyBoxWealthTestCase(APITestCase):
+
+    def setUp(self):
+        self.moneybox = baker.make(MoneyBox, name='Moneybox test')
+        self.moneybox.save_money([
+            {'cash_type': 'bill', 'value': Decimal('100'), 'amount': 2},
+            {'cash_type': 'coin', 'value': Decimal('0.2'), 'amount': 5},
+        ])
+
+    def test_save_money_updates_persisted_wealth(self):
+        """Test saving cash in a money box keeps the persisted wealth in sync with its content."""
+        self.moneybox.save_money([{'cash_type': 'coin', 'value': Decimal('0.05'), 'amount': 3}])
+        self.assertEqual(self.moneybox.wealth_minor, 20115)
+        self.assertEqual(self.moneybox.wealth, Decimal('201.15'))
+        self.moneybox.refresh_from_db()
+        self.assertEqual(self.moneybox.wealth_minor, 20115)
+        self.assertEqual(MoneyBox.compute_wealth_minor([self.moneybox.id]), {self.moneybox.id: 20115})
+
+    def test_save_money_after_break(self):
+        """Test a deposit through an instance read before the break of its money box does not add anything."""
+        stale_moneybox = MoneyBox.objects.get(id=self.moneybox.id)
+        self.moneybox.break_moneybox()
+        cashes = [{'cash_type': 'coin', 'value': Decimal('2'), 'amount': 1}]
+        self.assertFalse(stale_moneybox.save_money(cashes))
+        self.assertFalse(MoneyBoxContent.objects.filter(money_box=self.moneybox).exists())
+        self.assertEqual(MoneyBox.objects.get(id=self.moneybox.id).wealth_minor, 0)
+        ArchivedMoneyBox.archive_broken_money_boxes(batch_size=10)
+        self.assertEqual(MoneyBox.bulk_save_money({self.moneybox.id: cashes}), {self.moneybox.id})
+
+    def test_save_view_after_break(self):
+        """Test the save action answers the broken error when the money box is broken once read."""
+        stale_moneybox = MoneyBox.objects.get(id=self.moneybox.id)
+        self.moneybox.break_moneybox()
+        payload = {'cashes': [{'cash_type': 'coin', 'value': '2', 'amount': 1}]}
+        with patch.object(MoneyBoxViewSet, 'get_money_box', return_value=stale_moneybox):
+            response = self.client.post(reverse('api:moneyboxes-save', args=(self.moneybox.id,)), payload,
+                                        format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['detail'], 'This money box is broken you cannot use it anymore.')
+
+    def test_break_moneybox_resets_persisted_wealth(self):
+        """Test breaking a money box empties its persisted wealth."""
+        self.moneybox.break_moneybox()
+        self.moneybox.refresh_from_db()
+        self.assertEqual(self.moneybox.wealth_minor, 0)
+
+    def test_rebuild_wealth_command(self):
+        """Test the rebuild_wealth command detects and fixes an out of sync persisted wealth."""
+        MoneyBox.objects.filter(id=self.moneybox.id).update(wealth_minor=1)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_wealth', '--check', stdout=StringIO())
+        call_command('rebuild_wealth', stdout=StringIO())
+        self.moneybox.refresh_from_db()
+        self.assertEqual(self.moneybox.wealth_minor, 20100)
+        call_command('rebuild_wealth', '--check', stdout=StringIO())
+
+
+class MoneyBoxContentAddAmountsTestCase(APITestCase):
+
+    def setUp(self):
+        self.moneyboxes = baker.make(MoneyBox, _quantity=2)
+        self.two_euro_coin = Cash.find_from_type_and_value('coin', '2')
+        self.ten_euro_bill = Cash.find_from_type_and_value('bill', '10')
+
+    def test_add_amounts_merges_existing_and_new_contents(self):
+        """Test merging amounts into several money boxes adds to existing contents and creates the missing ones."""
+        baker.make(MoneyBoxContent, money_box=self.moneyboxes[0], cash=self.two_euro_coin, amount=3)
+        MoneyBoxContent.objects.add_amounts({
+            (self.moneyboxes[0].id, self.two_euro_coin.id): 2,
+            (self.moneyboxes[0].id, self.ten_euro_bill.id): 1,
+            (self.moneyboxes[1].id, self.two_euro_coin.id): 4,
+        })
+        self.assertEqual(
+            set(MoneyBoxContent.objects.values_list('money_box_id', 'cash_id', 'amount')),
+            {
+                (self.moneyboxes[0].id, self.two_euro_coin.id, 5),
+                (self.moneyboxes[0].id, self.ten_euro_bill.id, 1),
+                (self.moneyboxes[1].id, self.two_euro_coin.id, 4),
+            }
+        )
+
+    def test_delete_returning(self):
+        """Test deleting contents returns the values of the deleted rows and keeps the other ones."""
+        baker.make(MoneyBoxContent, money_box=self.moneyboxes[0], cash=self.two_euro_coin, amount=3)
+        baker.make(MoneyBoxContent, money_box=self.moneyboxes[0], cash=self.ten_euro_bill, amount=1)
+        baker.make(MoneyBoxContent, money_box=self.moneyboxes[1], cash=self.two_euro_coin, amount=4)
+        with transaction.atomic():
+            deleted = MoneyBoxContent.objects.filter(money_box=self.moneyboxes[0]).delete_returning('cash_id', 'amount')
+        self.assertEqual(set(deleted), {(self.two_euro_coin.id, 3), (self.ten_euro_bill.id, 1)})
+        self.assertEqual(
+            list(MoneyBoxContent.objects.values_list('money_box_id', 'amount')),
+            [(self.moneyboxes[1].id, 4)]
+        )
+
+    def test_content_is_unique_per_cash(self):
+        """Test a money box cannot hold two contents for the same cash."""
+        baker.make(MoneyBoxContent, money_box=self.moneyboxes[0], cash=self.two_euro_coin, amount=3)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            baker.make(MoneyBoxContent, money_box=self.moneyboxes[0], cash=self.two_euro_coin, amount=1)
+
+
+class CashRegistryTestCase(APITestCase):
+
+    def setUp(self):
+        # Cash objects created by the tests are rolled back without any signal
+        self.addCleanup(cash_registry.invalidate)
+
+    def test_find_cash_whatever_the_value_format(self):
+        """Test finding a cash from its type and value given as a string or a Decimal."""
+        cash = Cash.find_from_type_and_value('coin', '0.2')
+        self.assertEqual((cash.cash_type, cash.currency, cash.value), ('coin', 'EUR', Decimal('0.20')))
+        self.assertEqual(Cash.find_from_type_and_value('coin', Decimal('0.20')), cash)
+        self.assertIsNone(Cash.find_from_type_and_value('bill', '0.2'))
+        self.assertIsNone(Cash.find_from_type_and_value('coin', '0.3'))
+
+    def test_cash_values_are_stored_in_minor_units(self):
+        """Test the cash values are stored as integer minor units and values finer than a minor unit match nothing."""
+        cash = Cash.find_from_type_and_value('coin', '0.5')
+        self.assertEqual((cash.minor_value, cash.value), (50, Decimal('0.50')))
+        self.assertEqual(list(Cash.objects.values_list('minor_value', flat=True))[:3], [1, 2, 5])
+        self.assertIsNone(Cash.find_from_type_and_value('coin', '0.505'))
+        self.assertIsNone(Cash.find_from_type_and_value('coin', Decimal('Infinity')))
+
+    def test_registry_is_invalidated_when_cash_changes(self):
+        """Test a new Cash object can be found without restarting the worker."""
+        self.assertIsNone(Cash.find_from_type_and_value('bill', '500'))
+        new_bill = Cash.objects.create(cash_type='bill', value=Decimal('500'))
+        self.assertEqual(Cash.find_from_type_and_value('bill', '500'), new_bill)
+        new_bill.delete()
+        self.assertIsNone(Cash.find_from_type_and_value('bill', '500'))
+
+    @override_settings(CASH_REGISTRY_CHECK_INTERVAL=0)
+    def test_registry_reloads_when_version_changes(self):
+        """Test the registry reloads when another worker bumped the shared version stamp."""
+        self.assertIsNone(Cash.find_from_type_and_value('bill', '500'))
+        # Simulate a change made by another worker, which does not trigger the signals of this one
+        Cash.objects.bulk_create([Cash(cash_type='bill', value=Decimal('500'))])
+        self.assertIsNone(Cash.find_from_type_and_value('bill', '500'))
+        cache.set(CashRegistry.VERSION_CACHE_KEY, cache.get(CashRegistry.VERSION_CACHE_KEY, 0) + 1, timeout=None)
+        self.assertIsNotNone(Cash.find_from_type_and_value('bill', '500'))
+
+    @override_settings(CASH_REGISTRY_CHECK_INTERVAL=0)
+    def test_registry_version_is_bumped_on_commit(self):
+        """Test the other workers reload their registry only once the change of a Cash object is committed."""
+        other_registry = CashRegistry()
+        self.assertIsNone(other_registry.find('EUR', 'bill', '500'))
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                new_bill = Cash.objects.create(cash_type='bill', value=Decimal('500'))
+            self.assertEqual(cash_registry.find('EUR', 'bill', '500'), new_bill)
+            self.assertIsNone(other_registry.find('EUR', 'bill', '500'))
+        self.assertEqual(other_registry.find('EUR', 'bill', '500'), new_bill)
+
+
+class MoneyBoxBulkSaveTestCase(APITestCase):
+
+    def get_url(self) -> str:
+        return reverse('api:moneyboxes-bulk-save')
+
+    def setUp(self):
+        self.moneyboxes = baker.make(MoneyBox, _quantity=3)
+        self.moneyboxes[0].save_money([{'cash_type': 'coin', 'value': Decimal('2'), 'amount': 2}])
+        self.broken_moneybox = baker.make(MoneyBox, broken=True)
+
+    def test_bulk_save_moneyboxes(self):
+        """Test saving cash in several money boxes at once and check the wealth data of each one."""
+        payload = {
+            'deposits': [
+                {'moneybox_id': self.moneyboxes[0].id, 'cashes': [{'cash_type': 'coin', 'value': '2', 'amount': 1}]},
+                {'moneybox_id': self.moneyboxes[1].id, 'cashes': [{'cash_type': 'bill', 'value': '5', 'amount': 3}]},
+                {'moneybox_id': self.moneyboxes[0].id, 'cashes': [{'cash_type': 'bill', 'value': '10', 'amount': 1}]},
+            ]
+        }
+        response = self.client.post(self.get_url(), payload, format='json')
+        self.assertEqual(response.status_code, 201)
+        results = response.data['results']
+        self.assertEqual(
+            [result['moneybox_id'] for result in results],
+            [self.moneyboxes[0].id, self.moneyboxes[1].id, self.moneyboxes[0].id]
+        )
+        self.assertEqual(results[0]['wealth'], '16.00')
+        self.assertEqual(
+            [(cash['value'], cash['amount']) for cash in results[0]['cashes']],
+            [('2.00', 3), ('10.00', 1)]
+        )
+        self.assertEqual(results[1]['wealth'], '15.00')
+        self.assertEqual(results[2]['wealth'], '16.00')
+        self.moneyboxes[1].refresh_from_db()
+        self.assertEqual(self.moneyboxes[1].wealth_minor, 1500)
+        self.assertEqual(MoneyBoxContent.objects.filter(money_box=self.moneyboxes[2]).count(), 0)
+
+    def test_bulk_save_moneyboxes_with_errors(self):
+        """Test saving cash in several money boxes where some deposits are invalid, only the valid ones are saved."""
+        cashes = [{'cash_type': 'coin', 'value': '1', 'amount': 1}]
+        payload = {
+            'deposits': [
+                {'moneybox_id': self.moneyboxes[1].id, 'cashes': cashes},
+                {'moneybox_id': 111111, 'cashes': cashes},
+                {'moneybox_id': self.broken_moneybox.id, 'cashes': cashes},
+                {'moneybox_id': self.moneyboxes[2].id, 'cashes': [{'cash_type': 'coin', 'value': '30', 'amount': 1}]},
+            ]
+        }
+        response = self.client.post(self.get_url(), payload, format='json')
+        self.assertEqual(response.status_code, 201)
+        results = response.data['results']
+        self.assertEqual(results[0]['wealth'], '1.00')
+        self.assertEqual(results[1]['errors']['detail'], 'Not found.')
+        self.assertEqual(results[2]['errors']['detail'], 'This money box is broken you cannot use it anymore.')
+        self.assertEqual(results[3]['moneybox_id'], self.moneyboxes[2].id)
+        self.assertTrue(results[3]['errors']['cashes'])
+        self.assertEqual(MoneyBoxContent.objects.filter(money_box=self.moneyboxes[2]).count(), 0)
+
+    def test_bulk_save_moneyboxes_without_valid_deposit(self):
+        """Test saving cash in several money boxes without any valid deposit should return an error."""
+        payload = {'deposits': [{'moneybox_id': 111111, 'cashes': [{'cash_type': 'coin', 'value': '1', 'amount': 1}]}]}
+        response = self.client.post(self.get_url(), payload, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['results'][0]['errors']['detail'], 'Not found.')
+        response = self.client.post(self.get_url(), {'deposits': []}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(MONEYBOX_DEPOSIT_MODE='sharded', MONEYBOX_COUNTER_SHARDS=4)
+class MoneyBoxShardedDepositTestCase(APITestCase):
+
+    def setUp(self):
+        self.moneybox = baker.make(MoneyBox, name='Moneybox test')
+        self.cashes = [
+            {'cash_type': 'bill', 'value': Decimal('100'), 'amount': 2},
+            {'cash_type': 'coin', 'value': Decimal('0.2'), 'amount': 5},
+        ]
+
+    def test_sharded_deposits_are_summed_on_read(self):
+        """Test deposits in the sharded mode only write counters, which are merged into the wealth and contents."""
+        for _ in range(3):
+            self.moneybox.save_money(self.cashes)
+        self.assertEqual(MoneyBoxContent.objects.filter(money_box=self.moneybox).count(), 0)
+        self.assertEqual(self.moneybox.wealth_minor, 0)
+        self.assertEqual(self.moneybox.wealth, Decimal('603'))
+        response = self.client.get(reverse('api:moneyboxes-shake', args=(self.moneybox.id,)))
+        self.assertEqual(response.data['wealth'], '603.00')
+        self.assertEqual(
+            [(cash['value'], cash['amount']) for cash in response.data['cashes']],
+            [('0.20', 15), ('100.00', 6)]
+        )
+
+    def test_compact_moneybox_counters_command(self):
+        """Test the compaction folds the counters into the contents and the wealth column."""
+        self.moneybox.save_money(self.cashes)
+        self.moneybox.save_money(self.cashes)
+        call_command('compact_moneybox_counters', stdout=StringIO())
+        self.assertFalse(MoneyBoxContentShard.objects.exists())
+        self.moneybox = MoneyBox.objects.get(id=self.moneybox.id)
+        self.assertEqual(self.moneybox.wealth_minor, 40200)
+        self.assertEqual(self.moneybox.wealth, Decimal('402'))
+        self.assertEqual(
+            [(content.cash.value, content.amount) for content in self.moneybox.moneyboxcontent_set_ordered],
+            [(Decimal('0.2'), 10), (Decimal('100'), 4)]
+        )
+
+    def test_break_sharded_moneybox(self):
+        """Test breaking a money box in the sharded mode also empties its counters."""
+        self.moneybox.save_money(self.cashes)
+        response = self.client.delete(reverse('api:moneyboxes-break', args=(self.moneybox.id,)))
+        self.assertEqual(response.data['wealth'], '201.00')
+        self.assertFalse(MoneyBoxContentShard.objects.exists())
+
+    def test_compaction_drops_counters_of_broken_moneybox(self):
+        """Test counters left by a deposit which raced the break are not folded into the broken money box."""
+        self.moneybox.break_moneybox()
+        baker.make(MoneyBoxContentShard, money_box=self.moneybox, cash=Cash.find_from_type_and_value('coin', '2'),
+                   shard=0, amount=1)
+        MoneyBox.compact_pending_amounts([self.moneybox.id])
+        self.assertFalse(MoneyBoxContentShard.objects.exists())
+        self.assertFalse(MoneyBoxContent.objects.exists())
+        self.assertEqual(MoneyBox.objects.get(id=self.moneybox.id).wealth_minor, 0)
+
+
+@override_settings(MONEYBOX_DEPOSIT_MODE='ledger')
+class MoneyBoxLedgerDepositTestCase(APITestCase):
+
+    def setUp(self):
+        self.moneybox = baker.make(MoneyBox, name='Moneybox test')
+        self.cashes = [
+            {'cash_type': 'bill', 'value': Decimal('100'), 'amount': 2},
+            {'cash_type': 'coin', 'value': Decimal('0.2'), 'amount': 5},
+        ]
+
+    def test_ledger_deposits_are_summed_on_read(self):
+        """Test deposits in the ledger mode only insert ledger rows, which are merged into the wealth and contents."""
+        for _ in range(3):
+            self.moneybox.save_money(self.cashes)
+        self.assertEqual(Deposit.objects.filter(money_box=self.moneybox).count(), 6)
+        self.assertFalse(MoneyBoxContent.objects.exists())
+        self.assertEqual(self.moneybox.wealth_minor, 0)
+        self.assertEqual(self.moneybox.wealth, Decimal('603'))
+        payload = {'cashes': [{'cash_type': 'coin', 'value': '2', 'amount': 1}]}
+        response = self.client.post(reverse('api:moneyboxes-save', args=(self.moneybox.id,)), payload, format='json')
+        self.assertEqual(response.data['wealth'], '605.00')
+        self.assertEqual(
+            [(cash['value'], cash['amount']) for cash in response.data['cashes']],
+            [('0.20', 15), ('2.00', 1), ('100.00', 6)]
+        )
+
+    def test_compaction_keeps_ledger_history(self):
+        """Test the compaction folds the ledger tail into the contents and keeps the deposits as history."""
+        self.moneybox.save_money(self.cashes)
+        self.moneybox.save_money(self.cashes)
+        out = StringIO()
+        call_command('compact_moneybox_counters', stdout=out)
+        self.assertIn('Compacted 4 sharded counters and ledger deposits.', out.getvalue())
+        self.assertEqual(Deposit.objects.filter(compacted=True).count(), 4)
+        self.moneybox = MoneyBox.objects.get(id=self.moneybox.id)
+        self.assertEqual(self.moneybox.wealth_minor, 40200)
+        self.assertEqual(self.moneybox.pending_amounts, {})
+        self.assertEqual(self.moneybox.wealth, Decimal('402'))
+        self.moneybox.save_money(self.cashes)
+        self.assertEqual(self.moneybox.wealth, Decimal('603'))
+        self.assertEqual(MoneyBox.compact_pending_amounts([self.moneybox.id]), 2)
+        self.assertEqual(MoneyBox.compact_pending_amounts([self.moneybox.id]), 0)
+
+    def test_break_ledger_moneybox(self):
+        """Test breaking a money box in the ledger mode includes and compacts its ledger tail."""
+        self.moneybox.save_money(self.cashes)
+        response = self.client.delete(reverse('api:moneyboxes-break', args=(self.moneybox.id,)))
+        self.assertEqual(response.data['wealth'], '201.00')
+        self.assertFalse(Deposit.objects.filter(compacted=False).exists())
+        self.assertEqual(Deposit.objects.count(), 2)
+
+
+@skipIf(connection.vendor == 'sqlite', 'SQLite rejects concurrent writers with a database lock error.')
+class MoneyBoxConcurrentDepositTestCase(TransactionTestCase):
+    serialized_rollback = True
+    threads_count = 8
+    deposits_per_thread = 25
+
+    def setUp(self):
+        self.moneybox = baker.make(MoneyBox, name='Moneybox test')
+
+    def deposit_concurrently(self):
+        barrier = Barrier(self.threads_count)
+        errors = []
+
+        def deposit():
+            try:
+                money_box = MoneyBox.objects.get(id=self.moneybox.id)
+                barrier.wait()
+                for _ in range(self.deposits_per_thread):
+                    money_box.save_money([
+                        {'cash_type': 'coin', 'value': Decimal('1'), 'amount': 1},
+                        {'cash_type': 'coin', 'value': Decimal('0.5'), 'amount': 2},
+                    ])
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connections.close_all()
+
+        threads = [Thread(target=deposit) for _ in range(self.threads_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def assert_no_lost_deposit(self):
+        deposits_count = self.threads_count * self.deposits_per_thread
+        self.moneybox.refresh_from_db()
+        self.assertEqual(self.moneybox.wealth_minor, deposits_count * 200)
+        self.assertEqual(
+            sorted(
+                (content.cash.value, content.amount)
+                for content in self.moneybox.moneyboxcontent_set.select_related('cash')
+            ),
+            [(Decimal('0.5'), deposits_count * 2), (Decimal('1'), deposits_count)]
+        )
+
+    def test_concurrent_atomic_deposits(self):
+        """Test concurrent deposits into the same money box with atomic increments do not lose any increment."""
+        self.deposit_concurrently()
+        self.assert_no_lost_deposit()
+
+    @override_settings(MONEYBOX_DEPOSIT_MODE='sharded')
+    def test_concurrent_sharded_deposits(self):
+        """Test concurrent deposits into the same money box with sharded counters do not lose any increment."""
+        self.deposit_concurrently()
+        call_command('compact_moneybox_counters', stdout=StringIO())
+        self.assert_no_lost_deposit()
+
+    def deposit_during_break(self) -> list:
+        """Start a deposit while the money box is being broken, and return its results once the break committed."""
+        results = []
+
+        def deposit():
+            try:
+                results.append(MoneyBox.objects.get(id=self.moneybox.id).save_money([
+                    {'cash_type': 'coin', 'value': Decimal('1'), 'amount': 1},
+                ]))
+            except Exception as error:
+                results.append(error)
+            finally:
+                connections.close_all()
+
+        thread = Thread(target=deposit)
+        with transaction.atomic():
+            self.moneybox.break_moneybox()
+            thread.start()
+            thread.join(0.2)
+            # The deposit waits for the break to be committed
+            self.assertTrue(thread.is_alive())
+        thread.join()
+        return results
+
+    @override_settings(MONEYBOX_DEPOSIT_MODE='sharded')
+    def test_sharded_deposit_waits_for_break(self):
+        """Test a sharded deposit racing a break reports the money box as broken instead of losing the cash."""
+        self.assertEqual(self.deposit_during_break(), [False])
+        self.assertFalse(MoneyBoxContentShard.objects.exists())
+
+    @override_settings(MONEYBOX_DEPOSIT_MODE='ledger')
+    def test_ledger_deposit_waits_for_break(self):
+        """Test a ledger deposit racing a break reports the money box as broken instead of losing the cash."""
+        self.assertEqual(self.deposit_during_break(), [False])
+        self.assertFalse(Deposit.objects.exists())
+
+
+class MoneyBoxConditionalGetTestCase(APITestCase):
+
+    def setUp(self):
+        self.moneybox = baker.make(MoneyBox, name='Moneybox test')
+        self.moneybox.save_money([{'cash_type': 'bill', 'value': Decimal('100'), 'amount': 2}])
+
+    def test_shake_moneybox_not_modified(self):
+        """Test shaking a money box with its current ETag returns a 304 from a single query."""
+        url = reverse('api:moneyboxes-shake', args=(self.moneybox.id,))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['ETag'])
+        self.assertTrue(response['Last-Modified'])
+        with self.assertNumQueries(1):
+            not_modified_response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified_response.status_code, 304)
+        self.assertEqual(not_modified_response['ETag'], response['ETag'])
+
+    def test_shake_moneybox_modified(self):
+        """Test shaking a money box with an outdated ETag returns the new wealth data."""
+        url = reverse('api:moneyboxes-shake', args=(self.moneybox.id,))
+        etag = self.client.get(url)['ETag']
+        self.moneybox.save_money([{'cash_type': 'coin', 'value': Decimal('2'), 'amount': 1}])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['wealth'], '202.00')
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_retrieve_moneybox_not_modified_since(self):
+        """Test retrieving a money box not modified since the given date returns a 304."""
+        url = reverse('api:moneyboxes-detail', args=(self.moneybox.id,))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    @override_settings(MONEYBOX_DEPOSIT_MODE='sharded')
+    def test_conditional_get_ignored_in_sharded_mode(self):
+        """Test conditional requests are ignored in the sharded mode where deposits do not bump the money box."""
+        url = reverse('api:moneyboxes-shake', args=(self.moneybox.id,))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=self.moneybox.etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+
+
+class MoneyBoxWealthCacheTestCase(APITestCase):
+
+    def setUp(self):
+        wealth_cache.backend.clear()
+        self.moneybox = baker.make(MoneyBox, name='Moneybox test')
+        self.moneybox.save_money([{'cash_type': 'bill', 'value': Decimal('100'), 'amount': 2}])
+        self.url = reverse('api:moneyboxes-shake', args=(self.moneybox.id,))
+
+    def test_shake_moneybox_from_cache(self):
+        """Test shaking a money box twice serves the second response from the cache."""
+        stats = wealth_cache.stats()
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        with self.assertNumQueries(1):
+            cached_response = self.client.get(self.url)
+        self.assertEqual(cached_response['X-Cache'], 'HIT')
+        self.assertEqual(cached_response.data, response.data)
+        self.assertEqual(wealth_cache.stats(), {'hits': stats['hits'] + 1, 'misses': stats['misses'] + 1})
+
+    @override_settings(MONEYBOX_WEALTH_CACHE_STATS_FLUSH_INTERVAL=0)
+    def test_cache_counters_shared_in_backend(self):
+        """Test the hits and misses are added to the counters of the backend and logged when flushed."""
+        # The counts of the previous tests may not be flushed yet
+        stats = wealth_cache.stats()
+        self.client.get(self.url)
+        with self.assertLogs('app.caches', 'INFO') as logs:
+            self.client.get(self.url)
+        expected_stats = {'hits': stats['hits'] + 1, 'misses': stats['misses'] + 1}
+        counters = wealth_cache.backend.get_many([wealth_cache.make_counter_key(name) for name in expected_stats])
+        self.assertEqual(list(counters.values()), list(expected_stats.values()))
+        self.assertEqual({'hits': logs.records[0].hits, 'misses': logs.records[0].misses}, expected_stats)
+        self.assertEqual(wealth_cache.stats(), expected_stats)
+
+    def test_save_moneybox_writes_through_cache(self):
+        """Test saving cash in a money box rewrites its cached wealth data."""
+        self.client.get(self.url)
+        payload = {'cashes': [{'cash_type': 'coin', 'value': '2', 'amount': 1}]}
+        self.client.post(reverse('api:moneyboxes-save', args=(self.moneybox.id,)), payload, format='json')
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(response.data['wealth'], '202.00')
+
+    def test_cache_entry_of_older_version_is_a_miss(self):
+        """Test a cached entry is not served once the money box changed, even without invalidation."""
+        self.client.get(self.url)
+        MoneyBox.objects.filter(id=self.moneybox.id).update(wealth_minor=100, updated_at=datetime.now(timezone.utc))
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['wealth'], '1.00')
+
+
+class AsyncMoneyBoxViewSetTestCase(APITestCase):
+
+    def setUp(self):
+        wealth_cache.backend.clear()
+        self.moneybox = baker.make(MoneyBox, name='Moneybox test')
+        self.moneybox.save_money([
+            {'cash_type': 'bill', 'value': Decimal('100'), 'amount': 2},
+            {'cash_type': 'coin', 'value': Decimal('0.2'), 'amount': 5},
+        ])
+
+    async def test_async_read_endpoints(self):
+        """Test the async list, retrieve and shake endpoints return the same data as the sync ones."""
+        for url_name, args in [('moneyboxes-list', ()), ('moneyboxes-detail', (self.moneybox.id,)),
+                               ('moneyboxes-shake', (self.moneybox.id,))]:
+            response = await self.async_client.get(reverse(f'api:async-{url_name}', args=args))
+            sync_response = await sync_to_async(self.client.get)(reverse(f'api:{url_name}', args=args))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json(), sync_response.json())
+
+    async def test_async_list_and_retrieve_query_params(self):
+        """Test the async list and retrieve endpoints are filtered and ordered like the sync ones."""
+        await MoneyBox.objects.acreate(name='Other moneybox', broken=True)
+        rich_moneybox = await MoneyBox.objects.acreate(name='Rich moneybox')
+        await rich_moneybox.asave_money([{'cash_type': 'bill', 'value': Decimal('200'), 'amount': 2}])
+        for url_name, args, query_string in [
+            ('moneyboxes-list', (), 'broken=false&nameprefix=moneybox'),
+            ('moneyboxes-list', (), 'broken=true'),
+            ('moneyboxes-list', (), 'includeWealth=true&ordering=-wealth'),
+            ('moneyboxes-list', (), 'minWealth=300&includeWealth=true'),
+            ('moneyboxes-list', (), 'ordering=wealth&pageSize=1'),
+            ('moneyboxes-list', (), 'createdAfter=yesterday'),
+            ('moneyboxes-detail', (self.moneybox.id,), 'includeWealth=true'),
+            ('moneyboxes-detail', (self.moneybox.id,), 'minWealth=300'),
+        ]:
+            url = f'{reverse(f"api:{url_name}", args=args)}?{query_string}'
+            async_url = f'{reverse(f"api:async-{url_name}", args=args)}?{query_string}'
+            response = await self.async_client.get(async_url)
+            sync_response = await sync_to_async(self.client.get)(url)
+            self.assertEqual(response.status_code, sync_response.status_code, query_string)
+            # The page links only differ by the path of the endpoint
+            self.assertEqual(
+                json.loads(response.content.decode().replace('/async/', '/')), sync_response.json(), query_string
+            )
+
+    async def test_async_shake_errors(self):
+        """Test the async shake endpoint returns the same errors as the sync one."""
+        response = await self.async_client.get(reverse('api:async-moneyboxes-shake', args=(111111,)))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json(), {'detail': 'Not found.'})
+        response = await self.async_client.post(reverse('api:async-moneyboxes-shake', args=(self.moneybox.id,)))
+        self.assertEqual(response.status_code, 405)
+
+    async def test_async_save_and_break_moneybox(self):
+        """Test saving cash in and breaking a money box through the async endpoints."""
+        payload = {'cashes': [{'cashType': 'coin', 'value': '2', 'amount': 1}]}
+        response = await self.async_client.post(
+            reverse('api:async-moneyboxes-save', args=(self.moneybox.id,)), payload, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['wealth'], '203.00')
+        self.assertEqual(
+            response.json()['cashes'][1],
+            {'cashType': 'coin', 'currency': 'EUR', 'value': '2.00', 'amount': 1}
+        )
+        payload = {'cashes': [{'cashType': 'coin', 'value': '30', 'amount': 1}]}
+        response = await self.async_client.post(
+            reverse('api:async-moneyboxes-save', args=(self.moneybox.id,)), payload, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+        response = await self.async_client.delete(reverse('api:async-moneyboxes-break', args=(self.moneybox.id,)))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['wealth'], '203.00')
+        response = await self.async_client.delete(reverse('api:async-moneyboxes-break', args=(self.moneybox.id,)))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['detail'], 'This money box is broken you cannot use it anymore.')
+
+
+@skipIf('replica' not in settings.DATABASES, 'Run with a replica database, e.g. tirelire.settings_replica_sqlite.')
+@override_settings(DATABASE_REPLICAS=['replica'], DATABASE_REPLICA_STICKINESS_SECONDS=5)
+class ReplicaRouterTestCase(APITestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        wealth_cache.backend.clear()
+        # Nothing replicates the writes, the replica copy has another name and no cash to tell which database was read
+        self.moneybox = baker.make(MoneyBox, name='Primary')
+        self.moneybox.save_money([{'cash_type': 'coin', 'value': Decimal('2'), 'amount': 1}])
+        MoneyBox.objects.using('replica').create(id=self.moneybox.id, name='Replica')
+
+    def get_name(self) -> str:
+        return self.client.get(reverse('api:moneyboxes-detail', args=(self.moneybox.id,))).data['name']
+
+    def get_wealth(self) -> str:
+        return self.client.get(reverse('api:moneyboxes-shake', args=(self.moneybox.id,))).data['wealth']
+
+    def test_read_only_actions_read_from_replica(self):
+        """Test the list, retrieve and shake actions read from the replica."""
+        self.assertEqual(self.get_name(), 'Replica')
+        self.assertEqual(self.get_wealth(), '0.00')
+        response = self.client.get(reverse('api:moneyboxes-list'))
+        self.assertEqual([moneybox['name'] for moneybox in response.data['results']], ['Replica'])
+        self.assertNotIn(settings.DATABASE_REPLICA_STICKINESS_COOKIE, response.cookies)
+
+    def test_writes_stick_to_primary(self):
+        """Test a write goes to the primary and its client reads from the primary until the cookie expires."""
+        url = reverse('api:moneyboxes-save', args=(self.moneybox.id,))
+        response = self.client.post(url, {'cashes': [{'cash_type': 'coin', 'value': '2', 'amount': 1}]}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['wealth'], '4.00')
+        self.assertFalse(MoneyBoxContent.objects.using('replica').exists())
+        cookie = response.cookies[settings.DATABASE_REPLICA_STICKINESS_COOKIE]
+        self.assertEqual(cookie['max-age'], 5)
+        self.assertEqual(self.get_name(), 'Primary')
+        self.assertEqual(self.get_wealth(), '4.00')
+        del self.client.cookies[settings.DATABASE_REPLICA_STICKINESS_COOKIE]
+        self.assertEqual(self.get_name(), 'Replica')
+
+    def test_failed_writes_do_not_stick_to_primary(self):
+        """Test a rejected write does not make its client read from the primary."""
+        url = reverse('api:moneyboxes-save', args=(self.moneybox.id,))
+        response = self.client.post(url, {'cashes': [{'cash_type': 'coin', 'value': '30', 'amount': 1}]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertNotIn(settings.DATABASE_REPLICA_STICKINESS_COOKIE, response.cookies)
+        self.assertEqual(self.get_name(), 'Replica')
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_without_replica(self):
+        """Test every action reads from the primary and no cookie is set without replica."""
+        response = self.client.post(reverse('api:moneyboxes-list'), {'name': 'New'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn(settings.DATABASE_REPLICA_STICKINESS_COOKIE, response.cookies)
+        self.assertEqual(self.get_name(), 'Primary')
+
+    async def test_async_read_only_actions_read_from_replica(self):
+        """Test the async read-only actions read from the replica and the async writes stick to the primary."""
+        url = reverse('api:async-moneyboxes-detail', args=(self.moneybox.id,))
+        self.assertEqual((await self.async_client.get(url)).json()['name'], 'Replica')
+        response = await self.async_client.post(
+            reverse('api:async-moneyboxes-save', args=(self.moneybox.id,)),
+            {'cashes': [{'cashType': 'coin', 'value': '2', 'amount': 1}]},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 201)
+        cookie = response.cookies[settings.DATABASE_REPLICA_STICKINESS_COOKIE]
+        response = await self.async_client.get(url, headers={'cookie': f'{cookie.key}={cookie.value}'})
+        self.assertEqual(response.json()['name'], 'Primary')
+
+
+class RequestMetricsMiddlewareTestCase(APITestCase):
+
+    def setUp(self):
+        wealth_cache.backend.clear()
+        self.moneybox = baker.make(MoneyBox, name='Moneybox test')
+        self.moneybox.save_money([{'cash_type': 'bill', 'value': Decimal('100'), 'amount': 2}])
+        self.url = reverse('api:moneyboxes-shake', args=(self.moneybox.id,))
+
+    def test_server_timing_header(self):
+        """Test the response tells the number of queries and the time spent in each phase of the request."""
+        response = self.client.get(self.url)
+        metrics = dict(metric.split(';', 1) for metric in response['Server-Timing'].split(', '))
+        self.assertEqual(set(metrics), {'db', 'serialize', 'render', 'total'})
+        self.assertIn('desc="2 queries"', metrics['db'])
+        self.assertNotEqual(metrics['serialize'], 'dur=0.000')
+
+    def test_server_timing_header_async(self):
+        """Test the queries of the async views are recorded as well."""
+        response = self.client.get(reverse('api:async-moneyboxes-shake', args=(self.moneybox.id,)))
+        self.assertIn('desc="2 queries"', response['Server-Timing'])
+
+    async def test_server_timing_header_asgi(self):
+        """Test the queries of the async views served through ASGI are recorded by the sync middleware chain."""
+        response = await self.async_client.get(reverse('api:async-moneyboxes-shake', args=(self.moneybox.id,)))
+        self.assertIn('desc="2 queries"', response['Server-Timing'])
+
+    @override_settings(REQUEST_METRICS_QUERY_BUDGETS={'api:moneyboxes-shake': 1})
+    def test_query_budget_exceeded(self):
+        """Test a warning is logged when a request runs more queries than the budget of its view."""
+        with self.assertLogs('app.middleware', 'WARNING') as logs:
+            self.client.get(self.url)
+        self.assertEqual(logs.records[0].view_name, 'api:moneyboxes-shake')
+        self.assertEqual(logs.records[0].query_count, 2)
+        self.assertEqual(logs.records[0].query_budget, 1)
+
+    def test_query_budget_respected(self):
+        """Test nothing is logged when a request stays within the budget of its view."""
+        with self.assertNoLogs('app.middleware', 'WARNING'):
+            self.client.get(self.url)
+
+    @override_settings(REQUEST_METRICS_ENABLED=False)
+    def test_metrics_disabled(self):
+        """Test the middleware is unloaded when the metrics are disabled."""
+        response = self.client.get(self.url)
+        self.assertNotIn('Server-Timing', response)
+
+
+class MoneyBoxBenchmarkSuiteTestCase(APITestCase):
+
+    def test_run_suite(self):
+        """Test the benchmark suite reports every case for every size and denomination mix."""
+        report = MoneyBoxBenchmarkSuite(sizes=[1, 3], mixes=['single', 'all'], iterations=2).run()
+        self.assertEqual(len(report['results']), 2 * 2 * 15)
+        result = report['results']['api.shake[boxes=3,mix=all]']
+        self.assertEqual(result['count'], 2)
+        self.assertEqual(result['queries'], 2)
+        # The 3 money boxes of the largest size and one money box per run of api.break for each size
+        self.assertEqual(MoneyBox.objects.filter(name__startswith='Benchmark all').count(), 3 + 2 * 2)
+
+    def test_compare_with_baseline(self):
+        """Test the cases slower than the tolerance or running more queries are reported as regressions."""
+        baseline = {'results': {
+            'api.shake[boxes=10,mix=all]': {'p50_ms': 10.0, 'queries': 2},
+            'api.save[boxes=10,mix=all]': {'p50_ms': 10.0, 'queries': 7},
+        }}
+        report = {'results': {
+            'api.shake[boxes=10,mix=all]': {'p50_ms': 11.0, 'queries': 2},
+            'api.save[boxes=10,mix=all]': {'p50_ms': 13.0, 'queries': 8},
+            'api.list[boxes=10,mix=all]': {'p50_ms': 100.0, 'queries': 1},
+        }}
+        self.assertEqual(compare_with_baseline(report, baseline, tolerance=0.2), [
+            'api.save[boxes=10,mix=all]: p50 13.0ms, baseline 10.0ms',
+            'api.save[boxes=10,mix=all]: 8 queries, baseline 7',
+        ])
+
+
+class MoneyBoxStatisticsTestCase(APITestCase):
+
+    def setUp(self):
+        self.url = reverse('api:moneyboxes-statistics')
+        self.moneyboxes = baker.make(MoneyBox, _quantity=3)
+        self.moneyboxes[0].save_money([
+            {'cash_type': 'bill', 'value': Decimal('100'), 'amount': 2},
+            {'cash_type': 'coin', 'value': Decimal('0.2'), 'amount': 5},
+        ])
+        self.moneyboxes[1].save_money([{'cash_type': 'bill', 'value': Decimal('100'), 'amount': 1}])
+        MoneyBox.bulk_save_money({self.moneyboxes[2].id: [{'cash_type': 'coin', 'value': Decimal('2'), 'amount': 3}]})
+
+    def get_amounts(self, response) -> dict:
+        return {cash['value']: cash['amount'] for cash in response.data['cashes'] if cash['amount']}
+
+    def test_get_statistics(self):
+        """Test to get the total wealth and the amount of each cash of all the money boxes from the rollups."""
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['currencies'], [{'currency': 'EUR', 'wealth': '307.00'}])
+        self.assertEqual(len(response.data['cashes']), len(Cash.get_all()))
+        self.assertEqual(self.get_amounts(response), {'0.20': 5, '2.00': 3, '100.00': 3})
+
+    def test_broken_moneyboxes_are_not_counted(self):
+        """Test breaking a money box removes its contents from the statistics."""
+        self.moneyboxes[0].break_moneybox()
+        response = self.client.get(self.url)
+        self.assertEqual(response.data['currencies'], [{'currency': 'EUR', 'wealth': '106.00'}])
+        self.assertEqual(self.get_amounts(response), {'2.00': 3, '100.00': 1})
+
+    @override_settings(MONEYBOX_DEPOSIT_MODE='ledger')
+    def test_pending_deposits_are_counted_once_compacted(self):
+        """Test the deposits of the ledger are counted in the statistics once compacted."""
+        self.moneyboxes[1].save_money([{'cash_type': 'coin', 'value': Decimal('2'), 'amount': 1}])
+        self.assertEqual(self.client.get(self.url).data['currencies'][0]['wealth'], '307.00')
+        call_command('compact_moneybox_counters', stdout=StringIO())
+        self.assertEqual(self.client.get(self.url).data['currencies'][0]['wealth'], '309.00')
+
+    def test_rebuild_cash_rollups_command(self):
+        """Test the command detects and fixes out of sync rollups."""
+        CashRollup.objects.filter(cash=Cash.find_from_type_and_value('bill', '100')).delete()
+        with self.assertRaises(CommandError):
+            call_command('rebuild_cash_rollups', '--check', stdout=StringIO())
+        out = StringIO()
+        call_command('rebuild_cash_rollups', stdout=out)
+        self.assertIn('Bill of 100.00 EUR: rollup amount 0, computed amount 3', out.getvalue())
+        call_command('rebuild_cash_rollups', '--check', stdout=StringIO())
+        self.assertEqual(self.get_amounts(self.client.get(self.url)), {'0.20': 5, '2.00': 3, '100.00': 3})
+
+
+class MoneyBoxExportTestCase(APITestCase):
+
+    def setUp(self):
+        self.url = reverse('api:moneyboxes-export')
+        self.moneyboxes = baker.make(MoneyBox, _quantity=3)
+        self.moneyboxes[0].save_money([
+            {'cash_type': 'bill', 'value': Decimal('100'), 'amount': 2},
+            {'cash_type': 'coin', 'value': Decimal('0.2'), 'amount': 5},
+        ])
+        self.moneyboxes[2].save_money([{'cash_type': 'coin', 'value': Decimal('2'), 'amount': 1}])
+
+    def test_export_ndjson(self):
+        """Test to export every money box with its contents and wealth as NDJSON in a single query."""
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+            content = b''.join(response.streaming_content).decode()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([line['id'] for line in lines], [moneybox.id for moneybox in self.moneyboxes])
+        self.assertEqual(lines[0]['wealth'], '201.00')
+        self.assertEqual(lines[0]['cashes'], [
+            {'cashType': 'coin', 'currency': 'EUR', 'value': '0.20', 'amount': 5},
+            {'cashType': 'bill', 'currency': 'EUR', 'value': '100.00', 'amount': 2},
+        ])
+        self.assertEqual((lines[1]['wealth'], lines[1]['cashes']), ('0.00', []))
+        detail = self.client.get(reverse('api:moneyboxes-detail', args=(self.moneyboxes[2].id,))).data
+        self.assertEqual(lines[2]['updatedAt'], detail['updated_at'])
+
+    def test_export_csv(self):
+        """Test to export every money box with its contents as CSV, one row per money box and cash."""
+        response = self.client.get(self.url, {'fileFormat': 'csv'})
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.DictReader(StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(
+            [(int(row['id']), row['wealth'], row['value'], row['amount']) for row in rows],
+            [
+                (self.moneyboxes[0].id, '201.00', '0.20', '5'),
+                (self.moneyboxes[0].id, '201.00', '100.00', '2'),
+                (self.moneyboxes[1].id, '0.00', '', ''),
+                (self.moneyboxes[2].id, '2.00', '2.00', '1'),
+            ]
+        )
+
+    async def test_export_asgi(self):
+        """Test the export is streamed through an async iterator under ASGI, in chunks of lines."""
+        response = await self.async_client.get(self.url, {'fileFormat': 'csv'})
+        self.assertTrue(response.is_async)
+        chunks = [chunk async for chunk in response.streaming_content]
+        sync_content = await sync_to_async(
+            lambda: b''.join(self.client.get(self.url, {'fileFormat': 'csv'}).streaming_content)
+        )()
+        self.assertEqual(b''.join(chunks), sync_content)
+        with override_settings(MONEYBOX_EXPORT_CHUNK_SIZE=2):
+            response = await self.async_client.get(self.url)
+            self.assertEqual(len([chunk async for chunk in response.streaming_content]), 2)
+
+    def test_export_invalid_format(self):
+        """Test to get an error from the API's response when the export format is unknown."""
+        response = self.client.get(self.url, {'fileFormat': 'xml'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_export_moneyboxes_command(self):
+        """Test the command writes the same export as the endpoint."""
+        out = StringIO()
+        call_command('export_moneyboxes', '--chunk-size', '2', stdout=out)
+        response = self.client.get(self.url)
+        self.assertEqual(out.getvalue(), b''.join(response.streaming_content).decode())
+
+
+class MoneyBoxImportTestCase(APITestCase):
+
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def _write(self, file_name: str, content: str) -> str:
+        path = os.path.join(self.directory.name, file_name)
+        with open(path, 'w') as import_file:
+            import_file.write(content)
+        return path
+
+    def test_import_csv(self):
+        """Test to import deposits from a CSV file, creating the money boxes and updating the rollups."""
+        path = self._write('deposits.csv', (
+            'externalRef,name,cashType,value,amount\n'
+            'box-1,Holidays,bill,100,2\n'
+            'box-1,Holidays,coin,0.2,5\n'
+            'box-2,,coin,2,1\n'
+            'box-1,Holidays,bill,100,1\n'
+        ))
+        out = StringIO()
+        call_command('import_moneyboxes', path, '--batch-size', '2', stdout=out)
+        self.assertIn('Imported 4 rows, rejected 0 rows.', out.getvalue())
+        first_box = MoneyBox.objects.get(external_ref='box-1')
+        self.assertEqual((first_box.name, first_box.wealth), ('Holidays', Decimal('301.00')))
+        self.assertEqual(
+            [(content.cash.value, content.amount) for content in first_box.moneyboxcontent_set_ordered],
+            [(Decimal('0.20'), 5), (Decimal('100.00'), 3)],
+        )
+        second_box = MoneyBox.objects.get(external_ref='box-2')
+        self.assertEqual((second_box.name, second_box.wealth), ('box-2', Decimal('2.00')))
+        self.assertEqual(CashRollup.get_amounts(), {
+            cash_registry.find('EUR', 'bill', '100').id: 3,
+            cash_registry.find('EUR', 'coin', '0.2').id: 5,
+            cash_registry.find('EUR', 'coin', '2').id: 1,
+        })
+
+    def test_import_ndjson_into_existing_money_boxes(self):
+        """Test to import deposits from a NDJSON file into existing money boxes, ignoring the broken ones."""
+        money_box = baker.make(MoneyBox, external_ref='box-1')
+        money_box.save_money([{'cash_type': 'coin', 'value': Decimal('1'), 'amount': 1}])
+        broken_box = baker.make(MoneyBox, external_ref='box-2', broken=True)
+        baker.make(MoneyBox, external_ref='box-3', broken=True)
+        ArchivedMoneyBox.archive_broken_money_boxes(batch_size=1)
+        path = self._write('deposits.ndjson', (
+            '{"externalRef": "box-1", "cashType": "coin", "value": "1.00", "amount": 2}\n'
+            '\n'
+            '{"externalRef": "box-2", "cashType": "coin", "value": "1.00", "amount": 2}\n'
+            '{"externalRef": "box-3", "cashType": "coin", "value": "1.00", "amount": 2}\n'
+        ))
+        call_command('import_moneyboxes', path, stdout=StringIO())
+        money_box.refresh_from_db()
+        self.assertEqual(money_box.wealth, Decimal('3.00'))
+        self.assertFalse(MoneyBoxContent.objects.exclude(money_box=money_box).exists())
+        self.assertEqual(set(MoneyBox.objects.values_list('external_ref', flat=True)), {'box-1', 'box-3'})
+        self.assertTrue(ArchivedMoneyBox.objects.filter(id=broken_box.id, external_ref='box-2').exists())
+
+    def test_import_invalid_rows(self):
+        """Test the invalid rows are reported with their line number and skipped."""
+        path = self._write('deposits.csv', (
+            'externalRef,cashType,value,amount\n'
+            'box-1,coin,3,1\n'
+            ',coin,1,1\n'
+            'box-1,coin,1,-2\n'
+            'box-1,coin,abc,1\n'
+            'box-1,coin,1,4\n'
+        ))
+        out, err = StringIO(), StringIO()
+        call_command('import_moneyboxes', path, stdout=out, stderr=err)
+        self.assertIn('Imported 1 rows, rejected 4 rows.', out.getvalue())
+        self.assertEqual([line.split(':')[0] for line in err.getvalue().splitlines()], [
+            'Line 2', 'Line 3', 'Line 4', 'Line 5',
+        ])
+        self.assertEqual(MoneyBox.objects.get().wealth, Decimal('4.00'))
+
+    def test_import_unknown_format(self):
+        """Test to get an error when the format of the file cannot be inferred."""
+        path = self._write('deposits.xml', '')
+        with self.assertRaises(CommandError):
+            call_command('import_moneyboxes', path, stdout=StringIO())
+
+
+class MoneyBoxArchiveTestCase(APITestCase):
+
+    def setUp(self):
+        wealth_cache.backend.clear()
+        self.moneybox = baker.make(MoneyBox, name='Live')
+        self.broken_moneyboxes = baker.make(MoneyBox, _quantity=3, name='Broken')
+        for moneybox in self.broken_moneyboxes:
+            moneybox.save_money([{'cash_type': 'bill', 'value': Decimal('5'), 'amount': 2}])
+            moneybox.break_moneybox()
+        self.archived_moneybox = self.broken_moneyboxes[0]
+
+    def archive(self) -> str:
+        stdout = StringIO()
+        call_command('archive_moneyboxes', batch_size=2, stdout=stdout)
+        return stdout.getvalue()
+
+    def test_archive_command(self):
+        """Test the broken money boxes are moved by batches with their final snapshot, the live ones are kept."""
+        self.assertIn('Archived 3 broken money boxes.', self.archive())
+        self.assertEqual(list(MoneyBox.objects.values_list('id', flat=True)), [self.moneybox.id])
+        archived_moneyboxes = ArchivedMoneyBox.objects.order_by('id')
+        self.assertEqual([archived.id for archived in archived_moneyboxes], [box.id for box in self.broken_moneyboxes])
+        money_box = archived_moneyboxes[0].to_money_box()
+        self.assertEqual(money_box.final_snapshot, self.archived_moneybox.final_snapshot)
+        self.assertEqual(money_box.final_wealth, Decimal('10.00'))
+        self.assertEqual(money_box.updated_at, self.archived_moneybox.updated_at)
+        self.assertIn('Archived 0 broken money boxes.', self.archive())
+
+    @override_settings(MONEYBOX_DEPOSIT_MODE='ledger')
+    def test_archive_ledger_moneybox(self):
+        """Test the ledger deposits of an archived money box are kept in the archive as its history."""
+        moneybox = baker.make(MoneyBox, name='Ledger')
+        moneybox.save_money([{'cash_type': 'bill', 'value': Decimal('10'), 'amount': 1}])
+        call_command('compact_moneybox_counters', stdout=StringIO())
+        moneybox.save_money([{'cash_type': 'coin', 'value': Decimal('2'), 'amount': 3}])
+        moneybox.break_moneybox()
+        deposits = list(
+            Deposit.objects.filter(money_box=moneybox).order_by('id')
+            .values_list('id', 'cash_id', 'amount', 'created_at', 'compacted')
+        )
+        self.assertEqual(len(deposits), 2)
+        self.archive()
+        self.assertFalse(Deposit.objects.filter(money_box_id=moneybox.id).exists())
+        self.assertEqual(
+            list(
+                ArchivedDeposit.objects.filter(money_box_id=moneybox.id).order_by('id')
+                .values_list('id', 'cash_id', 'amount', 'created_at', 'compacted')
+            ),
+            deposits,
+        )
+
+    def test_retrieve_archived_moneybox(self):
+        """Test an archived money box is retrieved from the archive and the other actions answer it is broken."""
+        self.archive()
+        url = reverse('api:moneyboxes-detail', args=(self.archived_moneybox.id,))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['name'], 'Broken')
+        self.assertTrue(response.data['broken'])
+        self.assertEqual(response['ETag'], self.archived_moneybox.etag)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=self.archived_moneybox.etag).status_code, 304)
+        self.assertEqual(self.client.get(url, {'include_wealth': 'true'}).data['wealth'], '0.00')
+        for method, url_name in [('get', 'shake'), ('post', 'save'), ('post', 'withdraw'), ('delete', 'break')]:
+            response = getattr(self.client, method)(
+                reverse(f'api:moneyboxes-{url_name}', args=(self.archived_moneybox.id,)),
+                {'cashes': [], 'amount': '1'},
+                format='json',
+            )
+            self.assertEqual(response.status_code, 400, url_name)
+            self.assertEqual(response.data['detail'], 'This money box is broken you cannot use it anymore.')
+        self.assertEqual(self.client.get(reverse('api:moneyboxes-detail', args=(111111,))).status_code, 404)
+        response = self.client.get(reverse('api:moneyboxes-list'))
+        self.assertEqual([moneybox['id'] for moneybox in response.data['results']], [self.moneybox.id])
+
+    def test_bulk_save_into_archived_moneybox(self):
+        """Test a deposit into an archived money box is reported as broken by the bulk save."""
+        self.archive()
+        cashes = [{'cash_type': 'coin', 'value': '1', 'amount': 1}]
+        response = self.client.post(reverse('api:moneyboxes-bulk-save'), {'deposits': [
+            {'moneybox_id': self.moneybox.id, 'cashes': cashes},
+            {'moneybox_id': self.archived_moneybox.id, 'cashes': cashes},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['results'][0]['wealth'], '1.00')
+        self.assertEqual(
+            response.data['results'][1]['errors']['detail'], 'This money box is broken you cannot use it anymore.',
+        )
+
+    async def test_async_retrieve_archived_moneybox(self):
+        """Test the async retrieve endpoint reads an archived money box from the archive."""
+        await sync_to_async(self.archive)()
+        args = (self.archived_moneybox.id,)
+        response = await self.async_client.get(reverse('api:async-moneyboxes-detail', args=args))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['broken'])
+        response = await self.async_client.get(reverse('api:async-moneyboxes-shake', args=args))
+        self.assertEqual(response.status_code, 400)
+
+
+class MoneyBoxIdempotencyTestCase(APITestCase):
+
+    def setUp(self):
+        idempotent_response_store.backend.clear()
+        self.moneybox = baker.make(MoneyBox)
+        self.url = reverse('api:moneyboxes-save', args=(self.moneybox.id,))
+        self.payload = {'cashes': [{'cash_type': 'bill', 'value': '10', 'amount': 1}]}
+
+    def save(self, key: str, payload: Optional[dict] = None):
+        return self.client.post(self.url, payload or self.payload, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_stored_response(self):
+        """Test a retry with the same key gets the stored response without any query and saves the cash once."""
+        response = self.save('key-1')
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', response)
+        with self.assertNumQueries(0):
+            retry_response = self.save('key-1')
+        self.assertEqual(retry_response.status_code, 201)
+        self.assertEqual(retry_response['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry_response.content, response.content)
+        self.assertEqual(self.save('key-2').data['wealth'], '20.00')
+        self.assertEqual(self.client.post(self.url, self.payload, format='json').data['wealth'], '30.00')
+
+    def test_key_reused_with_another_payload(self):
+        """Test a key sent again with another payload is rejected, and is scoped to its endpoint."""
+        self.save('key-1')
+        response = self.save('key-1', {'cashes': [{'cash_type': 'bill', 'value': '20', 'amount': 1}]})
+        self.assertEqual(response.status_code, 422)
+        self.url = reverse('api:moneyboxes-save', args=(baker.make(MoneyBox).id,))
+        self.assertEqual(self.save('key-1').status_code, 201)
+        self.moneybox.refresh_from_db()
+        self.assertEqual(self.moneybox.wealth, Decimal('10.00'))
+
+    def test_failed_requests_are_not_stored(self):
+        """Test a failed request runs again when retried with the same key."""
+        payload = {'cashes': [{'cash_type': 'bill', 'value': '30', 'amount': 1}]}
+        self.assertEqual(self.save('key-1', payload).status_code, 400)
+        response = self.save('key-1', payload)
+        self.assertEqual(response.status_code, 400)
+        self.assertNotIn('Idempotent-Replayed', response)
+        response = self.client.post(self.url, self.payload, format='json', HTTP_IDEMPOTENCY_KEY='k' * 256)
+        self.assertEqual(response.status_code, 400)
+
+    def test_create_and_break_replay(self):
+        """Test the retries of a creation and of a break get the stored responses."""
+        url = reverse('api:moneyboxes-list')
+        response = self.client.post(url, {'name': 'Idempotent'}, format='json', HTTP_IDEMPOTENCY_KEY='create-1')
+        retry_response = self.client.post(url, {'name': 'Idempotent'}, format='json', HTTP_IDEMPOTENCY_KEY='create-1')
+        self.assertEqual(retry_response.status_code, 201)
+        self.assertEqual(retry_response.data['id'], response.data['id'])
+        self.assertEqual(MoneyBox.objects.filter(name='Idempotent').count(), 1)
+        self.save('key-1')
+        url = reverse('api:moneyboxes-break', args=(self.moneybox.id,))
+        response = self.client.delete(url, HTTP_IDEMPOTENCY_KEY='break-1')
+        self.assertEqual(response.status_code, 200)
+        retry_response = self.client.delete(url, HTTP_IDEMPOTENCY_KEY='break-1')
+        self.assertEqual(retry_response.status_code, 200)
+        self.assertEqual(retry_response.data, response.data)
+        self.assertEqual(retry_response.data['wealth'], '10.00')
+
+    def test_concurrent_duplicate_waits_for_response(self):
+        """Test a duplicate of a request in progress replays its response once stored, or gets a 409 meanwhile."""
+        request = APIRequestFactory().post(self.url)
+        key = idempotent_response_store.make_key(request, 'key-1')
+        token = idempotent_response_store.acquire(key)
+        with override_settings(MONEYBOX_IDEMPOTENCY_WAIT_TIMEOUT=0):
+            self.assertEqual(self.save('key-1').status_code, 409)
+
+        def finish_first_request():
+            fingerprint = idempotent_response_store.make_fingerprint(Request(
+                APIRequestFactory().post(self.url, self.payload, format='json'), parsers=[JSONParser()],
+            ).data)
+            idempotent_response_store.set(key, StoredResponse(fingerprint, 201, {'wealth': '10.00'}))
+            idempotent_response_store.release(key, token)
+
+        timer = Timer(0.1, finish_first_request)
+        timer.start()
+        self.addCleanup(timer.cancel)
+        with self.assertNumQueries(0):
+            response = self.save('key-1')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data, {'wealth': '10.00'})
+        self.assertFalse(self.moneybox.moneyboxcontent_set.exists())
+
+    async def test_async_retry_replays_stored_response(self):
+        """Test the async save and break endpoints replay the stored responses of the retries too."""
+        url = reverse('api:async-moneyboxes-save', args=(self.moneybox.id,))
+        payload = json.dumps(self.payload)
+        response = await self.async_client.post(url, payload, content_type='application/json',
+                                                headers={'idempotency-key': 'key-1'})
+        self.assertEqual(response.status_code, 201)
+        retry_response = await self.async_client.post(url, payload, content_type='application/json',
+                                                      headers={'idempotency-key': 'key-1'})
+        self.assertEqual(retry_response['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry_response.content, response.content)
+        response = await self.async_client.post(url, json.dumps({'cashes': []}), content_type='application/json',
+                                                headers={'idempotency-key': 'key-1'})
+        self.assertEqual(response.status_code, 422)
+        url = reverse('api:async-moneyboxes-break', args=(self.moneybox.id,))
+        response = await self.async_client.delete(url, headers={'idempotency-key': 'break-1'})
+        retry_response = await self.async_client.delete(url, headers={'idempotency-key': 'break-1'})
+        self.assertEqual(retry_response.status_code, 200)
+        self.assertEqual(retry_response.json(), response.json())
+        self.assertEqual(retry_response.json()['wealth'], '10.00')
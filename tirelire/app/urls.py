@@ -3,7 +3,7 @@ from drf_yasg import openapi
 from drf_yasg.views import get_schema_view
 from rest_framework import routers
 
-from app import views as api_views
+from app import async_views, views as api_views
 
 schema_view = get_schema_view(
    openapi.Info(
@@ -15,13 +15,27 @@ schema_view = get_schema_view(
         Grâce à cette API vous avez la possibilité de:
         - Créer une tireline avec l'endpoint: POST /moneyboxes/
         - Lister les tirelires avec l'endpoint: GET /moneyboxes/
+          (avec leur richesse via ?include_wealth=true, triées par richesse via ?ordering=wealth
+          et filtrées par richesse via ?min_wealth= et ?max_wealth=, par état via ?broken=,
+          par date de création via ?created_after= et ?created_before=, par date de mise à jour via ?updated_since=
+          et par nom via ?name_prefix= et ?search=)
         - Retrouver les informations basiques d'une tirelire avec l'endpoint: GET /moneyboxes/{id}/
         - Secouer une tirelire pour y savoir son contenu et votre richesse avec l'endpoint: GET /moneyboxes/{id}/shake/
         - Épargner de la monnaie dans une tirelire avec l'endpoint: GET /moneyboxes/{id}/shake/
         - Casser une tirelire avec l'endpoint: GET /moneyboxes/{id}/break/
+        - Retirer un montant d'une tirelire avec le moins de pièces et billets possible
+          avec l'endpoint: POST /moneyboxes/{id}/withdraw/
+        - Épargner de la monnaie dans plusieurs tirelires à la fois avec l'endpoint: POST /moneyboxes/save/
+        - Connaître la richesse totale et le nombre de chaque pièce et billet de toutes les tirelires
+          avec l'endpoint: GET /moneyboxes/statistics/
+        - Exporter toutes les tirelires avec leur contenu en NDJSON ou CSV avec l'endpoint: GET /moneyboxes/export/
 
         La monnaie est limitée à de la monnaie avec pièces et billets de la devise Euro.
         Casser une tirelire retourna son contenu et votre richesse finale, après ça elle ne sera plus utilisable.
+        Les requêtes de création, d'épargne, de retrait et de cassage acceptent un en-tête Idempotency-Key:
+        les nouvelles tentatives envoyées avec la même clé reçoivent la réponse de la première requête sans la rejouer.
+        Les tirelires cassées sont archivées régulièrement: elles ne sont plus listées ni exportées
+        mais restent consultables avec l'endpoint: GET /moneyboxes/{id}/
         """
       ),
       contact=openapi.Contact(email="jesuispaulbonnet@gmail.com"),
@@ -31,8 +45,36 @@ schema_view = get_schema_view(
 router = routers.DefaultRouter()
 router.register(r'moneyboxes', api_views.MoneyBoxViewSet, basename='moneyboxes')
 
+AsyncMoneyBoxViewSet = async_views.AsyncMoneyBoxViewSet
+
+# Native async versions of the main money box endpoints, to be served by an ASGI server
+async_urlpatterns = [
+    path('moneyboxes/', AsyncMoneyBoxViewSet.as_view({'get': 'list'}), name='async-moneyboxes-list'),
+    path(
+        'moneyboxes/<int:pk>/',
+        AsyncMoneyBoxViewSet.as_view({'get': 'retrieve'}),
+        name='async-moneyboxes-detail',
+    ),
+    path(
+        'moneyboxes/<int:pk>/shake/',
+        AsyncMoneyBoxViewSet.as_view({'get': 'shake'}),
+        name='async-moneyboxes-shake',
+    ),
+    path(
+        'moneyboxes/<int:pk>/save/',
+        AsyncMoneyBoxViewSet.as_view({'post': 'save'}),
+        name='async-moneyboxes-save',
+    ),
+    path(
+        'moneyboxes/<int:pk>/break/',
+        AsyncMoneyBoxViewSet.as_view({'delete': 'break_moneybox'}),
+        name='async-moneyboxes-break',
+    ),
+]
+
 urlpatterns = [
     path('api/v1/', include(router.urls)),
+    path('api/v1/async/', include(async_urlpatterns)),
     re_path(r'^swagger(?P<format>\.json|\.yaml)$', schema_view.without_ui(cache_timeout=0), name='schema-json'),
     re_path(r'^api/swagger-doc/$', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
 ]
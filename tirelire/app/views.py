@@ -1,13 +1,38 @@
-from typing import Union
+from collections import defaultdict
+from typing import Optional, Union
 
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpRequest, HttpResponseBase, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from drf_yasg import openapi
+from drf_yasg.utils import swagger_auto_schema
 from rest_framework import mixins, status, viewsets
 from rest_framework.decorators import action
-from rest_framework.exceptions import APIException
+from rest_framework.exceptions import APIException, NotFound, ValidationError
+from rest_framework.permissions import SAFE_METHODS
 from rest_framework.request import Request
 
-from app.models import MoneyBox
-from app.serializers import MoneyBoxSerializer, MoneyBoxWealthSerializer, MoneyBoxContentSerializer
+from app.caches import wealth_cache
+from app.exports import EXPORT_CONTENT_TYPES, EXPORTERS, aiter_export
+from app.filters import MoneyBoxFilter, MoneyBoxOrderingFilter, MoneyBoxWealthFilter, is_wealth_included
+from app.idempotency import IDEMPOTENCY_KEY_PARAMETER, idempotent
+from app.models import ArchivedMoneyBox, Cash, CashRollup, MoneyBox
+from app.pagination import MoneyBoxCursorPagination
+from app.routers import stick_to_primary, use_replica
+from app.serializers import (
+    MoneyBoxBulkDepositSerializer,
+    MoneyBoxContentSerializer,
+    MoneyBoxDepositSerializer,
+    MoneyBoxFinalWealthSerializer,
+    MoneyBoxSerializer,
+    MoneyBoxStatisticsSerializer,
+    MoneyBoxWealthSerializer,
+    MoneyBoxWithdrawalSerializer,
+    MoneyBoxWithWealthSerializer,
+)
 from rest_framework.response import Response
 
 
@@ -16,7 +41,50 @@ class MoneyBoxBrokenError(APIException):
     default_detail = 'This money box is broken you cannot use it anymore.'
 
 
+class MoneyBoxConditionalMixin:
+    """
+    Mixin answering the conditional requests of the money box views from the money box version.
+    """
+
+    def get_not_modified_response(self, request: HttpRequest, money_box: MoneyBox) -> Optional[HttpResponseBase]:
+        """
+        Answer a conditional request (If-None-Match / If-Modified-Since) from the money box version only,
+        without loading its contents. Conditional requests are ignored in the sharded and ledger deposit modes
+        because the deposits do not update the money box row.
+        Args:
+            request (HttpRequest): Django or DRF request object.
+            money_box (MoneyBox): MoneyBox instance.
+        Returns:
+            Optional[HttpResponseBase]: The 304 or 412 response, or None if the full response must be built.
+        """
+        if settings.MONEYBOX_DEPOSIT_MODE != MoneyBox.DepositModeChoice.ATOMIC:
+            return None
+        response = get_conditional_response(
+            request,
+            etag=money_box.etag,
+            last_modified=int(money_box.updated_at.timestamp()),
+        )
+        if response is None:
+            return None
+        return self.set_conditional_headers(response, money_box)
+
+    def set_conditional_headers(self, response: HttpResponseBase, money_box: MoneyBox) -> HttpResponseBase:
+        """
+        Set the ETag and Last-Modified headers of a response from the money box version.
+        Args:
+            response (HttpResponseBase): Django or DRF response object.
+            money_box (MoneyBox): MoneyBox instance.
+        Returns:
+            HttpResponseBase: The response object.
+        """
+        if settings.MONEYBOX_DEPOSIT_MODE == MoneyBox.DepositModeChoice.ATOMIC:
+            response.headers['ETag'] = money_box.etag
+            response.headers['Last-Modified'] = http_date(money_box.updated_at.timestamp())
+        return response
+
+
 class MoneyBoxViewSet(
+    MoneyBoxConditionalMixin,
     mixins.CreateModelMixin,
     mixins.RetrieveModelMixin,
     mixins.ListModelMixin,
@@ -26,7 +94,30 @@ class MoneyBoxViewSet(
     Viewset for managing moneyboxes and its cash content.
     """
 
-    queryset = MoneyBox.objects.all().order_by('-created_at')
+    queryset = MoneyBox.objects.all().order_by('-created_at', '-id')
+    pagination_class = MoneyBoxCursorPagination
+    filter_backends = [MoneyBoxFilter, MoneyBoxWealthFilter, MoneyBoxOrderingFilter]
+    ordering_fields = ['created_at', 'wealth']
+    ordering = ('-created_at', '-id')
+    # Read-only actions reading from a replica, see app.routers
+    replica_actions = {'list', 'retrieve', 'shake', 'statistics'}
+
+    def dispatch(self, request: HttpRequest, *args, **kwargs) -> HttpResponseBase:
+        """
+        Route the reads of the read-only actions to a replica, and make the client of a write read from
+        the default database for a while.
+        Args:
+            request (HttpRequest): Django request object.
+        Returns:
+            HttpResponseBase: The response object.
+        """
+        if self.action_map.get(request.method.lower()) in self.replica_actions:
+            with use_replica(request):
+                return super().dispatch(request, *args, **kwargs)
+        response = super().dispatch(request, *args, **kwargs)
+        if request.method not in SAFE_METHODS:
+            stick_to_primary(response)
+        return response
 
     def get_serializer_class(self) -> Union[MoneyBoxSerializer, MoneyBoxWealthSerializer]:
         """
@@ -36,6 +127,14 @@ class MoneyBoxViewSet(
         """
         if self.action in ['shake', 'save', 'break_moneybox']:
             return MoneyBoxWealthSerializer
+        if self.action == 'bulk_save':
+            return MoneyBoxBulkDepositSerializer
+        if self.action == 'statistics':
+            return MoneyBoxStatisticsSerializer
+        if self.action == 'withdraw':
+            return MoneyBoxWithdrawalSerializer
+        if self.action in ['list', 'retrieve'] and self.request is not None and is_wealth_included(self.request):
+            return MoneyBoxWithWealthSerializer
         return MoneyBoxSerializer
 
     def get_money_box(self, pk: int) -> MoneyBox:
@@ -46,25 +145,76 @@ class MoneyBoxViewSet(
         Returns:
             MoneyBox: MoneyBox instance.
         """
-        money_box = get_object_or_404(MoneyBox, id=pk)
+        try:
+            money_box = get_object_or_404(MoneyBox, id=pk)
+        except Http404:
+            if ArchivedMoneyBox.objects.filter(id=pk).exists():
+                raise MoneyBoxBrokenError
+            raise
         if money_box.broken:
             raise MoneyBoxBrokenError
         return money_box
 
+    def retrieve(self, request: Request, *args, **kwargs):
+        """
+        Retrieve the basic data of a MoneyBox instance, answering conditional requests with a 304.
+        The money boxes archived once broken are read from the archive.
+        Args:
+            request (Request): DRF request object.
+        Returns:
+            Response: DRF response object of MoneyBoxSerializer serialized.
+        """
+        try:
+            money_box = self.get_object()
+        except Http404:
+            money_box = ArchivedMoneyBox.get_money_box(kwargs[self.lookup_field])
+            if money_box is None:
+                raise
+        not_modified_response = self.get_not_modified_response(request, money_box)
+        if not_modified_response is not None:
+            return not_modified_response
+        serializer = self.get_serializer(money_box)
+        return self.set_conditional_headers(Response(serializer.data), money_box)
+
+    @swagger_auto_schema(manual_parameters=[IDEMPOTENCY_KEY_PARAMETER])
+    @idempotent
+    def create(self, request: Request, *args, **kwargs):
+        """
+        Create a MoneyBox instance.
+        Args:
+            request (Request): DRF request object.
+        Returns:
+            Response: DRF response object of MoneyBoxSerializer serialized.
+        """
+        return super().create(request, *args, **kwargs)
+
     @action(methods=['get'], detail=True)
     def shake(self, request: Request, pk: int):
         """
         Perform the 'shake' action on a MoneyBox instance, which retrieves its wealth.
+        Conditional requests are answered with a 304 without loading the contents.
         Args:
             request (Request): DRF request object.
             pk (int): Primary key of the MoneyBox instance.
         Returns:
             Response: DRF response object of MoneyBoxWealthSerializer serialized which contains wealth data.
         """
-        serializer = MoneyBoxWealthSerializer(self.get_money_box(pk))
-        return Response(serializer.data)
+        money_box = self.get_money_box(pk)
+        not_modified_response = self.get_not_modified_response(request, money_box)
+        if not_modified_response is not None:
+            return not_modified_response
+        wealth_data = wealth_cache.get(money_box)
+        cache_status = 'HIT'
+        if wealth_data is None:
+            wealth_data = MoneyBoxWealthSerializer(money_box).data
+            wealth_cache.set(money_box, wealth_data)
+            cache_status = 'MISS'
+        response = Response(wealth_data, headers={'X-Cache': cache_status})
+        return self.set_conditional_headers(response, money_box)
 
+    @swagger_auto_schema(manual_parameters=[IDEMPOTENCY_KEY_PARAMETER])
     @action(methods=['post'], detail=True)
+    @idempotent
     def save(self, request: Request, pk):
         """
         Perform the 'save' action on a MoneyBox instance, which adds cashes to it.
@@ -80,12 +230,158 @@ class MoneyBoxViewSet(
             # Map the errors to get the correct format
             errors = [error for error in cashes_to_add_serializer.errors if 'cashes' in error][0]
             return Response(errors, status=status.HTTP_400_BAD_REQUEST)
-        # Save moneybox content
-        money_box.save_money(cashes_to_add_serializer.data)
+        # Save moneybox content, the money box may have been broken since it was read
+        if not money_box.save_money(cashes_to_add_serializer.data):
+            raise MoneyBoxBrokenError
         serializer = MoneyBoxWealthSerializer(money_box)
+        # Write the new wealth data through to the cache for the next shakes
+        wealth_cache.set(money_box, serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    @swagger_auto_schema(manual_parameters=[IDEMPOTENCY_KEY_PARAMETER])
+    @action(methods=['post'], detail=False, url_name='bulk-save', url_path='save')
+    @idempotent
+    def bulk_save(self, request: Request):
+        """
+        Perform the 'save' action on several MoneyBox instances at once, each deposit is applied independently.
+        Args:
+            request (Request): DRF request object.
+        Returns:
+            Response: DRF response object with the wealth data, or the errors, of each deposit in the payload order.
+        """
+        bulk_deposit_serializer = MoneyBoxBulkDepositSerializer(data=request.data)
+        bulk_deposit_serializer.is_valid(raise_exception=True)
+        deposit_serializers = [
+            MoneyBoxDepositSerializer(data=deposit) for deposit in bulk_deposit_serializer.validated_data['deposits']
+        ]
+        valid_deposit_serializers = [
+            deposit_serializer for deposit_serializer in deposit_serializers if deposit_serializer.is_valid()
+        ]
+        # Check all the money boxes in a single query
+        money_box_ids = {serializer.validated_data['moneybox_id'] for serializer in valid_deposit_serializers}
+        broken_by_money_box = dict(MoneyBox.objects.filter(id__in=money_box_ids).values_list('id', 'broken'))
+        # The archived money boxes are broken, the archive is only read for the money boxes missing
+        missing_money_box_ids = money_box_ids - broken_by_money_box.keys()
+        if missing_money_box_ids:
+            broken_by_money_box.update(dict.fromkeys(
+                ArchivedMoneyBox.objects.filter(id__in=missing_money_box_ids).values_list('id', flat=True), True,
+            ))
+        results = []
+        cashes_to_add_by_money_box = defaultdict(list)
+        for deposit_serializer in deposit_serializers:
+            if deposit_serializer.errors:
+                results.append({
+                    'moneybox_id': deposit_serializer.initial_data.get('moneybox_id'),
+                    'errors': deposit_serializer.errors,
+                })
+                continue
+            money_box_id = deposit_serializer.validated_data['moneybox_id']
+            if money_box_id not in broken_by_money_box:
+                results.append({'moneybox_id': money_box_id, 'errors': {'detail': NotFound.default_detail}})
+            elif broken_by_money_box[money_box_id]:
+                results.append({'moneybox_id': money_box_id, 'errors': {'detail': MoneyBoxBrokenError.default_detail}})
+            else:
+                results.append({'moneybox_id': money_box_id})
+                cashes_to_add_by_money_box[money_box_id].extend(deposit_serializer.to_cashes_to_add())
+        if not cashes_to_add_by_money_box:
+            return Response({'results': results}, status=status.HTTP_400_BAD_REQUEST)
+
+        # The money boxes broken since they were checked are skipped
+        skipped_money_box_ids = MoneyBox.bulk_save_money(cashes_to_add_by_money_box)
+        money_boxes = MoneyBox.objects.filter(id__in=cashes_to_add_by_money_box).prefetch_related(
+            MoneyBox.ordered_contents_prefetch()
+        ).in_bulk()
+        for result in results:
+            if 'errors' in result:
+                continue
+            if result['moneybox_id'] in skipped_money_box_ids:
+                result['errors'] = {'detail': MoneyBoxBrokenError.default_detail}
+            else:
+                result.update(MoneyBoxWealthSerializer(money_boxes[result['moneybox_id']]).data)
+        if skipped_money_box_ids >= cashes_to_add_by_money_box.keys():
+            return Response({'results': results}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'results': results}, status=status.HTTP_201_CREATED)
+
+    @swagger_auto_schema(responses={200: MoneyBoxStatisticsSerializer()})
+    @action(methods=['get'], detail=False, filter_backends=[], pagination_class=None)
+    def statistics(self, request: Request):
+        """
+        Retrieve the total wealth of each currency and the amount of each cash held by all the money boxes,
+        read from the cash rollups so it does not depend on the number of money boxes.
+        The deposits not compacted yet in the sharded and ledger deposit modes are not counted.
+        Args:
+            request (Request): DRF request object.
+        Returns:
+            Response: DRF response object of MoneyBoxStatisticsSerializer serialized.
+        """
+        return Response(MoneyBoxStatisticsSerializer(CashRollup.get_statistics()).data)
+
+    @swagger_auto_schema(
+        manual_parameters=[openapi.Parameter(
+            'file_format',
+            openapi.IN_QUERY,
+            description='Format of the export.',
+            type=openapi.TYPE_STRING,
+            enum=list(EXPORTERS),
+            default='ndjson',
+        )],
+        responses={200: 'The money boxes, one per line in NDJSON or one per cash in CSV.'},
+    )
+    @action(methods=['get'], detail=False, filter_backends=[], pagination_class=None)
+    def export(self, request: Request):
+        """
+        Export every money box with its contents and wealth, as NDJSON or CSV depending on the file_format
+        query parameter, streamed while it is read from the database, through an async iterator under ASGI.
+        The broken money boxes already archived are not exported.
+        Args:
+            request (Request): DRF request object.
+        Returns:
+            StreamingHttpResponse: Django streaming response of the export.
+        """
+        file_format = request.query_params.get('file_format', 'ndjson')
+        if file_format not in EXPORTERS:
+            raise ValidationError({'file_format': f'Choose one of: {", ".join(EXPORTERS)}.'})
+        export = EXPORTERS[file_format]()
+        if isinstance(request._request, ASGIRequest):
+            export = aiter_export(export)
+        return StreamingHttpResponse(
+            export,
+            content_type=EXPORT_CONTENT_TYPES[file_format],
+            headers={'Content-Disposition': f'attachment; filename="moneyboxes.{file_format}"'},
+        )
+
+    @swagger_auto_schema(
+        request_body=MoneyBoxWithdrawalSerializer,
+        responses={200: MoneyBoxWithdrawalSerializer()},
+        manual_parameters=[IDEMPOTENCY_KEY_PARAMETER],
+    )
+    @action(methods=['post'], detail=True)
+    @idempotent
+    def withdraw(self, request: Request, pk):
+        """
+        Perform the 'withdraw' action on a MoneyBox instance, which removes an amount from its contents
+        with as few cashes as possible.
+        Args:
+            request (Request): DRF request object.
+            pk (int): Primary key of the MoneyBox instance.
+        Returns:
+            Response: DRF response object of MoneyBoxWithdrawalSerializer serialized which contains the amount
+            and the cashes withdrawn.
+        """
+        money_box = self.get_money_box(pk)
+        withdrawal_serializer = MoneyBoxWithdrawalSerializer(data=request.data)
+        withdrawal_serializer.is_valid(raise_exception=True)
+        amount = withdrawal_serializer.validated_data['amount']
+        cashes_withdrawn = money_box.withdraw_money(Cash.to_minor_units(amount))
+        if cashes_withdrawn is None:
+            if money_box.broken:
+                raise MoneyBoxBrokenError
+            raise ValidationError({'amount': 'This amount cannot be made from the cashes of this money box.'})
+        return Response(MoneyBoxWithdrawalSerializer({'amount': amount, 'cashes': cashes_withdrawn}).data)
+
+    @swagger_auto_schema(manual_parameters=[IDEMPOTENCY_KEY_PARAMETER])
     @action(methods=['delete'], detail=True, url_name='break', url_path='break')
+    @idempotent
     def break_moneybox(self, request: Request, pk):
         """
         Perform the 'break' action on a MoneyBox instance, which deletes all its contents and marks it as broken.
@@ -93,10 +389,9 @@ class MoneyBoxViewSet(
             request (Request): DRF request object.
             pk (int): Primary key of the MoneyBox instance.
         Returns:
-            Response: DRF response object of MoneyBoxWealthSerializer serialized which contains wealth data.
+            Response: DRF response object of MoneyBoxFinalWealthSerializer serialized which contains the wealth data
+            of the contents deleted.
         """
         money_box = self.get_money_box(pk)
-        serializer = MoneyBoxWealthSerializer(money_box)
-        wealth_data = serializer.data
         money_box.break_moneybox()
-        return Response(wealth_data)
+        return Response(MoneyBoxFinalWealthSerializer(money_box).data)
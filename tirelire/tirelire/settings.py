@@ -50,7 +50,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'djangorestframework_camel_case.middleware.CamelCaseMiddleWare',
+    'app.middleware.CamelCaseMiddleware',
+    'app.middleware.RequestMetricsMiddleware',
 ]
 
 ROOT_URLCONF = 'tirelire.urls'
@@ -88,6 +89,15 @@ DATABASES = {
     }
 }
 
+# Aliases of the read replicas of the default database in DATABASES, the read-only actions of the money box views read
+# from one of them picked at random while the other actions read and write on the default database
+DATABASE_REPLICAS = []
+DATABASE_ROUTERS = ['app.routers.ReplicaRouter']
+# Seconds during which the client of a write keeps reading from the default database, so it reads its own writes
+# despite the replication lag, tracked with a cookie expiring at the end of the window
+DATABASE_REPLICA_STICKINESS_SECONDS = 5
+DATABASE_REPLICA_STICKINESS_COOKIE = 'moneybox_primary'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -130,16 +140,103 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Cache used to share state between the workers, use a shared backend (e.g. Redis or Memcached) in production
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # The local memory backend evicts the least recently used entries once MAX_ENTRIES is reached
+    'moneybox-wealth': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'moneybox-wealth',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+    # Responses of the requests sent with an idempotency key, kept for TIMEOUT seconds, the backend must be shared
+    # by the workers (e.g. Redis) for a retry reaching another worker to be replayed
+    'moneybox-idempotency': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'moneybox-idempotency',
+        'TIMEOUT': 24 * 60 * 60,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+}
+
+# Cache of the wealth responses of the money boxes
+MONEYBOX_WEALTH_CACHE_ALIAS = 'moneybox-wealth'
+# Seconds between two additions of the hits and misses of a worker to the counters shared in the wealth cache
+MONEYBOX_WEALTH_CACHE_STATS_FLUSH_INTERVAL = 10
+
+# Cache storing the responses of the mutating money box actions sent with an Idempotency-Key header
+MONEYBOX_IDEMPOTENCY_CACHE_ALIAS = 'moneybox-idempotency'
+# Seconds a request holds its idempotency key at most, longer than the slowest mutating request
+MONEYBOX_IDEMPOTENCY_LOCK_TIMEOUT = 30
+# Seconds a concurrent duplicate waits for the response of the request holding its key before getting a 409
+MONEYBOX_IDEMPOTENCY_WAIT_TIMEOUT = 10
+
+# Maximum number of seconds a worker serves its cash registry before checking the shared version stamp
+CASH_REGISTRY_CHECK_INTERVAL = 1
+
+# Default and maximum number of money boxes returned per page by the list endpoint
+MONEYBOX_PAGE_SIZE = 50
+MONEYBOX_MAX_PAGE_SIZE = 500
+
+# Maximum number of deposits accepted in a single request by the bulk save endpoint
+MONEYBOX_BULK_SAVE_MAX_DEPOSITS = 1000
+
+# Number of rows fetched at once by the money box exports, through a server-side cursor on PostgreSQL
+MONEYBOX_EXPORT_CHUNK_SIZE = 2000
+
+# Number of rows loaded per transaction by the money box imports, with COPY on PostgreSQL
+MONEYBOX_IMPORT_BATCH_SIZE = 10000
+
+# Number of broken money boxes moved per transaction to the archive by the archive_moneyboxes management command
+MONEYBOX_ARCHIVE_BATCH_SIZE = 1000
+
+# How deposits are written: 'atomic' increments the money box rows with database-side atomic increments,
+# 'sharded' spreads them on MONEYBOX_COUNTER_SHARDS counter rows per cash for hot money boxes, those rows are summed
+# on read and must be compacted periodically with the compact_moneybox_counters management command, 'ledger' appends
+# them to the Deposit ledger whose uncompacted tail is summed on read and compacted by the same command
+MONEYBOX_DEPOSIT_MODE = 'atomic'
+MONEYBOX_COUNTER_SHARDS = 8
+
+# Per request SQL and timing metrics sent in a Server-Timing header, the middleware is unloaded when disabled
+REQUEST_METRICS_ENABLED = DEBUG
+
+# Maximum number of SQL queries expected per view name, a warning is logged on the 'app.middleware' logger when a
+# request exceeds it, the default budget applies to the other views (None for no budget)
+REQUEST_METRICS_QUERY_BUDGETS = {
+    'api:moneyboxes-list': 2,
+    'api:moneyboxes-detail': 1,
+    'api:moneyboxes-shake': 2,
+    'api:moneyboxes-save': 8,
+    'api:moneyboxes-bulk-save': 8,
+    'api:moneyboxes-break': 8,
+    'api:moneyboxes-withdraw': 11,
+    'api:moneyboxes-statistics': 1,
+}
+REQUEST_METRICS_DEFAULT_QUERY_BUDGET = None
+
+# Maximum number of keys memoized by each direction of the camelCase translation of the JSON renderer, parser and
+# query string middleware, the API only uses a few dozen keys
+JSON_CAMEL_CASE_KEY_CACHE_SIZE = 1024
+
 REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'rest_framework.schemas.coreapi.AutoSchema',
     'DEFAULT_RENDERER_CLASSES': (
-        'djangorestframework_camel_case.render.CamelCaseJSONRenderer',
+        'app.renderers.CamelCaseORJSONRenderer',
         'djangorestframework_camel_case.render.CamelCaseBrowsableAPIRenderer',
     ),
     'DEFAULT_PARSER_CLASSES': (
         'djangorestframework_camel_case.parser.CamelCaseFormParser',
         'djangorestframework_camel_case.parser.CamelCaseMultiPartParser',
-        'djangorestframework_camel_case.parser.CamelCaseJSONParser',
+        'app.parsers.CamelCaseORJSONParser',
     ),
     'EXCEPTION_HANDLER': 'rest_framework.views.exception_handler'
 }
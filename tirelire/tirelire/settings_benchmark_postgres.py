@@ -0,0 +1,20 @@
+"""
+Settings profile running the benchmarks on the local Postgres database of docker-compose.
+"""
+
+from tirelire.settings import *  # noqa: F401, F403
+
+DEBUG = False
+
+REQUEST_METRICS_ENABLED = False
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.postgresql_psycopg2',
+        'NAME': 'money_box',
+        'USER': 'money_box',
+        'PASSWORD': 'money_box',
+        'HOST': 'localhost',
+        'PORT': '5433',
+    }
+}
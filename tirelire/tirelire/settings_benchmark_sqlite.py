@@ -0,0 +1,16 @@
+"""
+Settings profile running the benchmarks on a local SQLite database.
+"""
+
+from tirelire.settings import *  # noqa: F401, F403
+
+DEBUG = False
+
+REQUEST_METRICS_ENABLED = False
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'benchmark.sqlite3',  # noqa: F405
+    }
+}
@@ -0,0 +1,22 @@
+"""
+Settings profile running the application on two local SQLite databases, the second one standing in for a read replica
+of the first one, e.g. python -m pytest --ds tirelire.settings_replica_sqlite to run the replica routing tests.
+Nothing copies the rows of the default database to the replica. DATABASE_REPLICAS is left empty so the other tests
+read their writes, the replica routing tests enable it.
+"""
+
+from tirelire.settings import *  # noqa: F401, F403
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db.sqlite3',  # noqa: F405
+    },
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'replica.sqlite3',  # noqa: F405
+        # The test replica gets its tables from the models instead of the migrations, whose data migrations would
+        # write into the default database through the router
+        'TEST': {'MIGRATE': False},
+    },
+}